@@ -0,0 +1,216 @@
+"""
+Converting all .seq files of directories or glob patterns to .jpg and/or .tiff frames with one pool of workers.
+Frames of every file are saved like seq_to_jpg.py and seq_to_tiff.py do: `<name>/jpg_frames`, `<name>/tiff_frames`
+next to the .seq file (or in the output directory, at the same path relative to the common directory of the files).
+The frame index of every file is saved to `<name>/<name>.seq.idx`, so the dirs of the .seq files are not written to
+when there is an output directory.
+Timings and failures of every file are written to a JSON report
+"""
+import os
+import argparse
+
+from typing import Dict
+from typing import List
+from typing import Optional
+
+from fe_tools import profiling
+from fe_tools.seq import Seq
+from fe_tools.batch import convert_seqs
+from fe_tools.batch import find_seq_files
+from fe_tools.fff_tools import get_thermal_image
+from fe_tools.encoding import ENCODINGS
+from fe_tools.units import UNITS
+from fe_tools.units import get_is_celsius
+from fe_tools.units import get_unit_is_celsius
+
+from seq_to_jpg import thermal2jpg
+from seq_to_tiff import thermal2tiff
+from seq_to_tiff import get_tiff_encoding
+
+
+def main():
+    args = parse_args()
+    if args.profile or args.profile_trace is not None:
+        profiling.enable(is_trace=args.profile_trace is not None)
+    unit_is_celsius = get_unit_is_celsius(args.unit, args.is_celsius)
+    report = batch_convert(
+            args.inputs, args.min_thr, args.max_thr, unit_is_celsius, args.formats, args.output_dir, args.workers,
+            args.max_worker_memory, args.report, args.encoding
+    )
+    print(f"Converted {report['converted']} of {report['frames']} frames of {len(report['files'])} files "
+          f"in {report['elapsed_time']:.1f} s ({report['frames_per_second']:.1f} frames/s), "
+          f"{report['failed']} frames and {report['failed_files']} files failed. Report: {args.report}")
+    profiling.save_profile(args.profile_trace)
+
+
+def batch_convert(
+        inputs: List[str],
+        min_thr: float,
+        max_thr: float,
+        is_celsius: Optional[bool] = None,
+        formats: List[str] = ("jpg", "tiff"),
+        output_dir: str = None,
+        workers: int = None,
+        max_worker_memory: float = None,
+        report_path: str = "batch_report.json",
+        encoding: str = "float64",
+) -> dict:
+    """
+    Saves frames of all .seq files into .jpg and/or .tiff files
+    :param inputs: directories (searched recursively), glob patterns or .seq files
+    :param min_thr: min temperature threshold of capturing
+    :param max_thr: max temperature threshold of capturing
+    :param is_celsius: if temperature in .seq files is in celsius, None to detect it for every file
+    :param formats: "jpg" and/or "tiff"
+    :param output_dir: dir for the outputs, next to the .seq files by default
+    :param workers: number of worker processes, all CPUs by default
+    :param max_worker_memory: memory (in MB) of a worker above which it drops its caches,
+    workers still above it are restarted
+    :param report_path: path to .json report
+    :param encoding: type of the temperatures saved to .tiff, see fe_tools.encoding
+    :return: report
+    """
+    seq_paths = find_seq_files(inputs)
+    folders = get_output_folders(seq_paths, output_dir)
+    print(f"Converting {len(seq_paths)} files...")
+    for folder in folders.values():
+        for fmt in formats:
+            os.makedirs(f"{folder}/{fmt}_frames", exist_ok=True)
+
+    def file_args(seq: Seq) -> tuple:
+        return get_is_celsius(seq, min_thr, max_thr, is_celsius), folders[seq.input_file]
+
+    def index_file(seq_path: str) -> str:
+        return os.path.join(folders[seq_path], f"{os.path.basename(seq_path)}.idx")
+
+    return convert_seqs(
+            seq_paths, convert_frame, (min_thr, max_thr, tuple(formats), encoding), file_args, workers,
+            max_worker_memory, report_path=report_path, index_file=index_file
+    )
+
+
+def convert_frame(
+        frame_bytes: bytes,
+        frame_id: int,
+        seq_path: str,
+        min_thr: float,
+        max_thr: float,
+        formats: tuple,
+        encoding: str,
+        is_celsius: bool,
+        folder: str,
+) -> None:
+    """ Decodes the frame once and saves it in all formats to the output folder of the file """
+    thermal_image = get_thermal_image(frame_bytes, is_celsius=is_celsius)
+    file_basename = os.path.basename(folder)
+    if "jpg" in formats:
+        jpg_bytes = thermal2jpg(thermal_image, min_thr, max_thr)
+        with profiling.span("write.jpg"):
+            with open(f"{folder}/jpg_frames/{file_basename}_{frame_id:04d}.jpg", "wb") as jpg_file:
+                jpg_file.write(jpg_bytes)
+        profiling.count("bytes_written", len(jpg_bytes))
+    if "tiff" in formats:
+        tiff_encoding = get_tiff_encoding(encoding, min_thr, max_thr, is_celsius)
+        tiff_bytes = thermal2tiff(thermal_image, min_thr, max_thr, is_celsius, tiff_encoding)
+        with profiling.span("write.tiff"):
+            with open(f"{folder}/tiff_frames/{file_basename}_{frame_id:04d}.tiff", "wb") as tiff_file:
+                tiff_file.write(tiff_bytes)
+        profiling.count("bytes_written", len(tiff_bytes))
+
+
+def get_output_folders(seq_paths: List[str], output_dir: str = None) -> Dict[str, str]:
+    """
+    Output folders of the SEQ files, `<name>` next to the .seq file or in the output dir.
+    The output dir mirrors the dirs of the files relative to their common dir,
+    so files with the same name in different dirs are not saved to the same folder
+    :param seq_paths: paths to .seq files
+    :param output_dir: dir for the outputs, next to the .seq files by default
+    :return: SEQ path -> output folder
+    """
+    folders = {seq_path: os.path.splitext(seq_path)[0] for seq_path in seq_paths}
+    if output_dir is not None and len(seq_paths) > 0:
+        root_dir = os.path.commonpath([os.path.dirname(os.path.abspath(seq_path)) for seq_path in seq_paths])
+        for seq_path, folder in folders.items():
+            folders[seq_path] = os.path.join(output_dir, os.path.relpath(os.path.abspath(folder), root_dir))
+    seq_paths_by_folder = {}
+    for seq_path, folder in folders.items():
+        seq_paths_by_folder.setdefault(os.path.normcase(os.path.abspath(folder)), []).append(seq_path)
+    for same_folder_paths in seq_paths_by_folder.values():
+        if len(same_folder_paths) > 1:
+            raise ValueError(f"Files {', '.join(same_folder_paths)} would be saved to the same folder")
+    return folders
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Converts .seq files of directories to .jpg and .tiff files")
+    parser.add_argument("min_thr", type=float, help="Min temperature threshold of capturing")
+    parser.add_argument("max_thr", type=float, help="Max temperature threshold of capturing")
+    parser.add_argument("inputs", type=str, nargs="+", help="Directories, glob patterns or .seq files")
+    parser.add_argument(
+            "--formats",
+            choices=["jpg", "tiff"],
+            nargs="+",
+            help="Formats of the frames",
+            default=["jpg", "tiff"]
+    )
+    parser.add_argument(
+            "--celsius",
+            dest="is_celsius",
+            action="store_true",
+            help="Temperature in celsius in the .seq files (the same as --unit celsius)",
+            default=False
+    )
+    parser.add_argument(
+            "--unit",
+            choices=UNITS,
+            help="Unit of measurement of the .seq files, detected for every file by default",
+            default="auto"
+    )
+    parser.add_argument(
+            "--encoding",
+            choices=list(ENCODINGS),
+            help="Type of the temperatures saved to .tiff, see seq_to_tiff.py",
+            default="float64"
+    )
+    parser.add_argument(
+            "--output-dir",
+            type=str,
+            help="Directory for the outputs, next to the .seq files by default",
+            default=None
+    )
+    parser.add_argument(
+            "--workers",
+            type=int,
+            help="Number of worker processes, all CPUs by default",
+            default=None
+    )
+    parser.add_argument(
+            "--max-worker-memory",
+            type=float,
+            help="Memory (in MB) of a worker above which it drops its caches, workers still above it are restarted",
+            default=None
+    )
+    parser.add_argument(
+            "--report",
+            type=str,
+            help="Path to the JSON report",
+            default="batch_report.json"
+    )
+    parser.add_argument(
+            "--profile",
+            action="store_true",
+            help="Print the time spent in the stages of the conversion (summed over the workers)",
+            default=False
+    )
+    parser.add_argument(
+            "--profile-trace",
+            type=str,
+            help="Also save the profile and its timeline as JSON (chrome://tracing), implies --profile",
+            default=None
+    )
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Micro-benchmark of the raw to temperature conversion of one frame:
+np.vectorize(_raw2temperature) against the array engine raw2temperature and the lookup table
+"""
+import argparse
+import timeit
+import numpy as np
+
+from fe_tools.fff_tools import get_meta
+from fe_tools.fff_tools import raw2temperature
+from fe_tools.fff_tools import raw2temperature_lut
+from fe_tools.fff_tools import get_raw_image_np
+from fe_tools.fff_tools import _extract_float
+from fe_tools.fff_tools import _raw2temperature
+
+
+def main():
+    args = parse_args()
+    meta = get_meta(args.input_file)
+    raw_image = get_raw_image_np(args.input_file)
+    params = (
+        meta['PlanckR1'],
+        meta['PlanckR2'],
+        meta['PlanckB'],
+        meta['PlanckO'],
+        meta['PlanckF'],
+        meta['Emissivity'],
+        _extract_float(meta['ReflectedApparentTemperature']),
+    )
+    out = np.empty(raw_image.shape, dtype=np.float32)
+
+    cases = {
+        "np.vectorize(_raw2temperature)": lambda: np.vectorize(_raw2temperature)(raw_image, *params),
+        "raw2temperature float64": lambda: raw2temperature(raw_image, *params),
+        "raw2temperature float32": lambda: raw2temperature(raw_image, *params, dtype=np.float32),
+        "raw2temperature float32 out=": lambda: raw2temperature(raw_image, *params, out=out),
+        "raw2temperature_lut float64": lambda: raw2temperature_lut(raw_image, *params),
+        "raw2temperature_lut float32 out=": lambda: raw2temperature_lut(raw_image, *params, out=out),
+    }
+    print(f"Frame {raw_image.shape[1]}x{raw_image.shape[0]}, best of {args.repeat}:")
+    base_time = None
+    for name, case in cases.items():
+        number = 1 if base_time is None else 10
+        frame_time = min(timeit.repeat(case, number=number, repeat=args.repeat)) / number
+        base_time = base_time or frame_time
+        print(f"{name:32s} {frame_time * 1000:9.2f} ms/frame  x{base_time / frame_time:.1f}")
+
+    reference = np.vectorize(_raw2temperature)(raw_image, *params)
+    result = raw2temperature(raw_image, *params)
+    print(f"Max abs difference with _raw2temperature: {np.max(np.abs(result - reference)):.3g}")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark of the raw to temperature conversion")
+    parser.add_argument("input_file", type=str, nargs="?", default="bin/examples/frame.fff", help="Input .fff file")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of repeats")
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+"""
+Benchmark of the hot path on a synthetic .seq file made from the sample frame (see fe_tools.synthetic).
+Every stage runs over all frames: indexing in Seq, raw extraction, calibration, temperature conversion,
+the whole get_thermal_image, rendering, .jpg and .tiff writing.
+Every stage runs in a new process on frames read from the memory-mapped file, frames/s, MB/s (of the stage input,
+of the written files for the writers), the peak RSS of the process and its growth during the stage are printed as JSON.
+With --baseline the run fails if a stage is slower than the baseline by more than --tolerance.
+Startup of the short jobs (`python -m fe_tools ...` in a new interpreter) is timed too, the run fails if it is over
+STARTUP_BUDGETS
+"""
+import os
+import cv2
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+import multiprocessing
+import numpy as np
+import tifffile as tiff
+
+from typing import Callable
+
+from fe_tools import synthetic
+from fe_tools import fff_parser
+from fe_tools.seq import Seq
+from fe_tools.render import FrameRenderer
+from fe_tools.fff_tools import get_calibration
+from fe_tools.fff_tools import get_thermal_image
+from fe_tools.fff_tools import raw2temperature_lut
+
+
+# Commands timed from the start of the interpreter to exit, and their max seconds (the best of STARTUP_RUNS runs)
+STARTUP_COMMANDS = {
+    "cli_help": ["-m", "fe_tools", "--help"],
+    "tiff_help": ["-m", "fe_tools", "tiff", "--help"],
+    "import_fff_tools": ["-c", "import fe_tools.fff_tools"],
+}
+STARTUP_BUDGETS = {
+    "cli_help": 0.2,
+    "tiff_help": 0.6,
+    "import_fff_tools": 0.5,
+}
+STARTUP_RUNS = 5
+
+STAGES = ("index", "raw", "calibration", "convert", "thermal", "render", "jpg", "tiff")
+
+
+def main():
+    args = parse_args()
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="fe_tools_benchmark_")
+    os.makedirs(work_dir, exist_ok=True)
+    try:
+        results = run_benchmark(work_dir, args.frames, args.width, args.height, args.template)
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir)
+
+    results["startup"] = time_startup()
+
+    results_json = json.dumps(results, indent=2)
+    print(results_json)
+    if args.output is not None:
+        with open(args.output, "w") as output_file:
+            output_file.write(results_json)
+    regressions = find_startup_overruns(results["startup"])
+    if args.baseline is not None:
+        with open(args.baseline, "r") as baseline_file:
+            regressions += find_regressions(results, json.load(baseline_file), args.tolerance)
+    for regression in regressions:
+        print(f"Regression: {regression}", file=sys.stderr)
+    if len(regressions) > 0:
+        sys.exit(1)
+
+
+def run_benchmark(work_dir: str, n_frames: int, width: int, height: int, template_path: str) -> dict:
+    """
+    Make the synthetic .seq file in work_dir and time the stages on it
+    :param work_dir: dir for the .seq file and the written frames
+    :param n_frames: number of frames
+    :param width: width of the frames
+    :param height: height of the frames
+    :param template_path: path to the sample .fff image
+    :return: configuration and results of the stages
+    """
+    seq_path = os.path.join(work_dir, "synthetic.seq")
+    seq_size = synthetic.make_seq(seq_path, n_frames, width, height, template_path)
+    # A new process per stage, so the peak memory of a stage is its own
+    stages = {}
+    with multiprocessing.get_context("spawn").Pool(1, maxtasksperchild=1) as pool:
+        for name in STAGES:
+            stages[name] = pool.apply(run_stage, (name, seq_path, work_dir, n_frames, width, height))
+
+    return {
+        "config": {
+            "frames": n_frames,
+            "width": width,
+            "height": height,
+            "seq_mb": seq_size / 2 ** 20,
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+        },
+        "stages": stages,
+        "peak_rss_mb": max(stage["peak_rss_mb"] for stage in stages.values()),
+    }
+
+
+def run_stage(name: str, seq_path: str, work_dir: str, n_frames: int, width: int, height: int) -> dict:
+    """
+    Time the stage in the current process, frames are read from the memory-mapped file as the stage goes
+    :param name: one of STAGES
+    :param seq_path: path to the synthetic .seq file
+    :param work_dir: dir for the written frames
+    :param n_frames: number of frames
+    :param width: width of the frames
+    :param height: height of the frames
+    :return: results of the stage
+    """
+    seq_mb = os.path.getsize(seq_path) / 2 ** 20
+    frame_mb = width * height * 2 / 2 ** 20
+    # The file stays open until the process ends, memoryviews of the last frame may be alive
+    seq = Seq(seq_path, use_mmap=True)
+    if name == "index":
+        def index():
+            with Seq(seq_path, use_mmap=True) as index_seq:
+                len(index_seq)
+        return time_stage(index, n_frames, seq_mb)
+    len(seq)
+    if name == "raw":
+        def raw():
+            for frame_bytes in seq:
+                fff_parser.get_raw_image_np(frame_bytes)
+        return time_stage(raw, n_frames, seq_mb)
+    if name == "calibration":
+        def calibration():
+            for frame_bytes in seq:
+                get_calibration(frame_bytes)
+        return time_stage(calibration, n_frames, seq_mb)
+    if name == "thermal":
+        def thermal():
+            for frame_bytes in seq:
+                get_thermal_image(frame_bytes)
+        return time_stage(thermal, n_frames, seq_mb)
+
+    raw_image = fff_parser.get_raw_image_np(seq[0])
+    calibration_params = get_calibration(seq[0])
+    thermal_image = np.empty(raw_image.shape, dtype=np.float64)
+    # Build the lookup table outside of the timing
+    raw2temperature_lut(raw_image, *calibration_params, out=thermal_image)
+    if name == "convert":
+        def convert():
+            for _ in range(n_frames):
+                raw2temperature_lut(raw_image, *calibration_params, out=thermal_image)
+        return time_stage(convert, n_frames, n_frames * frame_mb)
+
+    renderer = FrameRenderer()
+    if name == "render":
+        def render():
+            for _ in range(n_frames):
+                renderer.gray(thermal_image, 0, 500)
+        return time_stage(render, n_frames, n_frames * frame_mb * 4)
+
+    frames_dir = os.path.join(work_dir, f"{name}_frames")
+    os.makedirs(frames_dir, exist_ok=True)
+    if name == "jpg":
+        gray_img = renderer.gray(thermal_image, 0, 500).copy()
+
+        def write_jpg():
+            for frame_id in range(n_frames):
+                cv2.imwrite(os.path.join(frames_dir, f"{frame_id:04d}.jpg"), gray_img)
+        return time_stage(write_jpg, n_frames, lambda: get_dir_size(frames_dir) / 2 ** 20)
+    if name == "tiff":
+        def write_tiff():
+            for frame_id in range(n_frames):
+                tiff.imwrite(os.path.join(frames_dir, f"{frame_id:04d}.tiff"), thermal_image, photometric="minisblack")
+        return time_stage(write_tiff, n_frames, lambda: get_dir_size(frames_dir) / 2 ** 20)
+    raise ValueError(f"Unknown stage {name}, expected one of {STAGES}")
+
+
+def time_stage(stage: Callable, n_frames: int, data_mb) -> dict:
+    """
+    Time the stage
+    :param stage: function processing all frames
+    :param n_frames: number of frames
+    :param data_mb: MB processed by the stage, or a function returning them after the stage
+    :return: results of the stage
+    """
+    rss_mb = get_rss()
+    start_time = time.perf_counter()
+    stage()
+    seconds = time.perf_counter() - start_time
+    data_mb = data_mb() if callable(data_mb) else data_mb
+    peak_rss_mb = get_peak_rss()
+    return {
+        "seconds": seconds,
+        "frames_per_second": n_frames / seconds,
+        "mb_per_second": data_mb / seconds,
+        "peak_rss_mb": peak_rss_mb,
+        "rss_growth_mb": max(peak_rss_mb - rss_mb, 0.0),
+    }
+
+
+def time_startup() -> dict:
+    """ Best seconds of STARTUP_RUNS runs of every startup command in a new interpreter """
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    startup = {}
+    for name, command in STARTUP_COMMANDS.items():
+        seconds = []
+        for _ in range(STARTUP_RUNS):
+            start_time = time.perf_counter()
+            subprocess.run([sys.executable, *command], cwd=repo_dir, stdout=subprocess.DEVNULL, check=True)
+            seconds.append(time.perf_counter() - start_time)
+        startup[name] = {"seconds": min(seconds), "budget_seconds": STARTUP_BUDGETS[name]}
+    return startup
+
+
+def find_startup_overruns(startup: dict) -> list:
+    """ Startup commands slower than their budget """
+    return [
+        f"startup of {name}: {command['seconds']:.3f} s, budget {command['budget_seconds']:.3f} s"
+        for name, command in startup.items() if command["seconds"] > command["budget_seconds"]
+    ]
+
+
+def find_regressions(results: dict, baseline: dict, tolerance: float) -> list:
+    """ Stages whose frames/s dropped below (1 - tolerance) of the baseline """
+    regressions = []
+    for name, stage in results["stages"].items():
+        baseline_stage = baseline.get("stages", {}).get(name)
+        if baseline_stage is None:
+            continue
+        if stage["frames_per_second"] < (1 - tolerance) * baseline_stage["frames_per_second"]:
+            regressions.append(
+                    f"{name}: {stage['frames_per_second']:.1f} frames/s, "
+                    f"baseline {baseline_stage['frames_per_second']:.1f} frames/s"
+            )
+    return regressions
+
+
+def get_peak_rss() -> float:
+    """ Peak resident memory of the process in MB """
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, KB on Linux
+    return max_rss / 2 ** 20 if sys.platform == "darwin" else max_rss / 2 ** 10
+
+
+def get_rss() -> float:
+    """ Resident memory of the process in MB, the peak if the current one is unknown (not on Linux) """
+    try:
+        with open("/proc/self/statm", "r") as statm_file:
+            resident_pages = int(statm_file.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return get_peak_rss()
+    return resident_pages * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+
+
+def get_dir_size(path: str) -> int:
+    return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark of the stages of .seq conversion on a synthetic .seq file")
+    parser.add_argument("--frames", type=int, default=100, help="Number of frames")
+    parser.add_argument("--width", type=int, default=640, help="Width of the frames")
+    parser.add_argument("--height", type=int, default=480, help="Height of the frames")
+    parser.add_argument("--template", type=str, default=synthetic.SAMPLE_FFF_PATH, help="Sample .fff file")
+    parser.add_argument("--work-dir", type=str, default=None, help="Dir for the files, a temporary one by default")
+    parser.add_argument("--output", type=str, default=None, help="Path to save the results as JSON")
+    parser.add_argument("--baseline", type=str, default=None, help="Results of a previous run to compare with")
+    parser.add_argument(
+            "--tolerance",
+            type=float,
+            default=0.2,
+            help="Allowed relative drop of frames/s against the baseline"
+    )
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    main()
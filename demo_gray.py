@@ -1,6 +1,5 @@
 import os
 import cv2
-import shutil
 import numpy as np
 import tifffile as tiff
 
@@ -8,8 +7,14 @@ from glob import glob
 from tqdm import tqdm
 
 from fe_tools.seq import Seq
+from fe_tools.sinks import ChunkedSink
+from fe_tools.render import FrameRenderer
+from fe_tools.encoding import get_encoding
 from fe_tools.fff_tools import get_thermal_image
-from fe_tools.fff_tools import get_thermal_image_vis_gray
+
+
+# Type of the thermal tensor, see fe_tools.encoding
+THERMAL_ENCODING = get_encoding("float32")
 
 
 def main():
@@ -23,32 +28,39 @@ def main():
         extract_seq_gray(seq_path)
 
 
-def extract_seq_gray(seq_path: str) -> None:
+def extract_seq_gray(seq_path: str, save_fff: bool = False) -> None:
     folder = os.path.join(os.path.dirname(seq_path), "converted", os.path.basename(seq_path).split(".")[0])
     file_basename = os.path.basename(folder)
-    make_empty_folder(folder)
-    make_empty_folder(f"{folder}/fff_frames")
-
-    thermal_tensor = []
-    for frame_id, frame_bytes in enumerate(tqdm(Seq(seq_path))):
-        # Write frame to .fff file
-        fff_path = f"{folder}/fff_frames/{frame_id:04d}.fff"
-        with open(fff_path, "wb") as fff_file:
-            fff_file.write(frame_bytes)
+    os.makedirs(folder, exist_ok=True)
+    if save_fff:
+        os.makedirs(f"{folder}/fff_frames", exist_ok=True)
+
+    # Thermal tensor is written by chunks while frames are decoded (load it with fe_tools.sinks.load_chunked),
+    # frames of the chunks written by an interrupted run are skipped
+    renderer = FrameRenderer()
+    thermal_sink = ChunkedSink(
+            f"{folder}/{file_basename}_thermal", dtype=THERMAL_ENCODING.dtype, attrs=THERMAL_ENCODING.as_dict()
+    )
+    for frame_id, frame_bytes in enumerate(tqdm(Seq(seq_path, use_mmap=True))):
+        if thermal_sink.is_written(frame_id):
+            continue
+        if save_fff:
+            # Export frame to .fff file
+            with open(f"{folder}/fff_frames/{frame_id:04d}.fff", "wb") as fff_file:
+                fff_file.write(frame_bytes)
 
-        # Get thermal image from .fff file
+        # Get thermal image from the frame bytes
         try:
-            thermal_image = get_thermal_image(fff_path, is_celsius=False)
+            thermal_image = get_thermal_image(frame_bytes, is_celsius=False)
         except Exception as e:
             print(f"Error: {e}")
             continue
-        # os.remove(fff_path)
 
-        # Add thermal image to tensor (for writing to .npz or .npy)
-        thermal_tensor.append(thermal_image)
+        # Add thermal image to tensor
+        thermal_sink.write(frame_id, THERMAL_ENCODING.encode(thermal_image))
 
-        gray_img = get_thermal_image_vis_gray(thermal_image, min_thr=200, max_thr=1000)
-        # gray_img = get_thermal_image_vis_gray(thermal_image, min_thr=0, max_thr=500, is_celsius=True)
+        gray_img = renderer.gray(thermal_image, min_thr=200, max_thr=1000)
+        # gray_img = renderer.gray(thermal_image, min_thr=0, max_thr=500)
 
         # Save thermal frame as .jpg
         jpg_path = f"{folder}/{file_basename}_{frame_id:04d}.jpg"
@@ -60,21 +72,10 @@ def extract_seq_gray(seq_path: str) -> None:
         # tiff_img = np.clip(thermal_image, 0.0, 500.0)
         tiff.imwrite(tiff_path, tiff_img, photometric="minisblack")
 
-    # Remove all .fff files
-    shutil.rmtree(f"{folder}/fff_frames")
-    # Save .npz or .npy
-    thermal_tensor = np.array(thermal_tensor)
-    print(f"Saving thermal tensor {thermal_tensor.shape} ...")
-    # np.save(f"{folder}/thermal.npy", thermal_tensor)
-    np.savez_compressed(f"{folder}/{file_basename}.npz", thermal_tensor)
+    thermal_sink.close()
+    print(f"Saved thermal tensor ({thermal_sink.n_frames}, {thermal_sink.frame_shape}) to {thermal_sink.path}")
     print("Complete!")
 
 
-def make_empty_folder(path: str) -> None:
-    if os.path.exists(path):
-        shutil.rmtree(path)
-    os.makedirs(path)
-
-
 if __name__ == "__main__":
     main()
@@ -0,0 +1,4 @@
+from fe_tools.cli import main
+
+
+main()
@@ -0,0 +1,272 @@
+"""
+Batch conversion of many SEQ files with one shared process pool.
+Files are split into tasks of a few frames, tasks of the largest files are scheduled first,
+so the pool stays busy until the end instead of waiting for one big file.
+Workers read the frames from their own memory maps and drop their caches when their memory goes over the cap,
+the workers are restarted if one of them stays over it.
+A killed worker (e.g. out of memory) fails the frames of the tasks in flight, the batch goes on with new workers.
+Progress and ETA are shown for all frames of the batch, timings and failures of every file are written to a JSON report.
+"""
+import os
+import json
+import time
+
+from glob import glob
+from typing import List
+from typing import Tuple
+from typing import Callable
+from typing import Optional
+from typing import Iterator
+from typing import Sequence
+from collections import deque
+
+from fe_tools import render
+from fe_tools import profiling
+from fe_tools import parallel
+from fe_tools import fff_tools
+from fe_tools.seq import Seq
+
+
+FRAMES_PER_TASK = 16
+
+# Max number of frame errors of a file kept in the report
+MAX_REPORTED_ERRORS = 100
+
+# Tasks sent to the pool ahead per worker, so workers don't wait for the next task
+TASKS_PER_WORKER = 2
+
+# Conversion of a worker process, set by _init_worker
+_worker_convert = None
+_worker_args = ()
+_worker_max_memory = None
+
+
+def find_seq_files(patterns: Sequence[str]) -> List[str]:
+    """
+    Find the SEQ files of directories (recursively), glob patterns and file paths
+    :param patterns: directories, glob patterns or files
+    :return: paths of the files, the largest first
+    """
+    seq_paths = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            seq_paths.update(glob(os.path.join(pattern, "**", "*.seq"), recursive=True))
+        else:
+            seq_paths.update(path for path in glob(pattern, recursive=True) if os.path.isfile(path))
+    return sorted(seq_paths, key=lambda path: (-os.path.getsize(path), path))
+
+
+def convert_seqs(
+        seq_paths: Sequence[str],
+        convert: Callable,
+        args: tuple = (),
+        file_args: Callable = None,
+        workers: int = None,
+        max_worker_memory: float = None,
+        frames_per_task: int = FRAMES_PER_TASK,
+        report_path: str = None,
+        is_profile: bool = None,
+        index_file: Callable = None,
+) -> dict:
+    """
+    Convert all frames of the SEQ files with `convert(frame_bytes, frame_id, seq_path, *args, *file_args(seq))`
+    :param seq_paths: paths to .seq files
+    :param convert: module-level (picklable) function converting and saving a frame, its result is ignored
+    :param args: additional arguments of `convert`
+    :param file_args: function of the Seq returning additional arguments of `convert` for the file
+    (e.g. its unit of measurement), called once per file in the main process
+    :param workers: number of worker processes, all CPUs by default
+    :param max_worker_memory: memory (in MB) of a worker above which it drops its caches after a task,
+    if it is still above it, the pool is restarted once the tasks in flight are done
+    (the cap is exceeded by one task at most)
+    :param frames_per_task: number of frames sent to a worker at once
+    :param report_path: path to .json report
+    :param is_profile: profile the workers and merge their results into the profiler of the main process,
+    by default if profiling is enabled
+    :param index_file: function of the SEQ path returning the path of its frame index (see Seq),
+    by default the index is saved next to the .seq file
+    :return: report with the timings and failures of the batch and of every file
+    """
+    from tqdm import tqdm
+
+    start_time = time.time()
+    workers = workers or os.cpu_count() or 1
+    file_reports = []
+    tasks = []
+    for file_id, seq_path in enumerate(seq_paths):
+        file_report = {
+            "path": seq_path,
+            "size": os.path.getsize(seq_path),
+            "frames": 0,
+            "converted": 0,
+            "failed": 0,
+            "error": None,
+            "frame_errors": [],
+            "cpu_time": 0.0,
+            "start_time": None,
+            "end_time": None,
+        }
+        file_reports.append(file_report)
+        try:
+            seq_index_file = index_file(seq_path) if index_file is not None else None
+            with Seq(seq_path, use_mmap=True, use_index=True, index_file=seq_index_file) as seq:
+                file_report["frames"] = len(seq)
+                extra_args = tuple(file_args(seq)) if file_args is not None and len(seq) > 0 else ()
+                frames = [(frame_id, offset, chunksize) for frame_id, (offset, chunksize) in enumerate(seq.pos)]
+        except Exception as e:
+            file_report["error"] = str(e)
+            continue
+        for task_start in range(0, len(frames), frames_per_task):
+            tasks.append((file_id, seq_path, extra_args, frames[task_start:task_start + frames_per_task]))
+    # The largest files first, whatever the order of seq_paths
+    tasks.sort(key=lambda task: -file_reports[task[0]]["size"])
+
+    total_frames = sum(len(task[3]) for task in tasks)
+    main_profiler = profiling.get_profiler()
+    if is_profile is None:
+        is_profile = main_profiler is not None
+    # Results of the workers are merged into the profiler of the main process
+    worker_trace = main_profiler.is_trace if is_profile and main_profiler is not None else None
+    initargs = (convert, args, max_worker_memory, worker_trace)
+    with tqdm(total=total_frames, unit="frame") as progress:
+        for task_result in _run_tasks(tasks, max(min(workers, len(tasks)), 1), initargs):
+            file_id, n_frames, task_start, task_end, frame_errors, profile, _ = task_result
+            if profile is not None and main_profiler is not None:
+                main_profiler.merge(profile)
+            file_report = file_reports[file_id]
+            file_report["converted"] += n_frames - len(frame_errors)
+            file_report["failed"] += len(frame_errors)
+            file_report["frame_errors"] += frame_errors[:MAX_REPORTED_ERRORS - len(file_report["frame_errors"])]
+            file_report["cpu_time"] += task_end - task_start
+            file_report["start_time"] = min(file_report["start_time"] or task_start, task_start)
+            file_report["end_time"] = max(file_report["end_time"] or task_end, task_end)
+            progress.update(n_frames)
+
+    end_time = time.time()
+    for file_report in file_reports:
+        # Seconds since the start of the batch
+        for key in ("start_time", "end_time"):
+            if file_report[key] is not None:
+                file_report[key] -= start_time
+        file_report["frames_per_second"] = (
+            file_report["converted"] / file_report["cpu_time"] if file_report["cpu_time"] > 0 else 0.0
+        )
+    report = {
+        "start_time": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(start_time)),
+        "elapsed_time": end_time - start_time,
+        "workers": workers,
+        "frames": total_frames,
+        "converted": sum(file_report["converted"] for file_report in file_reports),
+        "failed": sum(file_report["failed"] for file_report in file_reports),
+        "failed_files": sum(file_report["error"] is not None for file_report in file_reports),
+        "frames_per_second": total_frames / (end_time - start_time) if end_time > start_time else 0.0,
+        "files": file_reports,
+    }
+    if report_path is not None:
+        with open(report_path, "w") as report_file:
+            json.dump(report, report_file, indent=2)
+    return report
+
+
+def _run_tasks(tasks: list, workers: int, initargs: tuple) -> Iterator[tuple]:
+    """
+    Run the tasks in a pool, yield their results as they are done.
+    A worker over its memory cap after dropping its caches stops the sending of tasks,
+    the pool is restarted once the tasks in flight are done.
+    If a worker dies, the tasks in flight fail and the pool is restarted
+    """
+    from concurrent.futures import BrokenExecutor
+    from concurrent.futures import ProcessPoolExecutor
+
+    pending_tasks = deque(tasks)
+    while len(pending_tasks) > 0:
+        with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=initargs) as pool:
+            # (task, future) of the tasks sent to the pool
+            in_flight = deque()
+            is_restart = False
+            while len(in_flight) > 0 or (len(pending_tasks) > 0 and not is_restart):
+                while len(pending_tasks) > 0 and len(in_flight) < TASKS_PER_WORKER * workers and not is_restart:
+                    task = pending_tasks.popleft()
+                    try:
+                        in_flight.append((task, pool.submit(_convert_task, task)))
+                    except BrokenExecutor:
+                        pending_tasks.appendleft(task)
+                        is_restart = True
+                if len(in_flight) == 0:
+                    break
+                task, future = in_flight.popleft()
+                try:
+                    task_result = future.result()
+                except BrokenExecutor as e:
+                    is_restart = True
+                    task_result = _get_failed_task(task, f"The worker died: {e}")
+                is_restart = is_restart or task_result[-1]
+                yield task_result
+
+
+def _init_worker(convert: Callable, args: tuple, max_memory: float, profile_trace: bool = None) -> None:
+    """ profile_trace: None not to profile the worker, otherwise if its timeline is kept """
+    global _worker_convert, _worker_args, _worker_max_memory
+
+    _worker_convert = convert
+    _worker_args = args
+    _worker_max_memory = max_memory
+    if profile_trace is not None:
+        profiling.enable(is_trace=profile_trace)
+
+
+def _convert_task(
+        task: Tuple[int, str, tuple, list],
+) -> Tuple[int, int, float, float, List[dict], Optional[dict], bool]:
+    """
+    Convert the frames of the task, returns (file_id, number of frames, start time, end time, frame errors,
+    profile of the task or None, if the worker is over its memory cap even without its caches)
+    """
+    file_id, seq_path, extra_args, frames = task
+    task_start = time.time()
+    frame_errors = []
+    for frame_id, offset, chunksize in frames:
+        try:
+            _worker_convert(
+                    parallel.read_frame(seq_path, offset, chunksize), frame_id, seq_path, *_worker_args, *extra_args
+            )
+        except Exception as e:
+            frame_errors.append({"frame_id": frame_id, "error": str(e)})
+    task_end = time.time()
+
+    is_over_memory = False
+    if _worker_max_memory is not None and _get_memory() > _worker_max_memory:
+        _drop_caches()
+        # Memory outside of the caches is freed only by restarting the worker
+        is_over_memory = _get_memory() > _worker_max_memory
+    profile = None
+    profiler = profiling.get_profiler()
+    if profiler is not None:
+        profile = profiler.as_dict()
+        profiling.enable(is_trace=profiler.is_trace)
+    return file_id, len(frames), task_start, task_end, frame_errors, profile, is_over_memory
+
+
+def _get_failed_task(task: Tuple[int, str, tuple, list], error: str) -> tuple:
+    """ Result of a task whose frames all failed with the error, see _convert_task """
+    file_id, _, _, frames = task
+    now = time.time()
+    frame_errors = [{"frame_id": frame_id, "error": error} for frame_id, _, _ in frames]
+    return file_id, len(frames), now, now, frame_errors, None, False
+
+
+def _get_memory() -> float:
+    """ Resident memory of the process in MB, 0 if unknown """
+    try:
+        with open("/proc/self/statm", "r") as statm_file:
+            resident_pages = int(statm_file.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return 0.0
+    return resident_pages * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+
+
+def _drop_caches() -> None:
+    """ Unmap the SEQ files and drop the lookup tables and render buffers of the worker """
+    parallel.unmap_seq()
+    fff_tools.clear_lut_cache()
+    render.clear_renderers()
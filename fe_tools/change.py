@@ -0,0 +1,154 @@
+"""
+Change detection between frames of a SEQ file on raw counts, to skip the frames of static scenes.
+A frame is compared with the last kept frame (not the previous one, so slow drifts are kept too) on every
+stride-th row and column of the raw image: it is kept if more than min_fraction of the compared pixels
+differ by more than the threshold (in raw counts), or if its calibration differs.
+The frame map gives the kept frame standing for every frame of the sequence.
+Skipped frames are recorded in the manifest of the conversion, a re-run compares only the frames from the first one
+to convert on, the frames before it keep their kept frames of the saved map.
+"""
+import json
+import numpy as np
+
+from fe_tools import fff_parser
+from fe_tools.seq import Seq
+from fe_tools.manifest import Manifest
+from fe_tools.files import atomic_write
+from fe_tools.fff_parser import FFFError
+from fe_tools.fff_tools import get_calibration
+
+
+# Compared rows and columns of the raw images
+CHANGE_STRIDE = 4
+# Part of the compared pixels that have to change for a frame to be kept
+CHANGED_FRACTION = 0.001
+
+
+class ChangeDetector:
+    def __init__(self, threshold: float, min_fraction: float = CHANGED_FRACTION, stride: int = CHANGE_STRIDE):
+        """
+        :param threshold: change of a raw value (in counts) above the noise
+        :param min_fraction: part of the compared pixels that have to change
+        :param stride: compare every stride-th row and column
+        """
+        self.threshold = threshold
+        self.min_fraction = min_fraction
+        self.stride = stride
+        # Raw image and calibration of the last kept frame
+        self._reference = None
+        self._reference_calibration = None
+
+    def is_changed(self, fff_bytes: bytes) -> bool:
+        """ Compare the frame with the last kept one, the frame is kept if it changed """
+        try:
+            raw_image = fff_parser.get_raw_image_np(fff_bytes, stride=self.stride).astype(np.int32)
+            calibration = get_calibration(fff_bytes)
+        except (FFFError, ValueError):
+            # Formats only exiftool knows and broken frames are always kept, they are reported by the conversion
+            self._reference = None
+            return True
+        if self._reference is None or raw_image.shape != self._reference.shape:
+            is_changed = True
+        elif calibration is not self._reference_calibration:
+            is_changed = True
+        else:
+            n_changed = np.count_nonzero(np.abs(raw_image - self._reference) > self.threshold)
+            is_changed = n_changed > self.min_fraction * raw_image.size
+        if is_changed:
+            self._reference = raw_image
+            self._reference_calibration = calibration
+        return is_changed
+
+
+def get_frame_map(
+        seq: Seq,
+        threshold: float,
+        min_fraction: float = CHANGED_FRACTION,
+        stride: int = CHANGE_STRIDE,
+        start: int = 0,
+        previous_map: np.ndarray = None,
+) -> np.ndarray:
+    """
+    Find the frames of the sequence to keep
+    :param seq: sequence, memory-mapped to read only the compared rows
+    :param threshold: change of a raw value (in counts) above the noise
+    :param min_fraction: part of the compared pixels that have to change
+    :param stride: compare every stride-th row and column
+    :param start: first frame to compare, the frames before it keep their kept frames of previous_map
+    :param previous_map: frame map of at least the frames before start, e.g. of the last run
+    :return: id of the kept frame standing for every frame, kept frames stand for themselves
+    """
+    detector = ChangeDetector(threshold, min_fraction, stride)
+    frame_map = np.zeros(len(seq), dtype=np.int64)
+    if start > 0:
+        frame_map[:start] = previous_map[:start]
+        # The last kept frame is the reference of the next frames
+        detector.is_changed(seq[int(frame_map[start - 1])])
+    for frame_id in range(start, len(seq)):
+        frame_map[frame_id] = frame_id if detector.is_changed(seq[frame_id]) else frame_map[frame_id - 1]
+    return frame_map
+
+
+def skip_static_frames(seq: Seq, frame_ids, threshold: float, map_path: str, manifest: Manifest = None) -> list:
+    """
+    Find the frames to keep, save the frame map and drop the other frames from frame_ids.
+    Frames are compared from the first frame to convert on, if the saved frame map covers the frames before it
+    :param seq: sequence
+    :param frame_ids: ids of the frames to convert, see Manifest.get_todo
+    :param threshold: change of a raw value (in counts) above the noise
+    :param map_path: path to .json frame map
+    :param manifest: manifest of the conversion, the skipped frames are recorded in it with their kept frame
+    :return: ids of the frames to convert: the kept frames of frame_ids and the frames skipped by the last run
+    that are kept now
+    """
+    params = {"threshold": threshold, "min_fraction": CHANGED_FRACTION, "stride": CHANGE_STRIDE}
+    start = min(frame_ids) if len(frame_ids) > 0 else len(seq)
+    previous_map = _load_previous_map(map_path, params)
+    if manifest is None or previous_map is None or len(previous_map) < start:
+        start = 0
+    if start == len(seq) and previous_map is not None and len(previous_map) == len(seq):
+        # Nothing to convert, nothing to compare
+        frame_map = previous_map
+    else:
+        frame_map = get_frame_map(seq, threshold, start=start, previous_map=previous_map)
+        save_frame_map(map_path, frame_map, params)
+
+    frame_ids = set(int(frame_id) for frame_id in frame_ids)
+    kept_frame_ids = []
+    for frame_id in range(start, len(seq)):
+        kept_frame_id = int(frame_map[frame_id])
+        if kept_frame_id != frame_id:
+            if manifest is not None:
+                manifest.add_skipped(frame_id, seq.pos[frame_id], seq[frame_id], kept_frame_id)
+        elif frame_id in frame_ids or (manifest is not None and manifest.is_skipped(frame_id)):
+            kept_frame_ids.append(frame_id)
+    print(f"{len(np.unique(frame_map))} of {len(frame_map)} frames changed, the others are skipped (see {map_path})")
+    return kept_frame_ids
+
+
+def save_frame_map(path: str, frame_map: np.ndarray, params: dict) -> None:
+    """
+    Save the frame map as JSON: `{"params": ..., "frames": [kept frame id of every frame]}`
+    :param path: path to .json file
+    :param frame_map: see `get_frame_map`
+    :param params: parameters of the change detection
+    """
+    with atomic_write(path) as map_file:
+        json.dump({"params": params, "frames": frame_map.tolist()}, map_file)
+
+
+def load_frame_map(path: str) -> np.ndarray:
+    with open(path, "r") as map_file:
+        return np.array(json.load(map_file)["frames"], dtype=np.int64)
+
+
+def _load_previous_map(path: str, params: dict):
+    """ Frame map of the last run with the same parameters, None if there is none """
+    try:
+        with open(path, "r") as map_file:
+            frame_map = json.load(map_file)
+        if frame_map["params"] != params:
+            return None
+        return np.array(frame_map["frames"], dtype=np.int64)
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
@@ -0,0 +1,140 @@
+"""
+Single command line entry point: `python -m fe_tools <command> ...`
+Commands:
+
+- tiff: .seq file to .tiff files, the same as seq_to_tiff.py
+- jpg: .seq file to .jpg files, the same as seq_to_jpg.py
+- stats: temperature range and raw percentiles of .seq files, see fe_tools.stats
+- npz: temperatures of a .seq file to a chunked tensor, see fe_tools.sinks.ChunkedSink
+
+Only argparse is imported to parse the command, the modules of a command (NumPy, OpenCV, tifffile, ...)
+are imported when it runs, so short jobs and `--help` start fast.
+"""
+import os
+import sys
+import argparse
+import importlib
+
+from typing import List
+
+
+COMMANDS = {
+    "tiff": "Convert a .seq file to .tiff files",
+    "jpg": "Convert a .seq file to .jpg files",
+    "stats": "Print statistics of .seq files",
+    "npz": "Export the temperatures of a .seq file as a chunked tensor",
+}
+
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(
+            prog="fe_tools",
+            description="Tools for FLIR .seq and .fff files",
+            epilog="\n".join(f"{command}: {description}" for command, description in COMMANDS.items()),
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("command", choices=COMMANDS, help="Command to run")
+    parser.add_argument("args", nargs=argparse.REMAINDER, help="Arguments of the command, see <command> --help")
+    args = parser.parse_args(argv)
+    run_command = {"tiff": run_tiff, "jpg": run_jpg, "stats": run_stats, "npz": run_npz}[args.command]
+    run_command(args.args)
+
+
+def run_tiff(argv: List[str]) -> None:
+    _run_script("seq_to_tiff", "tiff", argv)
+
+
+def run_jpg(argv: List[str]) -> None:
+    _run_script("seq_to_jpg", "jpg", argv)
+
+
+def run_stats(argv: List[str]) -> None:
+    parser = argparse.ArgumentParser(prog="fe_tools stats", description=COMMANDS["stats"])
+    parser.add_argument("patterns", nargs="+", help="Directories (searched recursively), glob patterns or .seq files")
+    parser.add_argument("--workers", type=int, help="Number of processes, all CPUs by default", default=None)
+    parser.add_argument(
+            "--no-cache",
+            dest="use_cache",
+            action="store_false",
+            help="Recompute the statistics cached next to the .seq files",
+            default=True
+    )
+    args = parser.parse_args(argv)
+
+    import numpy as np
+    from fe_tools.batch import find_seq_files
+    from fe_tools.stats import get_seqs_stats
+
+    seq_paths = find_seq_files(args.patterns)
+    if len(seq_paths) == 0:
+        parser.error("No .seq files found")
+    all_stats, errors = get_seqs_stats(seq_paths, workers=args.workers, use_cache=args.use_cache)
+    for seq_path, error in errors.items():
+        print(f"{seq_path}: error: {error}")
+    for seq_path, stats in all_stats.items():
+        percentiles = ", ".join(f"p{p:g} {value:g}" for p, value in zip(stats.percentiles, stats.seq_percentiles_raw()))
+        print(
+                f"{seq_path}: {np.count_nonzero(stats.is_valid)} of {len(stats.is_valid)} frames decoded, "
+                f"{stats.seq_min_temp:.2f}..{stats.seq_max_temp:.2f} celsius, raw {percentiles}"
+        )
+
+
+def run_npz(argv: List[str]) -> None:
+    from fe_tools.encoding import ENCODINGS
+
+    parser = argparse.ArgumentParser(
+            prog="fe_tools npz",
+            description=f"{COMMANDS['npz']} in celsius, load it with fe_tools.sinks.load_chunked",
+    )
+    parser.add_argument("input_file", type=str, help="Input .seq file")
+    parser.add_argument("output_dir", type=str, help="Directory of the tensor, an interrupted export is resumed")
+    parser.add_argument(
+            "--encoding",
+            choices=ENCODINGS,
+            help="Type of the saved temperatures, uint16 covers the temperature range of the file (see fe_tools.encoding)",
+            default="float32"
+    )
+    parser.add_argument("--chunk-frames", dest="chunk_frames", type=int, help="Frames per chunk", default=64)
+    args = parser.parse_args(argv)
+
+    import numpy as np
+    from tqdm import tqdm
+    from fe_tools.seq import Seq
+    from fe_tools.sinks import ChunkedSink
+    from fe_tools.stats import get_seq_stats
+    from fe_tools.encoding import get_encoding
+    from fe_tools.fff_tools import get_thermal_image
+
+    if args.encoding == "uint16":
+        stats = get_seq_stats(args.input_file)
+        if not np.any(stats.is_valid):
+            parser.error(f"No frame of {args.input_file} could be decoded")
+        encoding = get_encoding(args.encoding, stats.seq_min_temp, stats.seq_max_temp)
+    else:
+        encoding = get_encoding(args.encoding)
+    # float16 is rounded anyway, the other encodings are exact to float64 only
+    decode_dtype = np.float32 if args.encoding == "float16" else np.float64
+
+    seq = Seq(args.input_file, use_mmap=True)
+    with ChunkedSink(args.output_dir, args.chunk_frames, dtype=encoding.dtype, attrs=encoding.as_dict()) as sink:
+        for frame_id, frame_bytes in enumerate(tqdm(seq)):
+            if sink.is_written(frame_id):
+                continue
+            try:
+                thermal_image = get_thermal_image(frame_bytes, dtype=decode_dtype)
+            except Exception as e:
+                print(f"Error in frame {frame_id}: {e}")
+                continue
+            sink.write(frame_id, encoding.encode(thermal_image))
+    print(f"Saved {sink.n_frames} frames to {args.output_dir}")
+
+
+def _run_script(module_name: str, command: str, argv: List[str]) -> None:
+    """ Run main() of a conversion script with the arguments of the command """
+    # The scripts live next to the package, not in it
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if repo_dir not in sys.path:
+        sys.path.insert(0, repo_dir)
+    script = importlib.import_module(module_name)
+    sys.argv = [f"fe_tools {command}", *argv]
+    script.main()
@@ -0,0 +1,88 @@
+"""
+Compact storage of temperature images, instead of 8 bytes per pixel of float64:
+
+- float32: 4 bytes, relative error <= 2**-24 (< 0.0001 degree at 1500)
+- float16: 2 bytes, relative error <= 2**-11: <= 0.125 degree below 256, 0.25 below 512, 0.5 below 2048
+- uint16: 2 bytes, fixed point `value = code * scale + offset` with the offset at the low end of the range,
+  scale is 0.01 (centi-Kelvin) if the range fits 655.35 degrees, otherwise the next multiple of 0.01 fitting it,
+  error <= scale / 2, values outside of the range are clipped
+
+Scale and offset are stored with the data (`as_dict`), `decode` gives the temperatures back.
+"""
+import numpy as np
+
+from math import ceil
+from typing import NamedTuple
+
+
+ENCODINGS = ("float64", "float32", "float16", "uint16")
+
+# Step of the fixed point encoding when the range fits 2 ** 16 steps
+CENTI_KELVIN = 0.01
+MAX_CODE = 2 ** 16 - 1
+
+
+class TemperatureEncoding(NamedTuple):
+    """ Type of stored temperatures, fixed point codes decode as `code * scale + offset` """
+    name: str
+    scale: float = 1.0
+    offset: float = 0.0
+
+    @property
+    def dtype(self) -> np.dtype:
+        return np.dtype(self.name)
+
+    @property
+    def is_fixed_point(self) -> bool:
+        return self.name == "uint16"
+
+    def encode(self, thermal_image: np.ndarray) -> np.ndarray:
+        """ Temperatures to stored values, NaN becomes the lowest code in fixed point """
+        if not self.is_fixed_point:
+            return thermal_image.astype(self.dtype, copy=False)
+        codes = np.subtract(thermal_image, self.offset, dtype=np.float64)
+        codes /= self.scale
+        np.rint(codes, out=codes)
+        np.clip(codes, 0, MAX_CODE, out=codes)
+        codes[np.isnan(codes)] = 0
+        return codes.astype(np.uint16)
+
+    def decode(self, stored: np.ndarray, dtype: type = np.float64) -> np.ndarray:
+        """ Stored values to temperatures """
+        if not self.is_fixed_point:
+            return stored.astype(dtype, copy=False)
+        thermal_image = stored.astype(dtype)
+        thermal_image *= self.scale
+        thermal_image += self.offset
+        return thermal_image
+
+    def get_max_error(self, max_abs_value: float) -> float:
+        """ Max absolute error of the stored temperatures up to max_abs_value """
+        if self.is_fixed_point:
+            return self.scale / 2
+        return max_abs_value * float(np.finfo(self.dtype).eps) / 2
+
+    def as_dict(self) -> dict:
+        return {"encoding": self.name, "scale": self.scale, "offset": self.offset}
+
+    @classmethod
+    def from_dict(cls, encoding: dict) -> "TemperatureEncoding":
+        return cls(encoding["encoding"], encoding["scale"], encoding["offset"])
+
+
+def get_encoding(name: str, min_value: float = None, max_value: float = None) -> TemperatureEncoding:
+    """
+    Get the encoding of temperatures
+    :param name: one of ENCODINGS
+    :param min_value: min temperature to store, needed by the fixed point encoding
+    :param max_value: max temperature to store, needed by the fixed point encoding
+    :return: encoding
+    """
+    if name not in ENCODINGS:
+        raise ValueError(f"Unknown encoding {name}, expected one of {ENCODINGS}")
+    if name != "uint16":
+        return TemperatureEncoding(name)
+    if min_value is None or max_value is None or max_value < min_value:
+        raise ValueError("Fixed point encoding needs the range of temperatures")
+    steps = max(ceil((max_value - min_value) / (MAX_CODE * CENTI_KELVIN)), 1)
+    return TemperatureEncoding(name, round(steps * CENTI_KELVIN, 10), float(min_value))
@@ -0,0 +1,240 @@
+"""
+Pool of persistent `exiftool -stay_open True -@ -` processes.
+Arguments of a request are written to the stdin of a process one per line and finished with `-execute<N>`,
+the response is everything exiftool prints to stdout until `{ready<N>}`.
+The Perl interpreter starts once per process instead of once per call.
+The installed version is probed once per machine, see probe_exiftool.
+"""
+import os
+import json
+import queue
+import atexit
+import shutil
+import tempfile
+import threading
+import subprocess
+
+from typing import List
+from typing import Optional
+
+from fe_tools import profiling
+from fe_tools.files import atomic_write
+
+
+EXIFTOOL_EXECUTABLE = "exiftool"
+EXIFTOOL_POOL_SIZE = 2
+EXIFTOOL_TIMEOUT = 30.0
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# Probed versions of the toolchain shared by the processes of the machine (pool workers, scheduled jobs),
+# keyed by the path and mtime of the executable, so an upgrade is probed again
+TOOLCHAIN_CACHE_PATH = os.path.join(tempfile.gettempdir(), "fe_tools_toolchain.json")
+_exiftool_versions = {}
+
+
+class ExiftoolProcess:
+    def __init__(self, executable: str = EXIFTOOL_EXECUTABLE, timeout: float = EXIFTOOL_TIMEOUT):
+        """
+        One exiftool process in the stay_open mode, started on the first request.
+        Not thread-safe, use ExiftoolPool to share processes
+        :param executable: exiftool executable
+        :param timeout: max seconds to wait for a response, a hung process is killed
+        """
+        self.executable = executable
+        self.timeout = timeout
+        self._process = None
+        self._stdout_chunks = None
+        self._request_id = 0
+
+    def start(self) -> None:
+        """ Start the process, raises FileNotFoundError if there is no exiftool """
+        self._process = subprocess.Popen(
+                [self.executable, "-stay_open", "True", "-@", "-"],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+        )
+        profiling.count("exiftool.spawns")
+        # Pipes can't be read with a timeout on every OS, so stdout is read by a thread
+        self._stdout_chunks = queue.Queue()
+        threading.Thread(
+                target=_read_chunks,
+                args=(self._process.stdout, self._stdout_chunks),
+                daemon=True,
+        ).start()
+
+    def execute(self, args: List[str]) -> bytes:
+        """
+        Run exiftool with the arguments
+        :param args: command line arguments, one per item
+        :return: stdout of exiftool
+        """
+        if self._process is None or self._process.poll() is not None:
+            self.start()
+        self._request_id += 1
+        ready_marker = f"{{ready{self._request_id}}}".encode()
+        command = "\n".join([*args, f"-execute{self._request_id}", ""])
+        try:
+            self._process.stdin.write(command.encode("utf-8"))
+            self._process.stdin.flush()
+        except OSError:
+            self.close()
+            raise subprocess.CalledProcessError(-1, [self.executable, *args])
+
+        output = bytearray()
+        while True:
+            try:
+                chunk = self._stdout_chunks.get(timeout=self.timeout)
+            except queue.Empty:
+                self.close()
+                raise subprocess.TimeoutExpired([self.executable, *args], self.timeout)
+            if not chunk:
+                # exiftool exited
+                return_code = self._process.wait()
+                self.close()
+                raise subprocess.CalledProcessError(return_code, [self.executable, *args], bytes(output))
+            output += chunk
+            marker_pos = output.rfind(ready_marker)
+            if marker_pos != -1 and output.endswith(b"\n"):
+                if marker_pos == 0:
+                    # In the stay_open mode errors go to stderr only, the response is empty
+                    raise subprocess.CalledProcessError(1, [self.executable, *args], b"")
+                return bytes(output[:marker_pos])
+
+    def close(self) -> None:
+        """ Stop the process, it is started again on the next request """
+        if self._process is None:
+            return
+        try:
+            self._process.stdin.write(b"-stay_open\nFalse\n")
+            self._process.stdin.flush()
+            self._process.wait(timeout=1)
+        except (OSError, subprocess.TimeoutExpired):
+            self._process.kill()
+            self._process.wait()
+        self._process = None
+
+
+class ExiftoolPool:
+    def __init__(
+            self,
+            size: int = EXIFTOOL_POOL_SIZE,
+            executable: str = EXIFTOOL_EXECUTABLE,
+            timeout: float = EXIFTOOL_TIMEOUT,
+    ):
+        """
+        Thread-safe pool of exiftool processes
+        :param size: number of processes
+        :param executable: exiftool executable
+        :param timeout: max seconds to wait for a response, a hung process is killed and restarted
+        """
+        self._processes = [ExiftoolProcess(executable, timeout) for _ in range(size)]
+        self._idle = queue.Queue()
+        for process in self._processes:
+            self._idle.put(process)
+
+    def execute(self, args: List[str]) -> bytes:
+        """ Run exiftool with the arguments in an idle process """
+        process = self._idle.get()
+        try:
+            return process.execute(args)
+        finally:
+            self._idle.put(process)
+
+    def close(self) -> None:
+        for process in self._processes:
+            process.close()
+
+
+def get_exiftool_pool() -> ExiftoolPool:
+    """ Get the pool shared by the process, it is created on the first call """
+    global _pool
+
+    with _pool_lock:
+        if _pool is None:
+            _pool = ExiftoolPool()
+        return _pool
+
+
+def _close_pool() -> None:
+    if _pool is not None:
+        _pool.close()
+
+
+def _forget_pool() -> None:
+    """
+    Forked children get their own pool: the pipes of the parent's processes are inherited without the threads
+    reading them, and closing them would stop the parent's processes
+    """
+    global _pool, _pool_lock
+
+    _pool = None
+    _pool_lock = threading.Lock()
+
+
+atexit.register(_close_pool)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_forget_pool)
+
+
+def probe_exiftool(executable: str = EXIFTOOL_EXECUTABLE) -> Optional[str]:
+    """
+    Get the version of exiftool without starting it when it was probed before,
+    by this process or by any other one through TOOLCHAIN_CACHE_PATH
+    :param executable: exiftool executable
+    :return: version, None if there is no exiftool
+    """
+    if executable in _exiftool_versions:
+        return _exiftool_versions[executable]
+    version = None
+    path = shutil.which(executable)
+    if path is not None:
+        key = f"{os.path.realpath(path)}:{os.stat(path).st_mtime_ns}"
+        cache = _load_toolchain_cache()
+        version = cache.get(key)
+        if version is None:
+            version = _run_version(path)
+            if version is not None:
+                cache[key] = version
+                _save_toolchain_cache(cache)
+    _exiftool_versions[executable] = version
+    return version
+
+
+def _run_version(path: str) -> Optional[str]:
+    try:
+        result = subprocess.run(
+                [path, "-ver"], stdin=subprocess.DEVNULL, capture_output=True, timeout=EXIFTOOL_TIMEOUT, check=True,
+        )
+    except (OSError, subprocess.SubprocessError):
+        return None
+    profiling.count("exiftool.spawns")
+    return result.stdout.decode("utf-8", "replace").strip() or None
+
+
+def _load_toolchain_cache() -> dict:
+    try:
+        with open(TOOLCHAIN_CACHE_PATH, "r") as cache_file:
+            cache = json.load(cache_file)
+    except (OSError, ValueError):
+        return {}
+    return cache if isinstance(cache, dict) else {}
+
+
+def _save_toolchain_cache(cache: dict) -> None:
+    try:
+        with atomic_write(TOOLCHAIN_CACHE_PATH) as cache_file:
+            json.dump(cache, cache_file)
+    except OSError:
+        # The cache is an optimization, e.g. the temp dir may be read-only
+        pass
+
+
+def _read_chunks(stream, chunks: queue.Queue) -> None:
+    """ Forward the stream to the queue, an empty chunk means the end of the stream """
+    while True:
+        chunk = os.read(stream.fileno(), 1 << 16)
+        chunks.put(chunk)
+        if not chunk:
+            return
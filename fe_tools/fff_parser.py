@@ -0,0 +1,237 @@
+"""
+Native reader of FLIR .fff images.
+Parses the FFF header, the record directory, the CameraInfo and the RawData records
+straight from bytes, so no exiftool process is needed per frame.
+The layout follows Image::ExifTool::FLIR: https://exiftool.org/TagNames/FLIR.html
+"""
+import io
+import struct
+import numpy as np
+
+from typing import Dict
+from typing import List
+from typing import Tuple
+from typing import Optional
+from typing import NamedTuple
+
+from fe_tools.profiling import timed
+
+
+FFF_MAGIC = b"FFF\x00"
+FFF_HEADER_SIZE = 0x40
+FFF_DIR_ENTRY_SIZE = 0x20
+
+RECORD_TYPE_RAW_DATA = 0x0001
+RECORD_TYPE_CAMERA_INFO = 0x0020
+
+PNG_MAGIC = b"\x89PNG\r\n\x1a\n"
+
+# CameraInfo record: tag name -> (offset, struct format)
+CAMERA_INFO_TAGS = {
+    "Emissivity": (0x20, "f"),
+    "ObjectDistance": (0x24, "f"),
+    "ReflectedApparentTemperature": (0x28, "f"),
+    "AtmosphericTemperature": (0x2c, "f"),
+    "IRWindowTemperature": (0x30, "f"),
+    "IRWindowTransmission": (0x34, "f"),
+    "RelativeHumidity": (0x3c, "f"),
+    "PlanckR1": (0x58, "f"),
+    "PlanckB": (0x5c, "f"),
+    "PlanckF": (0x60, "f"),
+    "AtmosphericTransAlpha1": (0x70, "f"),
+    "AtmosphericTransAlpha2": (0x74, "f"),
+    "AtmosphericTransBeta1": (0x78, "f"),
+    "AtmosphericTransBeta2": (0x7c, "f"),
+    "AtmosphericTransX": (0x80, "f"),
+    "CameraTemperatureRangeMax": (0x90, "f"),
+    "CameraTemperatureRangeMin": (0x94, "f"),
+    "PlanckO": (0x308, "i"),
+    "PlanckR2": (0x30c, "f"),
+}
+
+
+class FFFError(ValueError):
+    """ The bytes are not an FFF image this parser can handle """
+
+
+class FFFRecord(NamedTuple):
+    """ Entry of the FFF record directory """
+    type: int
+    subtype: int
+    version: int
+    index_id: int
+    offset: int
+    length: int
+
+
+def get_header_byte_order(fff_bytes: bytes) -> str:
+    """
+    Get the byte order of the FFF header and record directory.
+    As in exiftool, the order is the one giving a version number in [100, 200)
+    """
+    if len(fff_bytes) < FFF_HEADER_SIZE or bytes(fff_bytes[:4]) != FFF_MAGIC:
+        raise FFFError("No FFF header found")
+    for byte_order in (">", "<"):
+        version, = struct.unpack_from(f"{byte_order}I", fff_bytes, 0x14)
+        if 100 <= version < 200:
+            return byte_order
+    raise FFFError("Unsupported FFF version")
+
+
+def get_records(fff_bytes: bytes) -> List[FFFRecord]:
+    """ Get the non-empty entries of the FFF record directory """
+    byte_order = get_header_byte_order(fff_bytes)
+    dir_offset, dir_count = struct.unpack_from(f"{byte_order}II", fff_bytes, 0x18)
+    if dir_offset + dir_count * FFF_DIR_ENTRY_SIZE > len(fff_bytes):
+        raise FFFError("FFF record directory is truncated")
+
+    records = []
+    for entry_id in range(dir_count):
+        entry_offset = dir_offset + entry_id * FFF_DIR_ENTRY_SIZE
+        record = FFFRecord(*struct.unpack_from(f"{byte_order}HHIIII", fff_bytes, entry_offset))
+        if record.type == 0:
+            continue
+        if record.offset + record.length > len(fff_bytes):
+            raise FFFError(f"FFF record {record.type:#06x} is truncated")
+        records.append(record)
+    return records
+
+
+def get_frame_size(fff_bytes: bytes) -> int:
+    """
+    Get the size of the FFF image from its record directory
+    :param fff_bytes: bytes starting with the FFF image, may continue with other data
+    :return: offset of the end of the last record
+    """
+    byte_order = get_header_byte_order(fff_bytes)
+    dir_offset, dir_count = struct.unpack_from(f"{byte_order}II", fff_bytes, 0x18)
+    frame_size = max(FFF_HEADER_SIZE, dir_offset + dir_count * FFF_DIR_ENTRY_SIZE)
+    for record in get_records(fff_bytes):
+        frame_size = max(frame_size, record.offset + record.length)
+    return frame_size
+
+
+def get_record(fff_bytes: bytes, record_type: int) -> memoryview:
+    """ Get the body of the first record of the type as a zero-copy memoryview """
+    for record in get_records(fff_bytes):
+        if record.type == record_type:
+            return memoryview(fff_bytes)[record.offset:record.offset + record.length]
+    raise FFFError(f"FFF record {record_type:#06x} not found")
+
+
+def get_camera_info(fff_bytes: bytes) -> Dict[str, float]:
+    """
+    Get the raw values of the CameraInfo record (temperatures in Kelvin, humidity as a fraction)
+    :param fff_bytes: content of the .fff image
+    :return: tag name -> value
+    """
+    record = get_record(fff_bytes, RECORD_TYPE_CAMERA_INFO)
+    byte_order = _get_record_byte_order(record)
+    if len(record) < 0x310:
+        raise FFFError("FFF CameraInfo record is truncated")
+
+    camera_info = {}
+    for tag, (offset, fmt) in CAMERA_INFO_TAGS.items():
+        camera_info[tag], = struct.unpack_from(f"{byte_order}{fmt}", record, offset)
+    # Have seen the humidity expressed as percent
+    if camera_info["RelativeHumidity"] > 2:
+        camera_info["RelativeHumidity"] /= 100
+    return camera_info
+
+
+@timed("fff.meta")
+def get_meta(fff_bytes: bytes) -> dict:
+    """
+    Get the metadata from the fff image in the same form as `exiftool -j` prints it,
+    so values (and their rounding) are interchangeable with the exiftool path
+    """
+    camera_info = get_camera_info(fff_bytes)
+    meta = {
+        "Emissivity": float(f"{camera_info['Emissivity']:.2f}"),
+        "AtmosphericTemperature": _kelvin2str(camera_info["AtmosphericTemperature"]),
+        "ReflectedApparentTemperature": _kelvin2str(camera_info["ReflectedApparentTemperature"]),
+        "IRWindowTemperature": _kelvin2str(camera_info["IRWindowTemperature"]),
+        "IRWindowTransmission": float(f"{camera_info['IRWindowTransmission']:.2f}"),
+        "RelativeHumidity": f"{camera_info['RelativeHumidity'] * 100:.1f} %",
+        "PlanckR1": _round_float(camera_info["PlanckR1"]),
+        "PlanckB": _round_float(camera_info["PlanckB"]),
+        "PlanckF": _round_float(camera_info["PlanckF"]),
+        "PlanckO": camera_info["PlanckO"],
+        "PlanckR2": _round_float(camera_info["PlanckR2"]),
+    }
+    return meta
+
+
+@timed("fff.raw_image")
+def get_raw_image_np(
+        fff_bytes: bytes,
+        out: np.ndarray = None,
+        region: Optional[Tuple[int, int, int, int]] = None,
+        stride: int = 1,
+) -> np.ndarray:
+    """
+    Get the raw image from the fff image.
+    With a region and/or a stride only those pixels are copied out of the uncompressed record,
+    so pages of a memory-mapped SEQ file outside of them are never read
+    :param fff_bytes: content of the .fff image
+    :param out: buffer for the image, e.g. a frame of a preallocated stack
+    :param region: (top, left, bottom, right) rectangle of the image to get
+    :param stride: take every stride-th row and column
+    :return: raw image
+    """
+    raw_image = get_raw_image_view(fff_bytes)
+    if region is not None or stride != 1:
+        top, left, bottom, right = region if region is not None else (0, 0, *raw_image.shape)
+        if not (0 <= top < bottom <= raw_image.shape[0] and 0 <= left < right <= raw_image.shape[1]):
+            raise ValueError(f"Region {region} is outside of the {raw_image.shape} raw image")
+        raw_image = raw_image[top:bottom:stride, left:right:stride]
+
+    if out is None:
+        return raw_image if raw_image.flags.owndata else raw_image.copy()
+    if out.shape != raw_image.shape:
+        # Not an FFFError: exiftool would read the same image
+        raise ValueError(f"Raw image has shape {raw_image.shape}, expected {out.shape}")
+    np.copyto(out, raw_image, casting="same_kind")
+    return out
+
+
+def get_raw_image_view(fff_bytes: bytes) -> np.ndarray:
+    """
+    Get the raw image as a read-only zero-copy view of the fff image,
+    a new array if the image is compressed (PNG).
+    The view keeps `fff_bytes` alive, copy what is needed before closing a memory-mapped SEQ
+    """
+    record = get_record(fff_bytes, RECORD_TYPE_RAW_DATA)
+    byte_order = _get_record_byte_order(record)
+    width, height = struct.unpack_from(f"{byte_order}HH", record, 0x02)
+    image_bytes = record[0x20:]
+
+    if bytes(image_bytes[:len(PNG_MAGIC)]) == PNG_MAGIC:
+        # Imported on demand, most cameras store the raw image uncompressed
+        from PIL import Image
+
+        thermal_img = Image.open(io.BytesIO(image_bytes))
+        raw_image = np.array(thermal_img)
+    elif len(image_bytes) != width * height * 2:
+        raise FFFError("Unrecognized FLIR RawThermalImage data format")
+    elif byte_order != "<":
+        # exiftool doesn't support big-endian raw images either
+        raise FFFError("Big-endian RawThermalImage is not supported")
+    else:
+        raw_image = np.frombuffer(image_bytes, dtype="<u2").reshape(height, width)
+    return raw_image
+
+
+def _get_record_byte_order(record: memoryview) -> str:
+    """ The first word of CameraInfo and RawData records is always 2 """
+    return "<" if bytes(record[:2]) == b"\x02\x00" else ">"
+
+
+def _kelvin2str(kelvin: float) -> str:
+    """ Format temperature like exiftool does, e.g. "20.0 C" """
+    return f"{kelvin - 273.15:.1f} C"
+
+
+def _round_float(value: float) -> float:
+    """ exiftool prints float tags with 8 significant digits """
+    return float(f"{value:.8g}")
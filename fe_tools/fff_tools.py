@@ -3,78 +3,143 @@ import os
 import re
 import sys
 import json
-import subprocess
+import base64
+import weakref
+import hashlib
+import tempfile
 import numpy as np
 
 from math import exp
 from math import log
 from math import inf
+from typing import Tuple
+from typing import Union
+from typing import BinaryIO
+from collections import OrderedDict
 
-from PIL import Image
+from fe_tools import profiling
+from fe_tools import fff_parser
+from fe_tools.files import atomic_write
+from fe_tools.fff_parser import FFFError
+from fe_tools.render import FrameRenderer
+from fe_tools.exiftool import probe_exiftool
+from fe_tools.exiftool import get_exiftool_pool
 
 
 EXIFTOOL_EXISTS = False
 
+# Raw to temperature lookup tables: max number kept in memory and optional dir to persist them,
+# set by the environment so all scripts and their worker processes share it
+LUT_CACHE_SIZE = 16
+LUT_CACHE_DIR = os.environ.get("FE_TOOLS_LUT_CACHE_DIR") or None
+_lut_cache = OrderedDict()
 
-def get_thermal_image(fff_img_filename: str, is_celsius: bool = True) -> np.ndarray:
+# CameraInfo fields of the conversion parameters (offset, size), the byte order mark is the first word
+CALIBRATION_FIELDS = ((0x00, 2), (0x20, 4), (0x28, 4), (0x58, 12), (0x308, 8))
+CALIBRATION_CACHE_SIZE = 256
+_calibrations_by_fields = {}
+
+# Tags of the conversion parameters read by exiftool
+EXIFTOOL_META_TAGS = [
+    '-Emissivity', '-SubjectDistance', '-AtmosphericTemperature',
+    '-ReflectedApparentTemperature', '-IRWindowTemperature', '-IRWindowTransmission', '-RelativeHumidity',
+    '-PlanckR1', '-PlanckB', '-PlanckF', '-PlanckO', '-PlanckR2',
+]
+
+# Path to the fff image, or its content
+FFFSource = Union[str, os.PathLike, bytes, bytearray, memoryview, BinaryIO]
+
+
+@profiling.timed("thermal_image")
+def get_thermal_image(
+        fff_img_filename: FFFSource,
+        is_celsius: bool = True,
+        use_exiftool: bool = False,
+        stride: int = 1,
+        dtype: type = np.float64,
+) -> np.ndarray:
     """
     Get the temperature image from the fff image
-    :param fff_img_filename: path to image
+    :param fff_img_filename: path to image, or its content as bytes, memoryview or file-like object
     :param is_celsius: if the temperature on the image in celsius
+    :param use_exiftool: read the image with exiftool instead of the native parser
+    :param stride: convert only every stride-th row and column, e.g. for previews (see also fe_tools.roi)
+    :param dtype: float32 or float64 type of the temperatures, see also fe_tools.encoding
     :return:
     """
-    if not EXIFTOOL_EXISTS:
-        check_exiftool()
-    meta = get_meta(fff_img_filename)
-    raw_image = get_raw_image_np(fff_img_filename)
-    thermal_np = np.vectorize(_raw2temperature)(
-            raw_image,
-            meta['PlanckR1'],
-            meta['PlanckR2'],
-            meta['PlanckB'],
-            meta['PlanckO'],
-            meta['PlanckF'],
-            meta['Emissivity'],
-            _extract_float(meta['ReflectedApparentTemperature']),
-    )
+    if not _is_path(fff_img_filename):
+        # Read file-like objects once for both metadata and raw image
+        fff_img_filename = _read_fff(fff_img_filename)
+    calibration, raw_image = None, None
+    if not use_exiftool:
+        try:
+            fff_bytes = _read_fff(fff_img_filename)
+            calibration = _get_native_calibration(fff_bytes)
+            raw_image = fff_parser.get_raw_image_np(fff_bytes, stride=stride)
+        except FFFError:
+            # Fallback to exiftool, it knows more of FLIR formats
+            use_exiftool = True
+    if use_exiftool:
+        if not EXIFTOOL_EXISTS:
+            check_exiftool()
+        meta, raw_image = _get_meta_and_raw_image_exiftool(fff_img_filename)
+        raw_image = raw_image[::stride, ::stride]
+        calibration = Calibration.intern(*get_calibration_params(meta))
+    if raw_image.dtype == np.uint16:
+        thermal_np = raw2temperature_lut(raw_image, *calibration, dtype=dtype)
+    else:
+        thermal_np = raw2temperature(raw_image, *calibration, dtype=dtype)
     # Convert to Celsius
     thermal_np = thermal_np - np.min(thermal_np) if not is_celsius else thermal_np
 
     return thermal_np
 
 
-def get_thermal_image_vis(thermal_np: np.ndarray) -> np.ndarray:
-    """ Get the visualized temperature image from the numpy array of temperatures """
-    thermal_img_vis = np.zeros((thermal_np.shape[0], thermal_np.shape[1], 3), dtype=np.uint8)
-    thermal_np -= np.min(thermal_np)
-    thermal_np = (thermal_np / np.max(thermal_np) * 255).astype("uint8")
-    thermal_img_vis[:, :, 2] = thermal_np
-    return thermal_img_vis
+def get_thermal_image_vis(thermal_np: np.ndarray, colormap: str = "red") -> np.ndarray:
+    """
+    Get the visualized temperature image from the numpy array of temperatures (not modified).
+    Use fe_tools.render.FrameRenderer to reuse the buffers between frames
+    """
+    renderer = FrameRenderer(colormap)
+    return renderer.colorize(renderer.normalize(thermal_np)).copy()
 
 
 def get_thermal_image_vis_gray(thermal_np: np.ndarray, min_thr: float, max_thr: float) -> np.ndarray:
-    th_np = thermal_np.copy()
-    # th_np -= np.min(th_np)
-    # th_np -= 200
-    th_np = np.clip(th_np, min_thr, max_thr)
-    thermal_img_vis = (th_np / np.max(th_np) * 255).astype("uint8")
-    return thermal_img_vis
-
-
-def get_meta(fff_img_filename: str) -> dict:
-    """ Get the metadata from the fff image """
-    meta_json = subprocess.check_output(
-            ['exiftool', fff_img_filename, '-Emissivity', '-SubjectDistance', '-AtmosphericTemperature',
-             '-ReflectedApparentTemperature', '-IRWindowTemperature', '-IRWindowTransmission', '-RelativeHumidity',
-             '-PlanckR1', '-PlanckB', '-PlanckF', '-PlanckO', '-PlanckR2', '-j']
-    )
+    """
+    Get the gray image of the temperatures clipped to the thresholds.
+    Use fe_tools.render.FrameRenderer to reuse the buffers between frames
+    """
+    return FrameRenderer().gray(thermal_np, min_thr, max_thr)
+
+
+def get_meta(fff_img_filename: FFFSource, use_exiftool: bool = False) -> dict:
+    """ Get the metadata from the fff image (path, bytes, memoryview or file-like object) """
+    if not _is_path(fff_img_filename):
+        # A file-like object is read once, so exiftool gets its content too
+        fff_img_filename = _read_fff(fff_img_filename)
+    if not use_exiftool:
+        try:
+            return fff_parser.get_meta(_read_fff(fff_img_filename))
+        except FFFError:
+            pass
+    meta_json = _run_exiftool(fff_img_filename, [*EXIFTOOL_META_TAGS, '-j'])
     meta = json.loads(meta_json.decode())[0]
     return meta
 
 
-def get_raw_image_np(fff_img_filename: str) -> np.ndarray:
-    """ Get the raw image from the fff image """
-    thermal_img_bytes = subprocess.check_output(['exiftool', "-RawThermalImage", "-b", fff_img_filename])
+def get_raw_image_np(fff_img_filename: FFFSource, use_exiftool: bool = False) -> np.ndarray:
+    """ Get the raw image from the fff image (path, bytes, memoryview or file-like object) """
+    if not _is_path(fff_img_filename):
+        # A file-like object is read once, so exiftool gets its content too
+        fff_img_filename = _read_fff(fff_img_filename)
+    if not use_exiftool:
+        try:
+            return fff_parser.get_raw_image_np(_read_fff(fff_img_filename))
+        except FFFError:
+            pass
+    from PIL import Image
+
+    thermal_img_bytes = _run_exiftool(fff_img_filename, ["-RawThermalImage", "-b"])
     thermal_img_stream = io.BytesIO(thermal_img_bytes)
 
     thermal_img = Image.open(thermal_img_stream)
@@ -82,12 +147,411 @@ def get_raw_image_np(fff_img_filename: str) -> np.ndarray:
     return thermal_np
 
 
+def get_calibration_params(meta: dict) -> Tuple[float, float, float, float, float, float, float]:
+    """
+    Get the parameters of the raw to temperature conversion from the metadata
+    :param meta: metadata from `get_meta`
+    :return: (PlanckR1, PlanckR2, PlanckB, PlanckO, PlanckF, Emissivity, reflected temperature in celsius)
+    """
+    return (
+        meta['PlanckR1'],
+        meta['PlanckR2'],
+        meta['PlanckB'],
+        meta['PlanckO'],
+        meta['PlanckF'],
+        meta['Emissivity'],
+        _extract_float(meta['ReflectedApparentTemperature']),
+    )
+
+
+class Calibration:
+    """
+    Parameters of the raw to temperature conversion, unpacks like the tuple of `get_calibration_params`.
+    Instances are interned: `Calibration.intern` returns the same object for the same parameters,
+    so frames of a sequence share one object and a change of calibration is a change of the object
+    """
+    __slots__ = ("pr1", "pr2", "pb", "po", "pf", "e", "r_temp", "__weakref__")
+
+    # Parameters -> the interned calibration, while it is used (by frames, caches), so the table doesn't grow
+    # with the number of cameras and files of a long batch
+    _interned = weakref.WeakValueDictionary()
+
+    def __init__(self, pr1: float, pr2: float, pb: float, po: float, pf: float, e: float, r_temp: float):
+        """
+        :param pr1, pr2, pb, po, pf: Planck constants
+        :param e: emissivity
+        :param r_temp: reflected apparent temperature in celsius
+        """
+        self.pr1 = float(pr1)
+        self.pr2 = float(pr2)
+        self.pb = float(pb)
+        self.po = float(po)
+        self.pf = float(pf)
+        self.e = float(e)
+        self.r_temp = float(r_temp)
+
+    @classmethod
+    def intern(cls, pr1: float, pr2: float, pb: float, po: float, pf: float, e: float, r_temp: float) -> "Calibration":
+        """ Get the shared calibration with the parameters """
+        calibration = cls(pr1, pr2, pb, po, pf, e, r_temp)
+        return cls._interned.setdefault(calibration.as_tuple(), calibration)
+
+    def as_tuple(self) -> Tuple[float, float, float, float, float, float, float]:
+        return self.pr1, self.pr2, self.pb, self.po, self.pf, self.e, self.r_temp
+
+    def __iter__(self):
+        return iter(self.as_tuple())
+
+    def __eq__(self, other):
+        return isinstance(other, Calibration) and self.as_tuple() == other.as_tuple()
+
+    def __hash__(self):
+        return hash(self.as_tuple())
+
+    def __repr__(self):
+        return f"Calibration{self.as_tuple()}"
+
+
+def get_calibration(fff_img_filename: FFFSource, use_exiftool: bool = False) -> Calibration:
+    """
+    Get the interned calibration of the fff image (path, bytes, memoryview or file-like object).
+    With the native parser metadata are parsed only for a CameraInfo content not seen before
+    """
+    if not _is_path(fff_img_filename):
+        # A file-like object is read once, so exiftool gets its content too
+        fff_img_filename = _read_fff(fff_img_filename)
+    if not use_exiftool:
+        try:
+            return _get_native_calibration(_read_fff(fff_img_filename))
+        except FFFError:
+            pass
+    return Calibration.intern(*get_calibration_params(get_meta(fff_img_filename, use_exiftool=True)))
+
+
+def _get_native_calibration(fff_bytes: bytes) -> Calibration:
+    """ The bytes of the parameter fields of CameraInfo are the key of the parsed calibration """
+    record = fff_parser.get_record(fff_bytes, fff_parser.RECORD_TYPE_CAMERA_INFO)
+    key = b"".join(bytes(record[offset:offset + size]) for offset, size in CALIBRATION_FIELDS)
+    calibration = _calibrations_by_fields.get(key)
+    if calibration is None:
+        calibration = Calibration.intern(*get_calibration_params(fff_parser.get_meta(fff_bytes)))
+        profiling.count("calibration.parsed")
+        if len(_calibrations_by_fields) >= CALIBRATION_CACHE_SIZE:
+            _calibrations_by_fields.clear()
+        _calibrations_by_fields[key] = calibration
+    return calibration
+
+
+def get_temperature_range(fff_img_filename: FFFSource) -> Tuple[float, float]:
+    """
+    Get the min and max temperature (in Celsius) of the fff image from its raw extremes, without converting the image.
+    Temperatures outside the calibrated range of the camera (e.g. dead pixels) are clipped to it, if the range is known
+    :param fff_img_filename: path to image, or its content as bytes, memoryview or file-like object
+    :return: (min, max) temperature
+    """
+    if not _is_path(fff_img_filename):
+        fff_img_filename = _read_fff(fff_img_filename)
+    raw_image = get_raw_image_np(fff_img_filename)
+    calibration = get_calibration(fff_img_filename)
+    temp_range = raw2temperature(np.array([np.min(raw_image), np.max(raw_image)]), *calibration)
+    try:
+        camera_info = fff_parser.get_camera_info(_read_fff(fff_img_filename))
+        camera_min = camera_info["CameraTemperatureRangeMin"] - 273.15
+        camera_max = camera_info["CameraTemperatureRangeMax"] - 273.15
+        if camera_min < camera_max:
+            temp_range = np.clip(temp_range, camera_min, camera_max)
+    except FFFError:
+        pass
+    return float(temp_range[0]), float(temp_range[1])
+
+
+def detect_is_celsius(fff_img_filename: FFFSource, min_thr: float, max_thr: float, default: bool = True) -> bool:
+    """
+    Guess the unit of measurement of a recording with thresholds in Celsius from one image.
+    In Celsius the temperatures are compared with min_thr..max_thr, in Kelvin get_thermal_image(is_celsius=False)
+    gives 0..(max - min) and they are compared with min_thr + 273.15..max_thr + 273.15.
+    The unit whose threshold range is covered more by the temperature range of the image wins
+    :param fff_img_filename: path to image, or its content as bytes, memoryview or file-like object
+    :param min_thr: min temperature threshold of capturing (in Celsius)
+    :param max_thr: max temperature threshold of capturing (in Celsius)
+    :param default: unit if both are equally likely
+    :return: if temperature of the recording is in celsius
+    """
+    min_temp, max_temp = get_temperature_range(fff_img_filename)
+    celsius_overlap = min(max_temp, max_thr) - max(min_temp, min_thr)
+    kelvin_overlap = min(max_temp - min_temp, max_thr + 273.15) - max(0.0, min_thr + 273.15)
+    if max(celsius_overlap, kelvin_overlap) <= 0 or celsius_overlap == kelvin_overlap:
+        return default
+    return celsius_overlap > kelvin_overlap
+
+
+def check_parity(fff_img_filename: FFFSource) -> bool:
+    """
+    Cross-check the native parser with exiftool on the fff image
+    :param fff_img_filename: path to image, or its content as bytes, memoryview or file-like object
+    :return: True if metadata and raw image are the same
+    """
+    if not _is_path(fff_img_filename):
+        fff_img_filename = _read_fff(fff_img_filename)
+    if not EXIFTOOL_EXISTS:
+        check_exiftool()
+    native_meta = get_meta(fff_img_filename)
+    exiftool_meta = get_meta(fff_img_filename, use_exiftool=True)
+    for tag, value in native_meta.items():
+        if tag not in exiftool_meta:
+            print(f"Tag {tag} is missing in exiftool output")
+            return False
+        if isinstance(value, str):
+            value, exiftool_value = _extract_float(value), _extract_float(exiftool_meta[tag])
+        else:
+            exiftool_value = exiftool_meta[tag]
+        if not np.isclose(value, exiftool_value, rtol=1e-6):
+            print(f"Tag {tag}: native {native_meta[tag]} != exiftool {exiftool_meta[tag]}")
+            return False
+
+    native_raw = get_raw_image_np(fff_img_filename)
+    exiftool_raw = get_raw_image_np(fff_img_filename, use_exiftool=True)
+    if not np.array_equal(native_raw, exiftool_raw):
+        print("Raw images are different")
+        return False
+    return True
+
+
+def _is_path(fff_img_filename: FFFSource) -> bool:
+    return isinstance(fff_img_filename, (str, os.PathLike))
+
+
+def _read_fff(fff_img_filename: FFFSource) -> Union[bytes, bytearray, memoryview]:
+    """ Read the content of the fff image, bytes and memoryview are returned as is """
+    if isinstance(fff_img_filename, (bytes, bytearray, memoryview)):
+        return fff_img_filename
+    if not _is_path(fff_img_filename):
+        fff_bytes = fff_img_filename.read()
+    else:
+        with open(fff_img_filename, "rb") as fff_file:
+            fff_bytes = fff_file.read()
+    profiling.count("fff.bytes_read", len(fff_bytes))
+    return fff_bytes
+
+
+@profiling.timed("exiftool.execute")
+def _run_exiftool(fff_img_filename: FFFSource, args: list) -> bytes:
+    """ Run exiftool on the fff image in the shared pool of exiftool processes """
+    if _is_path(fff_img_filename):
+        return get_exiftool_pool().execute([*args, os.fspath(fff_img_filename)])
+    # The pool talks to exiftool through stdin, so the content is passed in a temporary file
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        fff_path = os.path.join(tmp_dir, "frame.fff")
+        with open(fff_path, "wb") as fff_file:
+            fff_file.write(_read_fff(fff_img_filename))
+        return get_exiftool_pool().execute([*args, fff_path])
+
+
+def _get_meta_and_raw_image_exiftool(fff_img_filename: FFFSource) -> Tuple[dict, np.ndarray]:
+    """ Get the metadata and the raw image from the fff image in one exiftool request """
+    from PIL import Image
+
+    # With -j and -b binary tags are printed in base64
+    meta_json = _run_exiftool(fff_img_filename, [*EXIFTOOL_META_TAGS, '-RawThermalImage', '-b', '-j'])
+    meta = json.loads(meta_json.decode())[0]
+    thermal_img_bytes = base64.b64decode(meta.pop('RawThermalImage')[len("base64:"):])
+    thermal_img = Image.open(io.BytesIO(thermal_img_bytes))
+    return meta, np.array(thermal_img)
+
+
 def _extract_float(dirty_str: str) -> float:
     """ Extract the float value of a string, helpful for parsing the exiftool data """
     digits = re.findall(r"[-+]?\d*\.\d+|\d+", dirty_str)
     return float(digits[0])
 
 
+@profiling.timed("convert.raw2temperature")
+def raw2temperature(
+        raw: np.ndarray,
+        pr1: float,
+        pr2: float,
+        pb: float,
+        po: float,
+        pf: float,
+        e: float,
+        r_temp: float,
+        dtype: type = np.float64,
+        out: np.ndarray = None,
+) -> np.ndarray:
+    """
+    Convert an array of raw values (a frame or a stack of frames) to temperature.
+    Array version of `_raw2temperature`: the same float64 operations in the same order,
+    so results match it within 1e-12 relative (only np.log and math.log may differ in the last ulp).
+    Like there, values with ln_arg <= 0 become -273.15.
+    :param raw: raw values
+    :param pr1, pr2, pb, po, pf: Planck constants
+    :param e: emissivity
+    :param r_temp: reflected apparent temperature in celsius
+    :param dtype: float32 or float64 type of the result (computed in float64 anyway)
+    :param out: buffer for the result, its dtype is used instead of `dtype`
+    :return: temperature in celsius
+    """
+    dtype = np.dtype(out.dtype if out is not None else dtype)
+    if dtype not in (np.float32, np.float64):
+        raise ValueError(f"Unsupported dtype {dtype}, expected float32 or float64")
+
+    # Reflected radiation is the same for the whole frame
+    raw_refl = pr1 / (pr2 * (exp(pb / (r_temp + 273.15)) - pf)) - po
+
+    # Compute in place in a single float64 buffer
+    if out is not None and dtype == np.float64:
+        work = out
+        np.subtract(raw, (1 - e) * raw_refl, out=work, dtype=np.float64)
+    else:
+        work = np.subtract(raw, (1 - e) * raw_refl, dtype=np.float64)
+    work /= e
+    work += po
+    work *= pr2
+    np.divide(pr1, work, out=work)
+    work += pf
+    invalid = work <= 0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        np.log(work, out=work)
+        np.divide(pb, work, out=work)
+    work -= 273.15
+    work[invalid] = -273.15
+
+    if work is out:
+        return out
+    if out is not None:
+        np.copyto(out, work, casting="same_kind")
+        return out
+    return work.astype(dtype, copy=False)
+
+
+def get_temperature_lut(
+        pr1: float,
+        pr2: float,
+        pb: float,
+        po: float,
+        pf: float,
+        e: float,
+        r_temp: float,
+        dtype: type = np.float64,
+        cache_dir: str = None,
+) -> np.ndarray:
+    """
+    Get the read-only table of temperatures of all 65536 raw values for the calibration parameters.
+    Tables are kept in a LRU cache of LUT_CACHE_SIZE entries and, if `cache_dir` (or LUT_CACHE_DIR,
+    the FE_TOOLS_LUT_CACHE_DIR environment variable) is set, saved to .npy files there,
+    so the next runs with the same camera skip building them
+    :param pr1, pr2, pb, po, pf: Planck constants
+    :param e: emissivity
+    :param r_temp: reflected apparent temperature in celsius
+    :param dtype: float32 or float64 type of the table
+    :param cache_dir: dir for persisted tables
+    :return: table of temperatures in celsius indexed by raw value
+    """
+    dtype = np.dtype(dtype)
+    key = (float(pr1), float(pr2), float(pb), float(po), float(pf), float(e), float(r_temp), dtype.str)
+    lut = _lut_cache.get(key)
+    if lut is not None:
+        _lut_cache.move_to_end(key)
+        return lut
+
+    cache_dir = cache_dir or LUT_CACHE_DIR
+    lut_path = None
+    if cache_dir:
+        lut_path = os.path.join(cache_dir, f"lut_{hashlib.sha1(repr(key).encode()).hexdigest()}.npy")
+        try:
+            lut = np.load(lut_path) if os.path.isfile(lut_path) else None
+        except (OSError, ValueError):
+            # A damaged table is built again
+            lut = None
+        if lut is not None and lut.shape != (2 ** 16,):
+            lut = None
+    if lut is None:
+        lut = raw2temperature(np.arange(2 ** 16, dtype=np.uint16), *key[:-1], dtype=dtype)
+        profiling.count("lut.built")
+        if lut_path:
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                with atomic_write(lut_path, "wb") as lut_file:
+                    np.save(lut_file, lut)
+            except OSError:
+                # The tables on disk are only a cache, e.g. the dir may be read-only
+                pass
+
+    lut.setflags(write=False)
+    _lut_cache[key] = lut
+    while len(_lut_cache) > LUT_CACHE_SIZE:
+        _lut_cache.popitem(last=False)
+    return lut
+
+
+def clear_lut_cache() -> None:
+    """ Drop the lookup tables kept in memory """
+    _lut_cache.clear()
+
+
+@profiling.timed("convert.lut")
+def raw2temperature_lut(
+        raw: np.ndarray,
+        pr1: float,
+        pr2: float,
+        pb: float,
+        po: float,
+        pf: float,
+        e: float,
+        r_temp: float,
+        dtype: type = np.float64,
+        out: np.ndarray = None,
+        cache_dir: str = None,
+) -> np.ndarray:
+    """
+    Convert an array of uint16 raw values to temperature by the lookup table of the calibration parameters.
+    Gives exactly the values of `raw2temperature`
+    :param raw: uint16 raw values
+    :param dtype: float32 or float64 type of the result
+    :param out: buffer for the result, its dtype is used instead of `dtype`
+    :param cache_dir: dir for persisted tables
+    :return: temperature in celsius
+    """
+    if raw.dtype != np.uint16:
+        raise ValueError(f"Lookup table needs uint16 raw values, got {raw.dtype}")
+    dtype = out.dtype if out is not None else dtype
+    lut = get_temperature_lut(pr1, pr2, pb, po, pf, e, r_temp, dtype=dtype, cache_dir=cache_dir)
+    return np.take(lut, raw, out=out)
+
+
+def raw2temperature_stack(
+        raw_stack: np.ndarray,
+        calibrations: np.ndarray,
+        dtype: type = np.float64,
+        out: np.ndarray = None,
+) -> np.ndarray:
+    """
+    Convert a (N, H, W) stack of uint16 raw images to temperature with the calibration of each frame.
+    Frames are grouped by unique calibration, each group is converted with one lookup table
+    :param raw_stack: uint16 raw images
+    :param calibrations: (N, 7) parameters of the frames, see `get_calibration_params`
+    :param dtype: float32 or float64 type of the result
+    :param out: buffer for the result, its dtype is used instead of `dtype`
+    :return: temperature in celsius
+    """
+    calibrations = np.asarray(calibrations, dtype=np.float64)
+    if len(calibrations) != len(raw_stack):
+        raise ValueError(f"Got {len(calibrations)} calibrations for {len(raw_stack)} frames")
+    if out is None:
+        out = np.empty(raw_stack.shape, dtype=dtype)
+    if len(raw_stack) == 0:
+        return out
+
+    unique_calibrations, calibration_ids = np.unique(calibrations, axis=0, return_inverse=True)
+    if len(unique_calibrations) == 1:
+        return raw2temperature_lut(raw_stack, *unique_calibrations[0], out=out)
+    calibration_ids = calibration_ids.reshape(-1)
+    for calibration_id, calibration in enumerate(unique_calibrations):
+        frame_ids = np.flatnonzero(calibration_ids == calibration_id)
+        out[frame_ids] = raw2temperature_lut(raw_stack[frame_ids], *calibration, dtype=out.dtype)
+    return out
+
+
 def _raw2temperature(raw, pr1, pr2, pb, po, pf, e, r_temp):
     """
     Convert single raw value to temperature
@@ -106,11 +570,11 @@ def check_exiftool():
 
     # check os
     if os.name == "posix":
-        try:
-            subprocess.check_output(["exiftool", "-ver"])
+        # Probed once per machine, not by every process
+        if probe_exiftool() is not None:
             print("OK. exiftool found")
             EXIFTOOL_EXISTS = True
-        except FileNotFoundError:
+        else:
             print("To work you should install exiftool via apt-get")
             print("sudo apt install libimage-exiftool-perl")
     elif os.name == "nt":
@@ -0,0 +1,40 @@
+"""
+File helpers shared by the modules and scripts.
+"""
+import os
+import shutil
+
+from typing import IO
+from typing import Iterator
+from contextlib import contextmanager
+
+
+@contextmanager
+def atomic_write(path: str, mode: str = "w") -> Iterator[IO]:
+    """
+    Open a temporary file next to the path, which replaces the file once it is written without errors.
+    Other processes and resumed runs never read a partial file, the temporary file is removed on errors
+    :param path: path of the written file
+    :param mode: "w" or "wb"
+    :return: the temporary file
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, mode) as tmp_file:
+            yield tmp_file
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def make_empty_folder(path: str, is_debug: bool) -> None:
+    """ Create the output folder, in debug mode an existing one is emptied (its manifest too) """
+    if not os.path.exists(path):
+        os.makedirs(path)
+    elif is_debug:
+        shutil.rmtree(path)
+        os.makedirs(path)
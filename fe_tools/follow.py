@@ -0,0 +1,101 @@
+"""
+Following a SEQ file while it is being recorded.
+The file is polled for new bytes, the frame index is extended from the end of the last complete frame
+and every frame is yielded once all of its records are on disk, at most one poll interval after that.
+Works as a blocking iterator and as an async iterator for asyncio applications (e.g. online alarms)
+"""
+import os
+import time
+import asyncio
+
+from typing import List
+from typing import Tuple
+from typing import Optional
+
+from fe_tools.seq import Seq
+
+
+POLL_INTERVAL = 0.5
+
+
+class SeqFollower:
+    def __init__(
+            self,
+            seq_path: str,
+            poll_interval: float = POLL_INTERVAL,
+            idle_timeout: Optional[float] = None,
+            start: int = 0,
+    ):
+        """
+        :param seq_path: path to .seq file, it may not exist yet
+        :param poll_interval: seconds between checks of the file, the max delay of a frame
+        :param idle_timeout: seconds without new frames after which the recording is considered finished,
+        None to follow until `stop`
+        :param start: first frame to yield, e.g. to skip the frames recorded before
+        """
+        self.seq_path = seq_path
+        self.poll_interval = poll_interval
+        self.idle_timeout = idle_timeout
+        self.next_frame_id = start
+        self.seq = None
+        self._is_stopped = False
+        self._last_frame_time = time.monotonic()
+
+    def poll(self) -> List[Tuple[int, memoryview]]:
+        """
+        Check the file once, only the headers of the new frames are read
+        :return: (frame_id, frame_bytes) of the frames completed since the last poll
+        """
+        if self.seq is None:
+            if not os.path.isfile(self.seq_path):
+                return []
+            self.seq = Seq(self.seq_path, use_mmap=True)
+        else:
+            self.seq.refresh()
+
+        frames = []
+        while self.next_frame_id < len(self.seq):
+            frames.append((self.next_frame_id, self.seq[self.next_frame_id]))
+            self.next_frame_id += 1
+        if len(frames) > 0:
+            self._last_frame_time = time.monotonic()
+        return frames
+
+    @property
+    def is_finished(self) -> bool:
+        """ Stopped or no new frames for idle_timeout seconds """
+        if self._is_stopped:
+            return True
+        return self.idle_timeout is not None and time.monotonic() - self._last_frame_time > self.idle_timeout
+
+    def stop(self) -> None:
+        """ Finish the iteration after the frames of the current poll, can be called from another thread """
+        self._is_stopped = True
+
+    def __iter__(self):
+        """ Yield (frame_id, frame_bytes) as frames land in the file, sleeping between polls """
+        while True:
+            yield from self.poll()
+            if self.is_finished:
+                break
+            time.sleep(self.poll_interval)
+
+    async def __aiter__(self):
+        """ The same as `__iter__` without blocking the event loop between polls """
+        while True:
+            for frame in self.poll():
+                yield frame
+            if self.is_finished:
+                break
+            await asyncio.sleep(self.poll_interval)
+
+    def close(self) -> None:
+        """ Close the file. Memoryviews of the frames must be released before """
+        if self.seq is not None:
+            self.seq.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
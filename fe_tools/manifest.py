@@ -0,0 +1,135 @@
+"""
+Manifest of a conversion: for every converted frame its offset in the SEQ file, content hash,
+calibration and output files. A re-run converts only the frames that are missing, changed or lost their outputs.
+Frames skipped as static (see fe_tools.change) are recorded with the frame standing for them and no outputs.
+Changed conversion parameters (e.g. thresholds) invalidate all frames.
+If the SEQ file has the same size and mtime as in the last run, frames are not even read to check their hashes.
+"""
+import os
+import json
+import time
+import hashlib
+
+from typing import List
+from typing import Tuple
+
+from fe_tools.seq import Seq
+from fe_tools.files import atomic_write
+from fe_tools.fff_tools import get_calibration
+
+
+# Bump when the format of the manifest or of the outputs changes
+MANIFEST_VERSION = 1
+
+# Min seconds between saves of the manifest while frames are added
+MANIFEST_SAVE_INTERVAL = 5.0
+
+
+class Manifest:
+    def __init__(self, path: str, params: dict):
+        """
+        Load the manifest, frames converted with other parameters are discarded
+        :param path: path to .json file
+        :param params: JSON-serializable parameters of the conversion
+        """
+        self.path = path
+        self.params = params
+        self.source = None
+        self.frames = {}
+        self._last_save_time = time.monotonic()
+
+        try:
+            with open(path, "r") as manifest_file:
+                manifest = json.load(manifest_file)
+        except (OSError, ValueError):
+            return
+        if manifest.get("version") != MANIFEST_VERSION or manifest.get("params") != params:
+            return
+        self.source = manifest.get("source")
+        self.frames = {int(frame_id): entry for frame_id, entry in manifest.get("frames", {}).items()}
+
+    def get_todo(self, seq: Seq) -> List[int]:
+        """
+        Get the frames to convert: not converted, changed or with missing outputs
+        :param seq: sequence of frames
+        :return: frame ids
+        """
+        len(seq)  # Index the whole sequence
+        is_same_source = self.source == _get_source(seq.input_file)
+        manifest_dir = os.path.dirname(self.path)
+        todo = []
+        for frame_id, (offset, chunksize) in enumerate(seq.pos):
+            entry = self.frames.get(frame_id)
+            if entry is None or entry["offset"] != offset or entry["size"] != chunksize:
+                todo.append(frame_id)
+            elif not is_same_source and entry["hash"] != get_frame_hash(seq[frame_id]):
+                todo.append(frame_id)
+            elif not all(os.path.isfile(os.path.join(manifest_dir, output)) for output in entry["outputs"]):
+                todo.append(frame_id)
+        # Entries of the frames to convert and of the frames past the end of a shorter file are outdated,
+        # they must not be trusted by a run after an interrupted one
+        for frame_id in todo + [frame_id for frame_id in self.frames if frame_id >= len(seq.pos)]:
+            self.frames.pop(frame_id, None)
+        self.source = _get_source(seq.input_file)
+        return todo
+
+    def add(self, frame_id: int, pos: Tuple[int, int], frame_bytes: bytes, outputs: List[str]) -> None:
+        """
+        Record the converted frame, the manifest is saved from time to time
+        :param frame_id: id of the frame
+        :param pos: (offset, chunksize) of the frame in the SEQ file
+        :param frame_bytes: FFF image
+        :param outputs: paths of the output files
+        """
+        self.frames[frame_id] = {
+            "offset": pos[0],
+            "size": pos[1],
+            "hash": get_frame_hash(frame_bytes),
+            "calibration": list(get_calibration(frame_bytes)),
+            # Relative to the manifest, so the outputs can be moved with it
+            "outputs": [os.path.relpath(output, os.path.dirname(self.path)) for output in outputs],
+        }
+        if time.monotonic() - self._last_save_time > MANIFEST_SAVE_INTERVAL:
+            self.save()
+
+    def add_skipped(self, frame_id: int, pos: Tuple[int, int], frame_bytes: bytes, kept_frame_id: int) -> None:
+        """
+        Record the frame skipped as static, a re-run doesn't compare it again
+        :param frame_id: id of the frame
+        :param pos: (offset, chunksize) of the frame in the SEQ file
+        :param frame_bytes: FFF image
+        :param kept_frame_id: id of the converted frame standing for it
+        """
+        self.frames[frame_id] = {
+            "offset": pos[0],
+            "size": pos[1],
+            "hash": get_frame_hash(frame_bytes),
+            "kept_frame": kept_frame_id,
+            "outputs": [],
+        }
+        if time.monotonic() - self._last_save_time > MANIFEST_SAVE_INTERVAL:
+            self.save()
+
+    def is_skipped(self, frame_id: int) -> bool:
+        """ If the frame is recorded as skipped, see add_skipped """
+        return "kept_frame" in self.frames.get(frame_id, {})
+
+    def save(self) -> None:
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "params": self.params,
+            "source": self.source,
+            "frames": {str(frame_id): self.frames[frame_id] for frame_id in sorted(self.frames)},
+        }
+        with atomic_write(self.path) as manifest_file:
+            json.dump(manifest, manifest_file)
+        self._last_save_time = time.monotonic()
+
+
+def get_frame_hash(frame_bytes: bytes) -> str:
+    return hashlib.sha1(frame_bytes).hexdigest()
+
+
+def _get_source(seq_path: str) -> dict:
+    stat = os.stat(seq_path)
+    return {"file_size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
\ No newline at end of file
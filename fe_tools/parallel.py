@@ -0,0 +1,113 @@
+"""
+Decoding of the frames of a SEQ file in worker processes (see fe_tools.pipeline and fe_tools.batch).
+Workers memory-map the SEQ file themselves and get only the frame offsets.
+Workers also convert the temperatures (e.g. encode them), so only the converted frames are sent back.
+"""
+import mmap
+import numpy as np
+
+from typing import Tuple
+from typing import Callable
+
+from fe_tools import profiling
+from fe_tools.pipeline import Pipeline
+from fe_tools.fff_tools import get_thermal_image
+
+
+# Memory-mapped SEQ files of the process: path -> (file, mmap), the oldest ones are unmapped over the limit
+MAX_MAPPED_SEQS = 8
+_seq_blobs = {}
+
+
+def read_frame(seq_path: str, offset: int, chunksize: int) -> memoryview:
+    """
+    Get the frame from the SEQ file by its offset without reading the file.
+    The file is memory-mapped once per process and stays mapped
+    :param seq_path: path to .seq file
+    :param offset: offset of the frame, see Seq.pos
+    :param chunksize: size of the frame
+    :return: FFF image bytes
+    """
+    if seq_path not in _seq_blobs:
+        while len(_seq_blobs) >= MAX_MAPPED_SEQS:
+            unmap_seq(next(iter(_seq_blobs)))
+        seq_file = open(seq_path, "rb")
+        _seq_blobs[seq_path] = seq_file, mmap.mmap(seq_file.fileno(), 0, access=mmap.ACCESS_READ)
+    profiling.count("seq.frame_bytes", chunksize)
+    return memoryview(_seq_blobs[seq_path][1])[offset:offset + chunksize]
+
+
+def unmap_seq(seq_path: str = None) -> None:
+    """
+    Forget the memory map of the SEQ file (of all files by default) made by read_frame.
+    A map is closed when the last memoryview of its frames is released
+    """
+    for path in [seq_path] if seq_path is not None else list(_seq_blobs):
+        seq_file, _ = _seq_blobs.pop(path, (None, None))
+        if seq_file is not None:
+            seq_file.close()
+
+
+def decode_thermal_frame(
+        pos: Tuple[int, int],
+        seq_path: str,
+        is_celsius: bool,
+        dtype: type = np.float64,
+) -> np.ndarray:
+    """
+    Get the temperature image of the frame by its offset, see read_frame
+    :param pos: (offset, chunksize) of the frame, see Seq.pos
+    :param seq_path: path to .seq file
+    :param is_celsius: if temperature in .seq file is in celsius
+    :param dtype: float32 or float64 type of the temperatures
+    :return: temperatures
+    """
+    offset, chunksize = pos
+    return get_thermal_image(read_frame(seq_path, offset, chunksize), is_celsius=is_celsius, dtype=dtype)
+
+
+def decode_convert_frame(
+        pos: Tuple[int, int],
+        seq_path: str,
+        is_celsius: bool,
+        dtype: type,
+        convert: Callable,
+        args: tuple,
+):
+    """ Decode the frame by its offset (see decode_thermal_frame) and return `convert(thermal_image, *args)` """
+    return convert(decode_thermal_frame(pos, seq_path, is_celsius, dtype), *args)
+
+
+def add_decode_stages(
+        pipeline: Pipeline,
+        seq_path: str,
+        is_celsius: bool,
+        dtype: type,
+        workers: int,
+        name: str,
+        convert: Callable,
+        args: tuple = (),
+        convert_workers: int = 1,
+) -> Pipeline:
+    """
+    Add the stages decoding the frames ((offset, chunksize) values of the items) and converting their temperatures.
+    With several workers the frames are decoded and converted in the same process,
+    a .jpg is sent back instead of 2.4 MB of float64 temperatures of a 640x480 frame
+    :param pipeline: pipeline of the conversion
+    :param seq_path: path to .seq file
+    :param is_celsius: if temperature in .seq file is in celsius
+    :param dtype: float32 or float64 type of the temperatures
+    :param workers: number of processes, 1 to decode in a thread of this process
+    :param name: name of the conversion stage in the report
+    :param convert: module-level (picklable) function `convert(thermal_image, *args)`, e.g. encoding the frame
+    :param args: additional arguments of `convert`
+    :param convert_workers: number of threads converting the frames decoded in this process
+    :return: the pipeline
+    """
+    decode_args = (seq_path, is_celsius, dtype)
+    if workers > 1:
+        return pipeline.add_stage(
+                f"decode+{name}", decode_convert_frame, (*decode_args, convert, args), workers, use_processes=True
+        )
+    pipeline.add_stage("decode", decode_thermal_frame, decode_args)
+    return pipeline.add_stage(name, convert, args, convert_workers)
@@ -0,0 +1,301 @@
+"""
+Pipeline of conversion stages connected by bounded queues.
+Items are (frame_id, value, error) tuples, each stage replaces the value by `func(value, *args)`
+(`func(frame_id, value, *args)` for stages that need the frame id, e.g. to name the output file).
+An exception of `func` is kept as the error message of the item, later stages pass such items as is.
+So is a failure of the process pool (e.g. a killed worker), the other items are still converted or get the error.
+An exception of the source of items is raised by Pipeline.run() after the items read before it.
+Stages run in threads (I/O-bound work: encoding, writing) or in a process pool (CPU-bound work: decoding).
+A full queue blocks the stage before it, so a slow stage slows down the whole pipeline instead of filling memory.
+For every stage the pipeline measures the busy time, the time waiting for input (starving)
+and the time waiting for space in the next queue (backpressure).
+"""
+import time
+import queue
+import threading
+
+from typing import List
+from typing import Tuple
+from typing import Callable
+from typing import Iterable
+from typing import Iterator
+from collections import deque
+
+
+# End of the items in a queue
+_END = None
+
+
+class StageStats:
+    __slots__ = ("name", "workers", "items", "busy_time", "input_wait_time", "output_wait_time", "elapsed_time")
+
+    def __init__(self, name: str, workers: int):
+        """ Timings of a stage, times are summed over the workers of the stage """
+        self.name = name
+        self.workers = workers
+        self.items = 0
+        self.busy_time = 0.0
+        self.input_wait_time = 0.0
+        self.output_wait_time = 0.0
+        self.elapsed_time = 0.0
+
+    @property
+    def throughput(self) -> float:
+        """ Items per second """
+        return self.items / self.elapsed_time if self.elapsed_time > 0 else 0.0
+
+    def as_dict(self) -> dict:
+        stats = {field: getattr(self, field) for field in self.__slots__}
+        stats["throughput"] = self.throughput
+        return stats
+
+
+class _Stage:
+    def __init__(
+            self,
+            name: str,
+            func: Callable,
+            args: tuple,
+            workers: int,
+            use_processes: bool,
+            initializer: Callable,
+            initargs: tuple,
+            pass_frame_id: bool,
+    ):
+        self.name = name
+        self.func = func
+        self.args = args
+        self.pass_frame_id = pass_frame_id
+        self.workers = workers
+        self.use_processes = use_processes
+        self.initializer = initializer
+        self.initargs = initargs
+        self.stats = StageStats(name, workers)
+        self._lock = threading.Lock()
+        self._running_workers = workers
+
+
+class Pipeline:
+    def __init__(self, items: Iterable[Tuple[int, object, str]], queue_size: int = 16):
+        """
+        :param items: source of (frame_id, value, error) items, read in a thread
+        :param queue_size: max number of items between two stages
+        """
+        self.items = items
+        self.queue_size = queue_size
+        self.stages: List[_Stage] = []
+        self.source_stats = StageStats("read", 1)
+        self._error = None
+        self._error_lock = threading.Lock()
+
+    def add_stage(
+            self,
+            name: str,
+            func: Callable,
+            args: tuple = (),
+            workers: int = 1,
+            use_processes: bool = False,
+            initializer: Callable = None,
+            initargs: tuple = (),
+            pass_frame_id: bool = False,
+    ) -> "Pipeline":
+        """
+        Add a stage converting the values of items with `func(value, *args)`
+        :param name: name of the stage in the report
+        :param func: conversion, module-level (picklable) for process stages
+        :param args: additional arguments of `func`
+        :param workers: number of threads or processes, items may come out of order of several threads
+        :param use_processes: run `func` in a process pool, items keep their order
+        :param initializer: function run once in every process of the pool
+        :param initargs: arguments of the initializer
+        :param pass_frame_id: call `func(frame_id, value, *args)`
+        :return: the pipeline
+        """
+        self.stages.append(_Stage(name, func, args, workers, use_processes, initializer, initargs, pass_frame_id))
+        return self
+
+    def run(self) -> Iterator[Tuple[int, object, str]]:
+        """ Run the stages, yields the items coming out of the last stage """
+        self._error = None
+        queues = [queue.Queue(self.queue_size) for _ in range(len(self.stages) + 1)]
+        threads = [threading.Thread(target=self._read, args=(queues[0],), daemon=True)]
+        for stage, input_queue, output_queue in zip(self.stages, queues[:-1], queues[1:]):
+            if stage.use_processes:
+                threads.append(threading.Thread(
+                        target=self._run_process_stage, args=(stage, input_queue, output_queue), daemon=True
+                ))
+            else:
+                threads += [
+                    threading.Thread(
+                            target=self._run_thread_worker, args=(stage, input_queue, output_queue), daemon=True
+                    )
+                    for _ in range(stage.workers)
+                ]
+        for thread in threads:
+            thread.start()
+
+        while True:
+            item = queues[-1].get()
+            if item is _END:
+                break
+            yield item
+        for thread in threads:
+            thread.join()
+        if self._error is not None:
+            raise self._error
+
+    def _read(self, output_queue: queue.Queue) -> None:
+        stats = self.source_stats
+        start_time = time.perf_counter()
+        try:
+            items = iter(self.items)
+            while True:
+                busy_start = time.perf_counter()
+                item = next(items, _END)
+                stats.busy_time += time.perf_counter() - busy_start
+                if item is _END:
+                    break
+                _put(output_queue, item, stats)
+                stats.items += 1
+        except Exception as e:
+            self._set_error(e)
+        finally:
+            # The next stages end even if the source fails
+            stats.elapsed_time = time.perf_counter() - start_time
+            output_queue.put(_END)
+
+    def _run_thread_worker(self, stage: _Stage, input_queue: queue.Queue, output_queue: queue.Queue) -> None:
+        start_time = time.perf_counter()
+        # Timings of this worker, added to the stage ones at the end
+        stats = StageStats(stage.name, 1)
+        try:
+            while True:
+                item = _get(input_queue, stats)
+                if item is _END:
+                    # Let the other workers of the stage see the end too
+                    input_queue.put(_END)
+                    break
+                busy_start = time.perf_counter()
+                item = _apply(item, stage.func, stage.args, stage.pass_frame_id)
+                stats.busy_time += time.perf_counter() - busy_start
+                stats.items += 1
+                _put(output_queue, item, stats)
+        except Exception as e:
+            self._set_error(e)
+            _drain(input_queue)
+        finally:
+            with stage._lock:
+                stage.stats.items += stats.items
+                stage.stats.busy_time += stats.busy_time
+                stage.stats.input_wait_time += stats.input_wait_time
+                stage.stats.output_wait_time += stats.output_wait_time
+                stage._running_workers -= 1
+                is_last = stage._running_workers == 0
+            if is_last:
+                stage.stats.elapsed_time = time.perf_counter() - start_time
+                output_queue.put(_END)
+
+    def _run_process_stage(self, stage: _Stage, input_queue: queue.Queue, output_queue: queue.Queue) -> None:
+        from concurrent.futures import ProcessPoolExecutor
+
+        start_time = time.perf_counter()
+        # Items in flight are limited, so a slow next stage holds back the input
+        max_pending = stage.workers + self.queue_size
+        # (item, future) of the items in flight
+        pending = deque()
+        try:
+            with ProcessPoolExecutor(stage.workers, initializer=stage.initializer, initargs=stage.initargs) as pool:
+                while True:
+                    item = _get(input_queue, stage.stats)
+                    if item is not _END:
+                        pending.append((item, _submit(pool, item, stage)))
+                    while len(pending) >= max_pending or (item is _END and len(pending) > 0):
+                        busy_start = time.perf_counter()
+                        done_item = _get_result(*pending.popleft())
+                        stage.stats.busy_time += time.perf_counter() - busy_start
+                        stage.stats.items += 1
+                        _put(output_queue, done_item, stage.stats)
+                    if item is _END:
+                        break
+        except Exception as e:
+            self._set_error(e)
+            _drain(input_queue)
+        finally:
+            stage.stats.elapsed_time = time.perf_counter() - start_time
+            output_queue.put(_END)
+
+    def _set_error(self, error: Exception) -> None:
+        """ Keep the first unexpected error of the threads, raised by run() """
+        with self._error_lock:
+            if self._error is None:
+                self._error = error
+
+    def get_stats(self) -> List[StageStats]:
+        return [self.source_stats] + [stage.stats for stage in self.stages]
+
+    def report(self) -> str:
+        """ Table of the stage timings, for process stages busy time is the time waiting for results """
+        lines = [f"{'stage':13s} {'workers':>7s} {'items':>7s} {'items/s':>9s} {'busy':>8s} {'starving':>8s} "
+                 f"{'blocked':>8s}"]
+        for stats in self.get_stats():
+            lines.append(
+                    f"{stats.name:13s} {stats.workers:7d} {stats.items:7d} {stats.throughput:9.1f} "
+                    f"{stats.busy_time:7.2f}s {stats.input_wait_time:7.2f}s {stats.output_wait_time:7.2f}s"
+            )
+        return "\n".join(lines)
+
+
+def _apply(item: Tuple[int, object, str], func: Callable, args: tuple, pass_frame_id: bool) -> Tuple[int, object, str]:
+    """ Errors are kept as messages, exceptions are not always picklable """
+    frame_id, value, error = item
+    if error is not None:
+        return item
+    try:
+        if pass_frame_id:
+            return frame_id, func(frame_id, value, *args), None
+        return frame_id, func(value, *args), None
+    except Exception as e:
+        return frame_id, None, str(e)
+
+
+def _submit(pool, item: Tuple[int, object, str], stage: _Stage):
+    """ Start the conversion of the item in the pool, the future fails if the pool is broken """
+    from concurrent.futures import Future
+    from concurrent.futures import BrokenExecutor
+
+    try:
+        return pool.submit(_apply, item, stage.func, stage.args, stage.pass_frame_id)
+    except BrokenExecutor as e:
+        future = Future()
+        future.set_exception(e)
+        return future
+
+
+def _get_result(item: Tuple[int, object, str], future) -> Tuple[int, object, str]:
+    """ Converted item, a failure of the pool (e.g. a killed worker) is kept as the error of the item """
+    try:
+        return future.result()
+    except Exception as e:
+        if item[2] is not None:
+            return item
+        return item[0], None, str(e)
+
+
+def _drain(input_queue: queue.Queue) -> None:
+    """ Consume the items up to the end, so the previous stages are not blocked by a full queue """
+    while input_queue.get() is not _END:
+        pass
+    input_queue.put(_END)
+
+
+def _get(input_queue: queue.Queue, stats: StageStats):
+    wait_start = time.perf_counter()
+    item = input_queue.get()
+    stats.input_wait_time += time.perf_counter() - wait_start
+    return item
+
+
+def _put(output_queue: queue.Queue, item, stats: StageStats) -> None:
+    wait_start = time.perf_counter()
+    output_queue.put(item)
+    stats.output_wait_time += time.perf_counter() - wait_start
@@ -0,0 +1,194 @@
+"""
+Optional instrumentation of the hot path: timers and call counts per stage, counters (bytes read and written,
+exiftool processes started, ...) and a timeline in the Chrome trace format (chrome://tracing, Perfetto).
+Disabled by default: instrumented functions then only check one global, `enable()` turns it on.
+Only the current process is profiled: worker processes enable their own profilers and send their results
+to the main process to be merged (see fe_tools.batch).
+"""
+import os
+import json
+import time
+import threading
+import functools
+import contextlib
+
+from typing import Dict
+from typing import List
+from typing import Callable
+
+
+_profiler = None
+
+# Shared no-op context of the disabled `span`
+_NULL_SPAN = contextlib.nullcontext()
+
+
+class Profiler:
+    def __init__(self, is_trace: bool = False):
+        """
+        :param is_trace: also keep every call as a timeline event
+        """
+        self.is_trace = is_trace
+        self.start_time = time.perf_counter_ns()
+        # name -> [calls, total ns, max ns]
+        self.timers: Dict[str, List[int]] = {}
+        self.counters: Dict[str, int] = {}
+        self.events = []
+        self._lock = threading.Lock()
+
+    def add_time(self, name: str, start_ns: int, end_ns: int) -> None:
+        duration = end_ns - start_ns
+        with self._lock:
+            timer = self.timers.setdefault(name, [0, 0, 0])
+            timer[0] += 1
+            timer[1] += duration
+            timer[2] = max(timer[2], duration)
+            if self.is_trace:
+                self.events.append({
+                    "name": name,
+                    "ph": "X",
+                    "ts": (start_ns - self.start_time) / 1000,
+                    "dur": duration / 1000,
+                    "pid": os.getpid(),
+                    "tid": threading.get_ident(),
+                })
+
+    def add_count(self, name: str, value: int) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def merge(self, profile: dict) -> None:
+        """ Add the results of another profiler (`as_dict` of a worker process) """
+        # perf_counter is the same monotonic clock in all processes
+        shift_us = (profile["start_time"] - self.start_time) / 1000
+        with self._lock:
+            for name, (calls, total_ns, max_ns) in profile["timers"].items():
+                timer = self.timers.setdefault(name, [0, 0, 0])
+                timer[0] += calls
+                timer[1] += total_ns
+                timer[2] = max(timer[2], max_ns)
+            for name, value in profile["counters"].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+            if self.is_trace:
+                self.events += [dict(event, ts=event["ts"] + shift_us) for event in profile["events"]]
+
+    def as_dict(self) -> dict:
+        """ Picklable results for `merge` """
+        with self._lock:
+            return {
+                "start_time": self.start_time,
+                "timers": {name: list(timer) for name, timer in self.timers.items()},
+                "counters": dict(self.counters),
+                "events": list(self.events),
+            }
+
+    def summary(self) -> str:
+        """ Table of the timers (sorted by total time) and the counters """
+        elapsed = (time.perf_counter_ns() - self.start_time) / 1e9
+        lines = [f"Profile of {elapsed:.2f} s", f"{'timer':32s} {'calls':>8s} {'total':>9s} {'mean':>9s} {'max':>9s}"]
+        for name, (calls, total_ns, max_ns) in sorted(self.timers.items(), key=lambda item: -item[1][1]):
+            lines.append(
+                    f"{name:32s} {calls:8d} {total_ns / 1e9:8.3f}s {total_ns / calls / 1e6:7.3f}ms {max_ns / 1e6:7.3f}ms"
+            )
+        if len(self.counters) > 0:
+            lines.append(f"{'counter':32s} {'value':>8s}")
+            for name, value in sorted(self.counters.items()):
+                lines.append(f"{name:32s} {value:8d}")
+        return "\n".join(lines)
+
+    def save(self, path: str) -> None:
+        """ Save the timers, counters and the timeline as JSON, loadable in chrome://tracing """
+        with self._lock:
+            events = list(self.events)
+            for name, value in self.counters.items():
+                events.append({"name": name, "ph": "C", "ts": 0, "pid": os.getpid(), "args": {"value": value}})
+            profile = {
+                "traceEvents": events,
+                "timers": {
+                    name: {"calls": calls, "total_s": total_ns / 1e9, "max_s": max_ns / 1e9}
+                    for name, (calls, total_ns, max_ns) in self.timers.items()
+                },
+                "counters": dict(self.counters),
+            }
+        with open(path, "w") as profile_file:
+            json.dump(profile, profile_file)
+
+
+def enable(is_trace: bool = False) -> Profiler:
+    """ Start profiling, the previous results are dropped """
+    global _profiler
+    _profiler = Profiler(is_trace)
+    return _profiler
+
+
+def disable() -> Profiler:
+    """ Stop profiling, returns the results """
+    global _profiler
+    profiler, _profiler = _profiler, None
+    return profiler
+
+
+def get_profiler() -> Profiler:
+    """ The active profiler, None if profiling is disabled """
+    return _profiler
+
+
+def save_profile(trace_path: str = None) -> None:
+    """
+    Stop profiling, print the summary and save the timeline, if profiling is enabled
+    :param trace_path: path to .json timeline, None not to save it
+    """
+    profiler = disable()
+    if profiler is None:
+        return
+    print(profiler.summary())
+    if trace_path is not None:
+        profiler.save(trace_path)
+        print(f"Saved the profile timeline to {trace_path}")
+
+
+def timed(name: str) -> Callable:
+    """ Decorator timing the calls of the function under the name """
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            profiler = _profiler
+            if profiler is None:
+                return func(*args, **kwargs)
+            start_ns = time.perf_counter_ns()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profiler.add_time(name, start_ns, time.perf_counter_ns())
+        return wrapper
+    return decorator
+
+
+def span(name: str):
+    """ Context timing its block under the name """
+    if _profiler is None:
+        return _NULL_SPAN
+    return _Span(_profiler, name)
+
+
+def count(name: str, value: int = 1) -> None:
+    """ Add the value to the counter """
+    profiler = _profiler
+    if profiler is not None:
+        profiler.add_count(name, value)
+
+
+class _Span:
+    __slots__ = ("profiler", "name", "start_ns")
+
+    def __init__(self, profiler: Profiler, name: str):
+        self.profiler = profiler
+        self.name = name
+        self.start_ns = None
+
+    def __enter__(self):
+        self.start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.profiler.add_time(self.name, self.start_ns, time.perf_counter_ns())
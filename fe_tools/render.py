@@ -0,0 +1,155 @@
+"""
+Rendering of temperature images to 8-bit images.
+A FrameRenderer keeps its work and output buffers between frames, so rendering a long sequence doesn't allocate
+per frame: clip, scale and the uint8 cast run in place in one float buffer.
+Inputs are never modified. Colormaps are (256, 3) BGR lookup tables, new ones can be added with `register_colormap`.
+"""
+import threading
+import numpy as np
+
+from typing import Dict
+from typing import Tuple
+from typing import Union
+
+
+def _make_colormap(points: Dict[int, Tuple[int, int, int]]) -> np.ndarray:
+    """ Piecewise linear (256, 3) BGR colormap through the {gray value: (b, g, r)} points """
+    gray_values = sorted(points)
+    colormap = np.empty((256, 3), dtype=np.uint8)
+    for channel in range(3):
+        channel_points = [points[gray_value][channel] for gray_value in gray_values]
+        colormap[:, channel] = np.round(np.interp(np.arange(256), gray_values, channel_points))
+    return colormap
+
+
+COLORMAPS = {
+    # Gray values in the red channel, as get_thermal_image_vis always did
+    "red": _make_colormap({0: (0, 0, 0), 255: (0, 0, 255)}),
+    "gray": _make_colormap({0: (0, 0, 0), 255: (255, 255, 255)}),
+    "iron": _make_colormap({
+        0: (0, 0, 0),
+        64: (140, 0, 80),
+        128: (40, 40, 220),
+        192: (0, 170, 255),
+        255: (220, 255, 255),
+    }),
+}
+
+
+def register_colormap(name: str, colormap: np.ndarray) -> None:
+    """ Add a (256, 3) uint8 BGR colormap """
+    colormap = np.asarray(colormap)
+    if colormap.shape != (256, 3) or colormap.dtype != np.uint8:
+        raise ValueError(f"Colormap should be a (256, 3) uint8 array, got {colormap.shape} {colormap.dtype}")
+    COLORMAPS[name] = colormap
+
+
+_thread_renderers = threading.local()
+
+
+def get_renderer(colormap: str = "red") -> "FrameRenderer":
+    """ Renderer of the current thread, renderers are not thread-safe """
+    renderers = getattr(_thread_renderers, "renderers", None)
+    if renderers is None:
+        renderers = _thread_renderers.renderers = {}
+    if colormap not in renderers:
+        renderers[colormap] = FrameRenderer(colormap)
+    return renderers[colormap]
+
+
+def clear_renderers() -> None:
+    """ Drop the renderers (and their buffers) of the current thread """
+    _thread_renderers.renderers = {}
+
+
+class FrameRenderer:
+    def __init__(self, colormap: Union[str, np.ndarray] = "red"):
+        """
+        Renders frames of the same shape reusing the buffers.
+        Returned arrays are the renderer's buffers, they are overwritten by the next frame,
+        pass `out=` or copy them to keep the result
+        :param colormap: name of a registered colormap or a (256, 3) uint8 BGR array
+        """
+        self.colormap = COLORMAPS[colormap] if isinstance(colormap, str) else np.asarray(colormap)
+        self._buffers = {}
+
+    def _buffer(self, name: str, shape: Tuple[int, ...], dtype: type) -> np.ndarray:
+        buffer = self._buffers.get(name)
+        if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+            buffer = np.empty(shape, dtype=dtype)
+            self._buffers[name] = buffer
+        return buffer
+
+    def normalize(self, thermal_np: np.ndarray, out: np.ndarray = None) -> np.ndarray:
+        """
+        Scale the temperatures from min..max of the frame to 0..255
+        :param thermal_np: temperatures
+        :param out: uint8 buffer for the result
+        :return: gray image
+        """
+        work = self._buffer("work", thermal_np.shape, np.float64)
+        np.subtract(thermal_np, np.min(thermal_np), out=work)
+        work /= np.max(work)
+        return self._to_uint8(work, out)
+
+    def gray(self, thermal_np: np.ndarray, min_thr: float, max_thr: float, out: np.ndarray = None) -> np.ndarray:
+        """
+        Clip the temperatures to the thresholds and scale them by the max clipped temperature to 0..255
+        (the mapping of get_thermal_image_vis_gray)
+        :param thermal_np: temperatures
+        :param min_thr: min temperature threshold
+        :param max_thr: max temperature threshold
+        :param out: uint8 buffer for the result
+        :return: gray image
+        """
+        work = self._buffer("work", thermal_np.shape, np.float64)
+        np.clip(thermal_np, min_thr, max_thr, out=work)
+        work /= np.max(work)
+        return self._to_uint8(work, out)
+
+    def gray_raw(
+            self,
+            raw_image: np.ndarray,
+            temperature_lut: np.ndarray,
+            min_thr: float,
+            max_thr: float,
+            out: np.ndarray = None,
+    ) -> np.ndarray:
+        """
+        The same as `gray` for the temperatures of uint16 raw image, without converting the frame:
+        only the 65536 entries of the lookup table are scaled, then the frame is a single take
+        :param raw_image: uint16 raw image
+        :param temperature_lut: temperatures of raw values, see fff_tools.get_temperature_lut
+        :param min_thr: min temperature threshold
+        :param max_thr: max temperature threshold
+        :param out: uint8 buffer for the result
+        :return: gray image
+        """
+        gray_lut = self._buffer("gray_lut", (2 ** 16,), np.uint8)
+        work = self._buffer("lut_work", (2 ** 16,), np.float64)
+        np.clip(temperature_lut, min_thr, max_thr, out=work)
+        # Max of the clipped frame is the clipped value of the frame max
+        work /= work[np.max(raw_image)]
+        self._to_uint8(work, gray_lut)
+        if out is None:
+            out = self._buffer("gray", raw_image.shape, np.uint8)
+        return np.take(gray_lut, raw_image, out=out)
+
+    def colorize(self, gray_img: np.ndarray, out: np.ndarray = None) -> np.ndarray:
+        """
+        Apply the colormap to the gray image
+        :param gray_img: uint8 gray image
+        :param out: (H, W, 3) uint8 buffer for the result
+        :return: BGR image
+        """
+        if out is None:
+            out = self._buffer("color", (*gray_img.shape, 3), np.uint8)
+        return np.take(self.colormap, gray_img, axis=0, out=out)
+
+    def _to_uint8(self, work: np.ndarray, out: np.ndarray = None) -> np.ndarray:
+        """ Multiply the 0..1 values by 255 in place and cast them to uint8 (truncating like astype) """
+        work *= 255
+        if out is None:
+            out = self._buffer("gray", work.shape, np.uint8)
+        np.copyto(out, work, casting="unsafe")
+        return out
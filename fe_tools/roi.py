@@ -0,0 +1,149 @@
+"""
+Decoding of regions of interest instead of whole frames.
+Only the raw pixels of the ROIs (rectangles or masks), optionally every stride-th row and column of them,
+are read from the FFF image and converted, frames of a sequence can be skipped with a frame stride.
+Per-ROI time series of min, max and mean temperature come back as (frames, ROIs) float32 arrays.
+Temperatures are in the unit of the calibration (celsius), without the shift by the frame minimum
+that `get_thermal_image(is_celsius=False)` applies.
+"""
+import numpy as np
+
+from typing import List
+from typing import Sequence
+from typing import NamedTuple
+
+from fe_tools import fff_parser
+from fe_tools import fff_tools
+from fe_tools.seq import Seq
+from fe_tools.fff_parser import FFFError
+
+
+class Roi(NamedTuple):
+    """ Rectangle [top:bottom, left:right] of the frame, optionally with a mask of its pixels """
+    top: int
+    left: int
+    bottom: int
+    right: int
+    mask: np.ndarray = None  # bool (bottom - top, right - left)
+
+    @classmethod
+    def from_rect(cls, x: int, y: int, width: int, height: int) -> "Roi":
+        return cls(y, x, y + height, x + width)
+
+    @classmethod
+    def from_mask(cls, mask: np.ndarray) -> "Roi":
+        """ ROI of the pixels of the frame-sized mask, cropped to their bounding box """
+        mask = np.asarray(mask, dtype=np.bool_)
+        rows, columns = np.flatnonzero(mask.any(axis=1)), np.flatnonzero(mask.any(axis=0))
+        if len(rows) == 0:
+            raise ValueError("Mask of the ROI is empty")
+        top, bottom, left, right = rows[0], rows[-1] + 1, columns[0], columns[-1] + 1
+        return cls(int(top), int(left), int(bottom), int(right), mask[top:bottom, left:right].copy())
+
+    @property
+    def region(self) -> tuple:
+        return self.top, self.left, self.bottom, self.right
+
+
+class RoiSeries(NamedTuple):
+    """ Time series of the ROIs, arrays are indexed by (sampled frame, ROI) """
+    frame_ids: np.ndarray  # ids of the sampled frames in the sequence
+    is_valid: np.ndarray  # bool, False for frames that couldn't be decoded
+    min_temp: np.ndarray
+    max_temp: np.ndarray
+    mean_temp: np.ndarray
+    n_pixels: np.ndarray  # number of converted pixels of every ROI
+
+
+def get_rois_temperature(fff_bytes: bytes, rois: Sequence[Roi], stride: int = 1) -> List[np.ndarray]:
+    """
+    Get the temperatures of the ROIs of the fff image
+    :param fff_bytes: content of the .fff image
+    :param rois: regions of interest
+    :param stride: convert only every stride-th row and column of the ROIs
+    :return: temperature images of the ROIs, pixels outside of their masks are NaN
+    """
+    raw_rois, calibration = _get_raw_rois(fff_bytes, rois, stride)
+    thermal_rois = []
+    for roi, raw_roi in zip(rois, raw_rois):
+        thermal_roi = _raw2temperature(raw_roi, calibration)
+        if roi.mask is not None:
+            thermal_roi[~roi.mask[::stride, ::stride]] = np.nan
+        thermal_rois.append(thermal_roi)
+    return thermal_rois
+
+
+def get_roi_series(
+        seq: Seq,
+        rois: Sequence[Roi],
+        stride: int = 1,
+        frame_stride: int = 1,
+        start: int = 0,
+        stop: int = None,
+) -> RoiSeries:
+    """
+    Get the min, max and mean temperature of the ROIs in the frames of the sequence
+    :param seq: sequence, memory-mapped to read only the pages of the ROIs
+    :param rois: regions of interest
+    :param stride: use only every stride-th row and column of the ROIs
+    :param frame_stride: use only every frame_stride-th frame
+    :param start: first frame
+    :param stop: frame to stop before, the end of the sequence by default
+    :return: time series of the ROIs
+    """
+    frame_ids = seq.get_frame_ids(slice(start, stop, frame_stride))
+    masks = [roi.mask[::stride, ::stride] if roi.mask is not None else None for roi in rois]
+    n_pixels = np.array([_count_pixels(roi, mask, stride) for roi, mask in zip(rois, masks)], dtype=np.int64)
+    if np.any(n_pixels == 0):
+        raise ValueError("ROIs should have pixels at the stride")
+
+    shape = (len(frame_ids), len(rois))
+    series = RoiSeries(
+            frame_ids=frame_ids,
+            is_valid=np.zeros(len(frame_ids), dtype=np.bool_),
+            min_temp=np.full(shape, np.nan, dtype=np.float32),
+            max_temp=np.full(shape, np.nan, dtype=np.float32),
+            mean_temp=np.full(shape, np.nan, dtype=np.float32),
+            n_pixels=n_pixels,
+    )
+    for series_id, frame_id in enumerate(frame_ids):
+        try:
+            raw_rois, calibration = _get_raw_rois(seq[int(frame_id)], rois, stride)
+        except Exception as e:
+            print(f"Error: {e}")
+            continue
+        for roi_id, (raw_roi, mask) in enumerate(zip(raw_rois, masks)):
+            thermal_roi = _raw2temperature(raw_roi if mask is None else raw_roi[mask], calibration)
+            series.min_temp[series_id, roi_id] = np.min(thermal_roi)
+            series.max_temp[series_id, roi_id] = np.max(thermal_roi)
+            series.mean_temp[series_id, roi_id] = np.mean(thermal_roi)
+        series.is_valid[series_id] = True
+    return series
+
+
+def _get_raw_rois(fff_bytes: bytes, rois: Sequence[Roi], stride: int) -> tuple:
+    """ Get the raw images of the ROIs (copies) and the calibration of the fff image """
+    try:
+        raw_image = fff_parser.get_raw_image_view(fff_bytes)
+    except FFFError:
+        # Formats only exiftool knows
+        raw_image = fff_tools.get_raw_image_np(fff_bytes, use_exiftool=True)
+    raw_rois = []
+    for roi in rois:
+        if not (0 <= roi.top < roi.bottom <= raw_image.shape[0] and 0 <= roi.left < roi.right <= raw_image.shape[1]):
+            raise ValueError(f"ROI {roi.region} is outside of the {raw_image.shape} raw image")
+        raw_rois.append(raw_image[roi.top:roi.bottom:stride, roi.left:roi.right:stride].copy())
+    return raw_rois, fff_tools.get_calibration(fff_bytes)
+
+
+def _count_pixels(roi: Roi, mask: np.ndarray, stride: int) -> int:
+    """ Number of pixels of the ROI at the stride, mask is the ROI mask at the stride """
+    if mask is not None:
+        return int(np.count_nonzero(mask))
+    return len(range(roi.top, roi.bottom, stride)) * len(range(roi.left, roi.right, stride))
+
+
+def _raw2temperature(raw: np.ndarray, calibration: fff_tools.Calibration) -> np.ndarray:
+    if raw.dtype == np.uint16:
+        return fff_tools.raw2temperature_lut(raw, *calibration)
+    return fff_tools.raw2temperature(raw, *calibration)
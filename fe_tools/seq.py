@@ -1,59 +1,309 @@
+import os
 import re
+import json
+import mmap
+import numpy as np
+
+from fe_tools import profiling
+from fe_tools import fff_parser
+from fe_tools import fff_tools
+from fe_tools.files import atomic_write
+from fe_tools.fff_parser import FFFError
 
 
 class Seq:
-    def __init__(self, input_file):
+    def __init__(self, input_file, use_mmap=False, use_index=False, index_file=None):
         """
         Load a FLIR SEQ file. Currently, this must be a SEQ
         file containing FFF files. The resulting object can
         be indexed as a normal array and will return the
+        FFF image bytes.
+        With use_mmap the file is memory-mapped instead of read into RAM,
+        frames are zero-copy memoryviews and frame offsets are found lazily,
+        so opening the file and reading the first frames costs the same for any file size.
+        With use_index the frame offsets are loaded from the sidecar index file
+        (`<input_file>.idx`, or index_file) if it is up to date, and saved to it once the whole file is indexed.
         """
-        with open(input_file, 'rb') as seq_file:
-            self.seq_blob = seq_file.read()
-
-        self._fff_it = self._get_fff_iterator(self.seq_blob)
+        self.input_file = input_file
+        self.use_mmap = use_mmap
+        self.use_index = use_index
+        self._index_file = index_file
+        self._seq_file = None
+        if use_mmap and os.path.getsize(input_file) > 0:
+            self._seq_file = open(input_file, 'rb')
+            self.seq_blob = mmap.mmap(self._seq_file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            with open(input_file, 'rb') as seq_file:
+                self.seq_blob = seq_file.read()
+            profiling.count("seq.bytes_read", len(self.seq_blob))
 
+        # (offset, chunksize) of the frames found so far
         self.pos = []
-        prev_pos = 0
+        self._next_offset = 0
+        self._is_indexed = False
 
-        # Iterate through sequence to get frame offsets
-        for match in self._fff_it:
-            index = match.start()
-            chunksize = index - prev_pos
-            self.pos.append((index, chunksize))
-            prev_pos = index
-
-        # Fix up the first chunk size
-        if len(self.pos) > 1:
-            self.pos[0] = (0, self.pos[1][1])
-        elif len(self.pos) == 1:
-            self.pos[0] = (0, len(self.seq_blob))
+        if use_index:
+            self.load_index()
+        if not use_mmap:
+            self._index_all()
 
     @staticmethod
-    def _get_fff_iterator(seq_blob):
+    def _get_fff_iterator(seq_blob, start=0):
         """
         Internal function which returns an iterator containing the
-        indices of the files in the SEQ. Probably this should be
-        converted to something a bit more intelligent which
-        actually identifies the size of the records in the file.
+        indices of the FFF magic bytes in the SEQ from the start offset.
+        Only used to resync when the next frame doesn't follow the previous one
         """
         magic_pattern_fff = "\x46\x46\x46\x00".encode()
 
         valid = re.compile(magic_pattern_fff)
-        return valid.finditer(seq_blob)
+        return valid.finditer(seq_blob, start)
+
+    @profiling.timed("seq.find_frame")
+    def _find_frame(self, offset):
+        """
+        Find the first valid FFF image starting at the offset or after it.
+        Returns (offset, chunksize) or None
+        """
+        if bytes(self.seq_blob[offset:offset + 4]) == fff_parser.FFF_MAGIC:
+            frame = self._get_frame(offset)
+            if frame is not None:
+                return frame
+            # Corrupt header, the frames after it are searched
+            offset += 1
+        profiling.count("seq.resyncs")
+        for match in self._get_fff_iterator(self.seq_blob, offset):
+            frame = self._get_frame(match.start())
+            if frame is not None:
+                return frame
+        return None
+
+    def _get_frame(self, offset):
+        """
+        Returns (offset, chunksize) of the FFF image at the offset,
+        None for magic bytes inside pixel data, a corrupt header or a truncated frame
+        """
+        with memoryview(self.seq_blob) as view, view[offset:] as frame_view:
+            try:
+                return offset, fff_parser.get_frame_size(frame_view)
+            except FFFError:
+                return None
+
+    def _index_next(self):
+        """
+        Read the record directory of the next frame and add it to the offsets.
+        Frames are expected to follow each other, otherwise the next valid FFF header is searched.
+        Returns False if there are no more frames
+        """
+        if self._is_indexed:
+            return False
+        frame = self._find_frame(self._next_offset)
+        if frame is None:
+            self._is_indexed = True
+            if self.use_index:
+                self.save_index()
+            return False
+        offset, chunksize = frame
+        self.pos.append((offset, chunksize))
+        self._next_offset = offset + chunksize
+        return True
+
+    def _index_all(self):
+        """
+        Iterate through sequence to get all frame offsets
+        """
+        while self._index_next():
+            pass
+
+    @property
+    def index_file(self):
+        """
+        Path of the sidecar index file
+        """
+        if self._index_file is not None:
+            return self._index_file
+        return f"{self.input_file}.idx"
+
+    @profiling.timed("seq.load_index")
+    def load_index(self):
+        """
+        Load the frame offsets from the sidecar index file.
+        Returns False if there is no index file or it was made for another version of the SEQ file
+        """
+        try:
+            with open(self.index_file, 'r') as index_file:
+                index = json.load(index_file)
+        except (OSError, ValueError):
+            return False
+        stat = os.stat(self.input_file)
+        if index.get("file_size") != stat.st_size or index.get("mtime_ns") != stat.st_mtime_ns:
+            return False
+
+        self.pos = [tuple(frame_pos) for frame_pos in index["pos"]]
+        # A frame truncated at the end is indexed by `refresh` once it is complete
+        self._next_offset = sum(self.pos[-1]) if len(self.pos) > 0 else 0
+        self._is_indexed = True
+        return True
+
+    @profiling.timed("seq.save_index")
+    def save_index(self):
+        """
+        Save the frame offsets of the whole sequence to the sidecar index file.
+        The index is only a cache: returns False if it can't be written, e.g. next to a SEQ file in a read-only dir
+        """
+        self._index_all()
+        stat = os.stat(self.input_file)
+        index = {"file_size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "pos": self.pos}
+        try:
+            with atomic_write(self.index_file) as index_file:
+                json.dump(index, index_file)
+        except OSError:
+            return False
+        return True
+
+    def refresh(self):
+        """
+        Pick up the bytes appended to the file since it was opened or refreshed, e.g. while it is being recorded.
+        Indexing continues from the end of the last frame found, a frame truncated at the end of the file
+        is indexed once it is complete. Returns the number of new bytes
+        """
+        size = os.path.getsize(self.input_file)
+        old_size = len(self.seq_blob)
+        if size <= old_size:
+            return 0
+        if self.use_mmap:
+            if self._seq_file is None:
+                self._seq_file = open(self.input_file, 'rb')
+            # Memoryviews of the frames may still use the previous map, it is unmapped once they are released
+            self.seq_blob = mmap.mmap(self._seq_file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            with open(self.input_file, 'rb') as seq_file:
+                seq_file.seek(old_size)
+                self.seq_blob += seq_file.read()
+        profiling.count("seq.bytes_appended", size - old_size)
+        self._is_indexed = False
+        return size - old_size
 
     def __len__(self):
         """
         Returns the length of the sequence
         """
+        self._index_all()
         return len(self.pos)
 
     def __getitem__(self, index):
         """
         Return a byte string containing the FFF image in the sequence
+        (a memoryview in the mmap mode).
+        A slice or a list/array of indices returns the (N, H, W) stack of raw images instead
         """
+        if isinstance(index, (slice, list, tuple, np.ndarray)):
+            return self.get_raw_stack(index)
+        if index < 0:
+            self._index_all()
+        while index >= len(self.pos) and self._index_next():
+            pass
 
         offset, chunksize = self.pos[index]
+        profiling.count("seq.frame_bytes", chunksize)
+        if self.use_mmap:
+            return memoryview(self.seq_blob)[offset:offset + chunksize]
         chunk = self.seq_blob[offset:offset + chunksize]
 
         return chunk
+
+    def get_frame_ids(self, indices):
+        """
+        Convert a slice, a list/array of indices or a boolean mask to the array of frame ids
+        """
+        if isinstance(indices, slice):
+            return np.arange(*indices.indices(len(self)))
+        frame_ids = np.asarray(indices)
+        if frame_ids.dtype == np.bool_:
+            return np.flatnonzero(frame_ids)
+        frame_ids = frame_ids.astype(np.int64).reshape(-1)
+        if np.any(frame_ids < 0):
+            frame_ids = np.where(frame_ids < 0, frame_ids + len(self), frame_ids)
+        return frame_ids
+
+    def get_raw_stack(self, indices, out=None):
+        """
+        Read the raw images of the frames into one (N, H, W) array
+        :param indices: slice, list/array of indices or boolean mask of the frames
+        :param out: preallocated buffer for the stack
+        :return: stack of raw images
+        """
+        return self._get_raw_stack(self.get_frame_ids(indices), out)
+
+    def _get_raw_stack(self, frame_ids, out=None, calibrations=None):
+        """
+        Read the raw images of the frames, and their calibrations into the (N, 7) array if it is given,
+        so every frame is read once
+        """
+        if out is None:
+            if len(frame_ids) == 0:
+                return np.empty((0, 0, 0), dtype=np.uint16)
+            first_raw = fff_tools.get_raw_image_np(self[int(frame_ids[0])])
+            out = np.empty((len(frame_ids), *first_raw.shape), dtype=np.uint16)
+        elif len(out) != len(frame_ids):
+            raise ValueError(f"Buffer is for {len(out)} frames, but {len(frame_ids)} frames are requested")
+
+        for stack_id, frame_id in enumerate(frame_ids):
+            frame_bytes = self[int(frame_id)]
+            try:
+                fff_parser.get_raw_image_np(frame_bytes, out=out[stack_id])
+            except FFFError:
+                # Formats only exiftool knows
+                out[stack_id] = fff_tools.get_raw_image_np(frame_bytes, use_exiftool=True)
+            if calibrations is not None:
+                calibrations[stack_id] = fff_tools.get_calibration(frame_bytes).as_tuple()
+        return out
+
+    def get_calibrations(self, indices):
+        """
+        Get the raw to temperature conversion parameters of the frames
+        :param indices: slice, list/array of indices or boolean mask of the frames
+        :return: (N, 7) array of parameters in the order of fff_tools.get_calibration_params
+        """
+        frame_ids = self.get_frame_ids(indices)
+        calibrations = np.empty((len(frame_ids), 7), dtype=np.float64)
+        for stack_id, frame_id in enumerate(frame_ids):
+            calibrations[stack_id] = fff_tools.get_calibration(self[int(frame_id)]).as_tuple()
+        return calibrations
+
+    def get_thermal_stack(self, indices, dtype=np.float64, out=None):
+        """
+        Get the (N, H, W) stack of temperatures (in Celsius) of the frames
+        :param indices: slice, list/array of indices or boolean mask of the frames
+        :param dtype: float32 or float64 type of the stack
+        :param out: preallocated buffer for the stack
+        :return: stack of temperatures
+        """
+        frame_ids = self.get_frame_ids(indices)
+        calibrations = np.empty((len(frame_ids), 7), dtype=np.float64)
+        raw_stack = self._get_raw_stack(frame_ids, calibrations=calibrations)
+        return fff_tools.raw2temperature_stack(raw_stack, calibrations, dtype=dtype, out=out)
+
+    def __iter__(self):
+        """
+        Iterate through the frames, indexing them on the way
+        """
+        frame_id = 0
+        while frame_id < len(self.pos) or self._index_next():
+            yield self[frame_id]
+            frame_id += 1
+
+    def close(self):
+        """
+        Close the memory-mapped file. Memoryviews of the frames must be released before
+        """
+        if self._seq_file is not None:
+            self.seq_blob.close()
+            self._seq_file.close()
+            self._seq_file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
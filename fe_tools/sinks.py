@@ -0,0 +1,383 @@
+"""
+Streaming sinks for whole-sequence tensors.
+Frames are written to disk as soon as they are decoded, so memory doesn't grow with the sequence length,
+and a sink reopened after an interrupted run knows which frames are already written.
+
+- NpySink: preallocated .npy file written through a memmap, frames can be written in any order
+- ChunkedSink: directory of compressed chunks of `chunk_frames` frames (zarr-like layout)
+- TiffStackSink: multi-page BigTIFF, one page per frame, optionally compressed and tiled
+- VideoSink: video stream of uint8 frames, lossless (FFV1) or MJPEG
+"""
+import os
+import json
+import numpy as np
+
+from glob import glob
+from typing import Tuple
+
+from fe_tools.files import atomic_write
+
+
+class FrameSink:
+    """ Base class of the sinks, frame shape and dtype are taken from the first written frame if not given """
+
+    def __init__(self, frame_shape: Tuple[int, ...] = None, dtype: type = None):
+        self.frame_shape = tuple(frame_shape) if frame_shape is not None else None
+        self.dtype = np.dtype(dtype) if dtype is not None else None
+
+    def write(self, frame_id: int, frame: np.ndarray) -> None:
+        """ Write the frame to the position frame_id of the tensor """
+        if self.frame_shape is None:
+            self.frame_shape = frame.shape
+        if self.dtype is None:
+            self.dtype = frame.dtype
+        if frame.shape != self.frame_shape:
+            raise ValueError(f"Frame {frame_id} has shape {frame.shape}, expected {self.frame_shape}")
+        self._write(frame_id, frame)
+
+    def _write(self, frame_id: int, frame: np.ndarray) -> None:
+        raise NotImplementedError
+
+    def is_written(self, frame_id: int) -> bool:
+        """ If the frame was written by this or a previous run """
+        raise NotImplementedError
+
+    def close(self) -> None:
+        raise NotImplementedError
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class NpySink(FrameSink):
+    def __init__(self, path: str, n_frames: int, frame_shape: Tuple[int, ...] = None, dtype: type = None):
+        """
+        Tensor of n_frames frames in a .npy file, allocated on the first write.
+        Written frames are marked in `<path>.done.npy`, which is removed on close when all frames are written
+        :param path: path to .npy file
+        :param n_frames: number of frames in the tensor
+        :param frame_shape: shape of a frame
+        :param dtype: type of the tensor
+        """
+        super().__init__(frame_shape, dtype)
+        self.path = path
+        self.n_frames = n_frames
+        self.done_path = f"{path}.done.npy"
+        self._tensor = None
+        self._done = None
+
+        if os.path.isfile(path) and os.path.isfile(self.done_path):
+            # Resume an interrupted run
+            self._tensor = np.load(path, mmap_mode="r+")
+            self._done = np.load(self.done_path, mmap_mode="r+")
+            self.frame_shape = self._tensor.shape[1:]
+            self.dtype = self._tensor.dtype
+        elif os.path.isfile(path):
+            # Complete tensor
+            self._tensor = np.load(path, mmap_mode="r")
+            self.frame_shape = self._tensor.shape[1:]
+            self.dtype = self._tensor.dtype
+
+    def _write(self, frame_id: int, frame: np.ndarray) -> None:
+        if self._tensor is None:
+            self._tensor = np.lib.format.open_memmap(
+                    self.path, mode="w+", dtype=self.dtype, shape=(self.n_frames, *self.frame_shape)
+            )
+            self._done = np.lib.format.open_memmap(self.done_path, mode="w+", dtype=np.bool_, shape=(self.n_frames,))
+        self._tensor[frame_id] = frame
+        self._done[frame_id] = True
+
+    def is_written(self, frame_id: int) -> bool:
+        if self._tensor is None:
+            return False
+        return self._done is None or bool(self._done[frame_id])
+
+    def close(self) -> None:
+        if self._tensor is None:
+            return
+        self._tensor.flush()
+        if self._done is not None:
+            self._done.flush()
+            is_complete = bool(np.all(self._done))
+            self._done = None
+            if is_complete:
+                os.remove(self.done_path)
+        self._tensor = None
+
+
+class ChunkedSink(FrameSink):
+    def __init__(
+            self,
+            path: str,
+            chunk_frames: int = 64,
+            frame_shape: Tuple[int, ...] = None,
+            dtype: type = None,
+            compress: bool = True,
+            attrs: dict = None,
+    ):
+        """
+        Tensor in a directory of chunks (`chunk_00000.npz`, ...) of chunk_frames frames
+        and `meta.json` with the frame shape, dtype, number of frames and attributes.
+        Only one chunk is kept in memory, frames of a chunk should be written before the next chunk starts.
+        Missing frames are filled with NaN (0 for integer types)
+        :param path: path to the directory
+        :param chunk_frames: number of frames in a chunk
+        :param frame_shape: shape of a frame
+        :param dtype: type of the tensor
+        :param compress: compress the chunks
+        :param attrs: JSON-serializable attributes of the tensor, e.g. the scale and offset of its encoding
+        """
+        super().__init__(frame_shape, dtype)
+        self.path = path
+        self.chunk_frames = chunk_frames
+        self.compress = compress
+        self.attrs = attrs or {}
+        self.n_frames = 0
+        self._chunk = None
+        self._chunk_id = None
+        self._written_chunks = set()
+
+        meta_path = os.path.join(path, "meta.json")
+        if os.path.isfile(meta_path):
+            # Resume an interrupted run, the chunk files on disk are complete
+            with open(meta_path, "r") as meta_file:
+                meta = json.load(meta_file)
+            self.chunk_frames = meta["chunk_frames"]
+            self.frame_shape = tuple(meta["frame_shape"])
+            self.dtype = np.dtype(meta["dtype"])
+            self.n_frames = meta["n_frames"]
+            self.attrs = meta.get("attrs", {})
+            for chunk_path in glob(os.path.join(path, "chunk_*.npz")):
+                self._written_chunks.add(int(os.path.basename(chunk_path)[len("chunk_"):-len(".npz")]))
+
+    def _write(self, frame_id: int, frame: np.ndarray) -> None:
+        chunk_id = frame_id // self.chunk_frames
+        if chunk_id != self._chunk_id:
+            self._flush()
+            self._chunk_id = chunk_id
+            self._chunk = np.full((self.chunk_frames, *self.frame_shape), _fill_value(self.dtype), dtype=self.dtype)
+        self._chunk[frame_id % self.chunk_frames] = frame
+        self.n_frames = max(self.n_frames, frame_id + 1)
+
+    def _flush(self) -> None:
+        """ Write the current chunk and the metadata """
+        if self._chunk is None:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        chunk_path = os.path.join(self.path, f"chunk_{self._chunk_id:05d}.npz")
+        with atomic_write(chunk_path, "wb") as chunk_file:
+            if self.compress:
+                np.savez_compressed(chunk_file, frames=self._chunk)
+            else:
+                np.savez(chunk_file, frames=self._chunk)
+        self._written_chunks.add(self._chunk_id)
+        self._chunk = None
+        self._chunk_id = None
+
+        meta = {
+            "chunk_frames": self.chunk_frames,
+            "frame_shape": list(self.frame_shape),
+            "dtype": self.dtype.str,
+            "n_frames": self.n_frames,
+            "attrs": self.attrs,
+        }
+        with atomic_write(os.path.join(self.path, "meta.json")) as meta_file:
+            json.dump(meta, meta_file)
+
+    def is_written(self, frame_id: int) -> bool:
+        return frame_id // self.chunk_frames in self._written_chunks
+
+    def close(self) -> None:
+        self._flush()
+
+
+class SequentialSink(FrameSink):
+    """
+    Base class of the sinks appending frames to a stream, frames must be written in the frame order.
+    Frames that are skipped (e.g. not decoded) are written as NaN (0 for integer types),
+    so the position of a frame in the stream is always its frame id
+    """
+
+    def __init__(self, n_frames: int = None, frame_shape: Tuple[int, ...] = None, dtype: type = None):
+        """
+        :param n_frames: number of frames, the missing last frames are filled on close
+        :param frame_shape: shape of a frame
+        :param dtype: type of the frames
+        """
+        super().__init__(frame_shape, dtype)
+        self.n_frames = n_frames
+        self.n_written = 0
+
+    def _write(self, frame_id: int, frame: np.ndarray) -> None:
+        if frame_id < self.n_written:
+            raise ValueError(f"Frame {frame_id} is already written, frames should be written in order")
+        self._fill(frame_id)
+        self._append(frame)
+        self.n_written += 1
+
+    def _fill(self, n_frames: int) -> None:
+        """ Write empty frames up to n_frames """
+        if self.n_written >= n_frames:
+            return
+        empty_frame = np.full(self.frame_shape, _fill_value(self.dtype), dtype=self.dtype)
+        while self.n_written < n_frames:
+            self._append(empty_frame)
+            self.n_written += 1
+
+    def _append(self, frame: np.ndarray) -> None:
+        raise NotImplementedError
+
+    def is_written(self, frame_id: int) -> bool:
+        return frame_id < self.n_written
+
+    def close(self) -> None:
+        if self.n_frames is not None and self.frame_shape is not None:
+            self._fill(self.n_frames)
+        self._close()
+
+    def _close(self) -> None:
+        raise NotImplementedError
+
+
+class TiffStackSink(SequentialSink):
+    def __init__(
+            self,
+            path: str,
+            n_frames: int = None,
+            compression: str = None,
+            tile: Tuple[int, int] = None,
+            append: bool = False,
+            frame_shape: Tuple[int, ...] = None,
+            dtype: type = None,
+            attrs: dict = None,
+    ):
+        """
+        Sequence in one BigTIFF file, a page per frame, streamed to disk frame by frame.
+        The pages form one (frames, H, W) series: `tifffile.imread(path)` returns the whole stack.
+        Attributes are saved as JSON in the description of the first page
+        :param path: path to .tiff file
+        :param n_frames: number of frames, the missing last frames are filled on close
+        :param compression: page compression supported by tifffile, e.g. "zlib", "lzma" ("zstd", "lzw" need imagecodecs)
+        :param tile: (height, width) of the tiles, multiples of 16, pages are stored in strips by default
+        :param append: continue the existing file, e.g. after an interrupted run
+        :param frame_shape: shape of a frame
+        :param dtype: type of the frames
+        :param attrs: JSON-serializable attributes of the stack, e.g. the scale and offset of its encoding
+        """
+        import tifffile as tiff
+
+        super().__init__(n_frames, frame_shape, dtype)
+        self.path = path
+        self.attrs = attrs
+        self.compression = compression
+        self.tile = tuple(tile) if tile is not None else None
+        if append and os.path.isfile(path):
+            try:
+                with tiff.TiffFile(path) as tiff_file:
+                    self.n_written = len(tiff_file.pages)
+                    if self.n_written > 0:
+                        self.frame_shape = tiff_file.pages[0].shape
+                        self.dtype = tiff_file.pages[0].dtype
+            except (OSError, ValueError, tiff.TiffFileError):
+                # Damaged by an interrupted write, start anew
+                append = False
+        self._writer = tiff.TiffWriter(path, bigtiff=True, append=append and os.path.isfile(path))
+
+    def _append(self, frame: np.ndarray) -> None:
+        # No shaped metadata, so the uniform pages are read as one series
+        description = json.dumps(self.attrs) if self.attrs and self.n_written == 0 else None
+        self._writer.write(
+                frame, photometric="minisblack", compression=self.compression, tile=self.tile, metadata=None,
+                description=description
+        )
+
+    def _close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+# Name -> (fourcc, OpenCV backend, file extension)
+VIDEO_CODECS = {
+    # Lossless
+    "ffv1": ("FFV1", "CAP_FFMPEG", ".mkv"),
+    # Lossy, quality is settable
+    "mjpg": ("MJPG", "CAP_OPENCV_MJPEG", ".avi"),
+}
+
+
+class VideoSink(SequentialSink):
+    def __init__(
+            self,
+            path: str,
+            fps: float = 25.0,
+            codec: str = "ffv1",
+            quality: int = 95,
+            n_frames: int = None,
+            frame_shape: Tuple[int, ...] = None,
+    ):
+        """
+        Sequence of uint8 gray (H, W) or BGR (H, W, 3) frames as a video stream, the stream is opened on the first write
+        :param path: path to the video file, see VIDEO_CODECS for the extension of the codec
+        :param fps: frame rate of the video
+        :param codec: name of the codec in VIDEO_CODECS
+        :param quality: 0..100 quality of the lossy codecs
+        :param n_frames: number of frames, the missing last frames are filled on close
+        :param frame_shape: shape of a frame
+        """
+        super().__init__(n_frames, frame_shape, np.uint8)
+        if codec not in VIDEO_CODECS:
+            raise ValueError(f"Unknown codec {codec}, expected one of {list(VIDEO_CODECS)}")
+        self.path = path
+        self.fps = fps
+        self.codec = codec
+        self.quality = quality
+        self._writer = None
+
+    def _append(self, frame: np.ndarray) -> None:
+        import cv2
+
+        fourcc, backend, _ = VIDEO_CODECS[self.codec]
+        # The MJPEG writer of OpenCV breaks gray frames
+        is_color = frame.ndim == 3 or self.codec == "mjpg"
+        if self._writer is None:
+            height, width = frame.shape[:2]
+            self._writer = cv2.VideoWriter(
+                    self.path, getattr(cv2, backend), cv2.VideoWriter_fourcc(*fourcc), self.fps, (width, height),
+                    isColor=is_color
+            )
+            if not self._writer.isOpened():
+                raise OSError(f"Can't open video {self.path} for writing with {self.codec}")
+            self._writer.set(cv2.VIDEOWRITER_PROP_QUALITY, self.quality)
+        if is_color and frame.ndim == 2:
+            frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+        self._writer.write(frame)
+
+    def _close(self) -> None:
+        if self._writer is not None:
+            self._writer.release()
+            self._writer = None
+
+
+def load_chunked(path: str) -> np.ndarray:
+    """ Load the whole tensor written by ChunkedSink """
+    with open(os.path.join(path, "meta.json"), "r") as meta_file:
+        meta = json.load(meta_file)
+    dtype = np.dtype(meta["dtype"])
+    chunk_frames = meta["chunk_frames"]
+    tensor = np.full((meta["n_frames"], *meta["frame_shape"]), _fill_value(dtype), dtype=dtype)
+    for chunk_start in range(0, meta["n_frames"], chunk_frames):
+        chunk_path = os.path.join(path, f"chunk_{chunk_start // chunk_frames:05d}.npz")
+        if not os.path.isfile(chunk_path):
+            continue
+        with np.load(chunk_path) as chunk:
+            frames = chunk["frames"]
+        tensor[chunk_start:chunk_start + chunk_frames] = frames[:meta["n_frames"] - chunk_start]
+    return tensor
+
+
+def _fill_value(dtype: np.dtype):
+    return np.nan if np.issubdtype(dtype, np.floating) else 0
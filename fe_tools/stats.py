@@ -0,0 +1,202 @@
+"""
+Single-pass statistics of SEQ files on raw counts.
+Per frame min, max, mean and percentiles of raw values and a histogram for the whole sequence are computed
+without converting frames to temperature, only the extremes are converted with the calibration of their frame.
+Results are cached next to the SEQ file (`<seq_path>.stats.npz`) and reused while its size and mtime are the same.
+"""
+import os
+import numpy as np
+
+from typing import Dict
+from typing import List
+from typing import Tuple
+from typing import Optional
+from typing import NamedTuple
+from typing import Sequence
+from multiprocessing import Pool
+
+from fe_tools.seq import Seq
+from fe_tools.files import atomic_write
+from fe_tools.fff_tools import raw2temperature
+from fe_tools.fff_tools import get_calibration
+from fe_tools.fff_tools import get_raw_image_np
+
+
+# Bump when the cached statistics change
+STATS_VERSION = 1
+DEFAULT_PERCENTILES = (1.0, 50.0, 99.0)
+
+
+class SeqStats(NamedTuple):
+    """ Statistics of a sequence, arrays are indexed by frame """
+    is_valid: np.ndarray  # bool, False for frames that couldn't be decoded
+    min_raw: np.ndarray
+    max_raw: np.ndarray
+    mean_raw: np.ndarray
+    percentiles: np.ndarray  # percentile values in percent
+    percentiles_raw: np.ndarray  # (frames, percentiles)
+    min_temp: np.ndarray  # celsius
+    max_temp: np.ndarray  # celsius
+    histogram: np.ndarray  # counts of the 65536 raw values in the whole sequence
+
+    @property
+    def seq_min_temp(self) -> float:
+        return float(np.min(self.min_temp[self.is_valid])) if np.any(self.is_valid) else np.nan
+
+    @property
+    def seq_max_temp(self) -> float:
+        return float(np.max(self.max_temp[self.is_valid])) if np.any(self.is_valid) else np.nan
+
+    def seq_percentiles_raw(self, percentiles: Sequence[float] = None) -> np.ndarray:
+        """ Percentiles of raw values of the whole sequence """
+        percentiles = self.percentiles if percentiles is None else percentiles
+        return histogram_percentiles(self.histogram, percentiles)
+
+
+def get_seq_stats(
+        seq_path: str,
+        percentiles: Sequence[float] = DEFAULT_PERCENTILES,
+        use_cache: bool = True,
+) -> SeqStats:
+    """
+    Get statistics of the SEQ file
+    :param seq_path: path to .seq file
+    :param percentiles: percentiles of raw values per frame, in percent
+    :param use_cache: load and save the cached statistics
+    :return: statistics of the sequence
+    """
+    percentiles = np.asarray(percentiles, dtype=np.float64)
+    if use_cache:
+        stats = _load_cache(seq_path, percentiles)
+        if stats is not None:
+            return stats
+
+    with Seq(seq_path, use_mmap=True) as seq:
+        n_frames = len(seq)
+        stats = SeqStats(
+                is_valid=np.zeros(n_frames, dtype=np.bool_),
+                min_raw=np.zeros(n_frames, dtype=np.uint16),
+                max_raw=np.zeros(n_frames, dtype=np.uint16),
+                mean_raw=np.full(n_frames, np.nan),
+                percentiles=percentiles,
+                percentiles_raw=np.zeros((n_frames, len(percentiles)), dtype=np.uint16),
+                min_temp=np.full(n_frames, np.nan),
+                max_temp=np.full(n_frames, np.nan),
+                histogram=np.zeros(2 ** 16, dtype=np.int64),
+        )
+        for frame_id in range(n_frames):
+            try:
+                raw_image, calibration = _decode_frame(seq[frame_id])
+            except Exception as e:
+                print(f"Error: {e}")
+                continue
+            frame_histogram = np.bincount(raw_image.reshape(-1), minlength=2 ** 16)
+            stats.histogram[:] += frame_histogram
+            nonzero = np.flatnonzero(frame_histogram)
+            stats.is_valid[frame_id] = True
+            stats.min_raw[frame_id] = nonzero[0]
+            stats.max_raw[frame_id] = nonzero[-1]
+            stats.mean_raw[frame_id] = np.mean(raw_image)
+            stats.percentiles_raw[frame_id] = histogram_percentiles(frame_histogram, percentiles)
+            # Conversion is monotonic, so the extremes of temperature are at the extremes of raw values
+            stats.min_temp[frame_id], stats.max_temp[frame_id] = raw2temperature(
+                    np.array([nonzero[0], nonzero[-1]]), *calibration
+            )
+
+    if use_cache:
+        _save_cache(seq_path, stats)
+    return stats
+
+
+def get_seqs_stats(
+        seq_paths: List[str],
+        percentiles: Sequence[float] = DEFAULT_PERCENTILES,
+        workers: int = None,
+        use_cache: bool = True,
+) -> Tuple[Dict[str, SeqStats], Dict[str, str]]:
+    """
+    Get statistics of SEQ files, files are processed in parallel.
+    A file that can't be read doesn't stop the others, its error is returned instead
+    :param seq_paths: paths to .seq files
+    :param percentiles: percentiles of raw values per frame, in percent
+    :param workers: number of processes, all CPUs by default
+    :param use_cache: load and save the cached statistics
+    :return: path -> statistics of the files read, path -> error of the failed files
+    """
+    all_stats = {}
+    if use_cache:
+        for seq_path in seq_paths:
+            stats = _load_cache(seq_path, np.asarray(percentiles, dtype=np.float64))
+            if stats is not None:
+                all_stats[seq_path] = stats
+    errors = {}
+    todo = [seq_path for seq_path in seq_paths if seq_path not in all_stats]
+    if len(todo) > 0:
+        workers = min(workers or os.cpu_count() or 1, len(todo))
+        with Pool(workers) as pool:
+            results = pool.starmap(_get_seq_stats_task, [(seq_path, percentiles, use_cache) for seq_path in todo])
+        for seq_path, (stats, error) in zip(todo, results):
+            if error is not None:
+                errors[seq_path] = error
+            else:
+                all_stats[seq_path] = stats
+    return {seq_path: all_stats[seq_path] for seq_path in seq_paths if seq_path in all_stats}, errors
+
+
+def histogram_percentiles(histogram: np.ndarray, percentiles: Sequence[float]) -> np.ndarray:
+    """
+    Percentiles of raw values from their histogram, the lowest value with at least q% of values not above it
+    :param histogram: counts of raw values
+    :param percentiles: percentiles in percent
+    :return: raw values
+    """
+    cumulative = np.cumsum(histogram)
+    if cumulative[-1] == 0:
+        return np.zeros(len(percentiles), dtype=np.uint16)
+    ranks = np.asarray(percentiles, dtype=np.float64) / 100 * cumulative[-1]
+    return np.searchsorted(cumulative, np.maximum(ranks, 1), side="left").astype(np.uint16)
+
+
+def _get_seq_stats_task(
+        seq_path: str,
+        percentiles: Sequence[float],
+        use_cache: bool,
+) -> Tuple[Optional[SeqStats], Optional[str]]:
+    """ Errors are returned as messages, exceptions are not always picklable """
+    try:
+        return get_seq_stats(seq_path, percentiles, use_cache), None
+    except Exception as e:
+        return None, str(e)
+
+
+def _decode_frame(frame_bytes: bytes) -> tuple:
+    """ Get the raw image and the calibration parameters of the frame """
+    return get_raw_image_np(frame_bytes), get_calibration(frame_bytes)
+
+
+def _cache_path(seq_path: str) -> str:
+    return f"{seq_path}.stats.npz"
+
+
+def _load_cache(seq_path: str, percentiles: np.ndarray):
+    """ Load the cached statistics, None if there are no valid ones """
+    try:
+        with np.load(_cache_path(seq_path)) as cache:
+            stat = os.stat(seq_path)
+            key = np.array([STATS_VERSION, stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+            if not np.array_equal(cache["key"], key) or not np.array_equal(cache["percentiles"], percentiles):
+                return None
+            return SeqStats(**{field: cache[field] for field in SeqStats._fields})
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def _save_cache(seq_path: str, stats: SeqStats) -> None:
+    """ The cache is skipped if it can't be written, e.g. next to a SEQ file in a read-only dir """
+    stat = os.stat(seq_path)
+    key = np.array([STATS_VERSION, stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+    try:
+        with atomic_write(_cache_path(seq_path), "wb") as cache_file:
+            np.savez(cache_file, key=key, **stats._asdict())
+    except OSError:
+        pass
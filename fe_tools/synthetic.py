@@ -0,0 +1,100 @@
+"""
+Synthetic FFF images and SEQ files for benchmarks, made from a sample FFF image.
+The sample keeps its header and records (CameraInfo with the calibration), only the RawData record is replaced:
+its raw image is resized to the requested resolution and shifted and noised per frame, so frames differ.
+"""
+import os
+import struct
+import numpy as np
+
+from fe_tools import fff_parser
+
+
+# Resolved from the package, so benchmarks run from any dir
+SAMPLE_FFF_PATH = os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bin", "examples", "frame.fff"
+)
+
+
+def make_fff(template_fff: bytes, raw_image: np.ndarray) -> bytes:
+    """
+    Make an FFF image with the records of the template and the raw image
+    :param template_fff: content of a sample .fff image with an uncompressed little-endian RawData record
+    :param raw_image: (H, W) uint16 raw image
+    :return: content of the new .fff image
+    """
+    byte_order = fff_parser.get_header_byte_order(template_fff)
+    dir_offset, dir_count = struct.unpack_from(f"{byte_order}II", template_fff, 0x18)
+    entries = [
+        struct.unpack_from(f"{byte_order}HHIIII", template_fff, dir_offset + entry_id * fff_parser.FFF_DIR_ENTRY_SIZE)
+        for entry_id in range(dir_count)
+    ]
+    records_start = min(entry[4] for entry in entries if entry[0] != 0)
+    fff_bytes = bytearray(template_fff[:records_start])
+    for entry_id, (record_type, subtype, version, index_id, offset, length) in enumerate(entries):
+        if record_type == 0:
+            continue
+        record = template_fff[offset:offset + length]
+        if record_type == fff_parser.RECORD_TYPE_RAW_DATA:
+            record = _make_raw_record(record, raw_image)
+        struct.pack_into(
+                f"{byte_order}HHIIII", fff_bytes, dir_offset + entry_id * fff_parser.FFF_DIR_ENTRY_SIZE,
+                record_type, subtype, version, index_id, len(fff_bytes), len(record)
+        )
+        fff_bytes += record
+    return bytes(fff_bytes)
+
+
+def make_raw_images(template_fff: bytes, n_frames: int, width: int, height: int, seed: int = 0):
+    """
+    Iterate through n_frames raw images: the raw image of the template resized to width x height,
+    rolled by a few pixels per frame and with noise of a few counts
+    """
+    template_raw = fff_parser.get_raw_image_np(template_fff)
+    rows = np.arange(height) * template_raw.shape[0] // height
+    columns = np.arange(width) * template_raw.shape[1] // width
+    base_raw = template_raw[rows[:, None], columns[None, :]].astype(np.int32)
+    rng = np.random.default_rng(seed)
+    for frame_id in range(n_frames):
+        raw_image = np.roll(base_raw, frame_id * 3, axis=1) + rng.integers(-8, 9, size=base_raw.shape)
+        yield np.clip(raw_image, 0, 2 ** 16 - 1).astype(np.uint16)
+
+
+def make_seq(
+        seq_path: str,
+        n_frames: int,
+        width: int = 640,
+        height: int = 480,
+        template_path: str = SAMPLE_FFF_PATH,
+        seed: int = 0,
+) -> int:
+    """
+    Write a SEQ file of synthetic frames
+    :param seq_path: path to the new .seq file
+    :param n_frames: number of frames
+    :param width: width of the frames
+    :param height: height of the frames
+    :param template_path: path to the sample .fff image
+    :param seed: seed of the noise
+    :return: size of the file in bytes
+    """
+    with open(template_path, "rb") as template_file:
+        template_fff = template_file.read()
+    size = 0
+    with open(seq_path, "wb") as seq_file:
+        for raw_image in make_raw_images(template_fff, n_frames, width, height, seed):
+            size += seq_file.write(make_fff(template_fff, raw_image))
+    return size
+
+
+def _make_raw_record(template_record: bytes, raw_image: np.ndarray) -> bytes:
+    """ RawData record header of the template with the new size, followed by the little-endian raw image """
+    record_header = bytearray(template_record[:0x20])
+    if record_header[:2] != b"\x02\x00":
+        raise fff_parser.FFFError("Template RawData record should be little-endian")
+    height, width = raw_image.shape
+    struct.pack_into("<HH", record_header, 0x02, width, height)
+    # Last column and row of the image
+    struct.pack_into("<H", record_header, 0x0c, width - 1)
+    struct.pack_into("<H", record_header, 0x10, height - 1)
+    return bytes(record_header) + raw_image.astype("<u2").tobytes()
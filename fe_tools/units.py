@@ -0,0 +1,49 @@
+"""
+Unit of measurement of a recording, Celsius or Kelvin: given on the command line (`--unit`, `--celsius`)
+or detected from the first frame with fff_tools.detect_is_celsius.
+Detection picks Kelvin only when the temperature spread of the first frame reaches the Kelvin threshold window,
+i.e. it is wider than min_thr + 273.15 degrees (473 degrees for a min threshold of 200),
+so Kelvin recordings of scenes with a narrower spread need `--unit kelvin`.
+"""
+from typing import Optional
+
+from fe_tools.seq import Seq
+from fe_tools.fff_tools import detect_is_celsius
+
+
+UNITS = ("auto", "celsius", "kelvin")
+
+
+def get_unit_is_celsius(unit: str, is_celsius: bool = False) -> Optional[bool]:
+    """
+    is_celsius of the command line arguments
+    :param unit: one of UNITS
+    :param is_celsius: --celsius flag, the same as the celsius unit
+    :return: if temperature in .seq file is in celsius, None to detect it
+    """
+    if is_celsius:
+        return True
+    return {"auto": None, "celsius": True, "kelvin": False}[unit]
+
+
+def get_is_celsius(seq: Seq, min_thr: float, max_thr: float, is_celsius: bool = None) -> bool:
+    """
+    Detect the unit of measurement from the first frame of the sequence, unless it is given.
+    Kelvin is used if the first frame can't be decoded
+    :param seq: sequence of frames
+    :param min_thr: min temperature threshold of capturing
+    :param max_thr: max temperature threshold of capturing
+    :param is_celsius: if temperature in .seq file is in celsius, None to detect it
+    :return: is_celsius
+    """
+    if is_celsius is not None:
+        return is_celsius
+    try:
+        is_celsius = detect_is_celsius(seq[0], min_thr, max_thr, default=False)
+    except Exception as e:
+        print(f"Error: can't detect the unit of {seq.input_file} from the first frame ({e}), using kelvin")
+        print("Use --unit to set it")
+        return False
+    unit = "celsius" if is_celsius else "kelvin"
+    print(f"Detected unit of measurement of {seq.input_file}: {unit} (use --unit to override)")
+    return is_celsius
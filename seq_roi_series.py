@@ -0,0 +1,65 @@
+"""
+Time series of the min, max and mean temperature of regions of interest of a .seq file.
+Only the pixels of the ROIs of every --frame-stride-th frame are read and converted.
+The series are saved to `<name>_roi_series.npz` next to the .seq file (see fe_tools.roi.RoiSeries)
+"""
+import os
+import argparse
+import numpy as np
+
+from fe_tools.seq import Seq
+from fe_tools.roi import Roi
+from fe_tools.roi import get_roi_series
+
+
+def main():
+    args = parse_args()
+    rois = [Roi.from_rect(*rect) for rect in args.rois]
+    rois += [Roi.from_mask(np.load(mask_path)) for mask_path in args.masks]
+    if len(rois) == 0:
+        raise SystemExit("No ROIs, set --roi or --mask")
+    output_path = args.output or f"{os.path.splitext(args.input_file)[0]}_roi_series.npz"
+
+    with Seq(args.input_file, use_mmap=True, use_index=True) as seq:
+        series = get_roi_series(seq, rois, args.stride, args.frame_stride)
+    np.savez(
+            output_path, regions=np.array([roi.region for roi in rois], dtype=np.int64), stride=args.stride,
+            **series._asdict()
+    )
+    for roi_id, roi in enumerate(rois):
+        valid_max = series.max_temp[series.is_valid, roi_id]
+        max_temp = f"{np.max(valid_max):.1f}" if len(valid_max) > 0 else "-"
+        print(f"ROI {roi_id} {roi.region}: {series.n_pixels[roi_id]} pixels, max={max_temp}")
+    print(f"Saved {len(series.frame_ids)} frames to {output_path}")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Time series of temperatures of regions of interest of a .seq file")
+    parser.add_argument("input_file", type=str, help="Path to .seq file")
+    parser.add_argument(
+            "--roi",
+            dest="rois",
+            type=int,
+            nargs=4,
+            action="append",
+            metavar=("X", "Y", "WIDTH", "HEIGHT"),
+            help="Rectangle of interest, can be repeated",
+            default=[]
+    )
+    parser.add_argument(
+            "--mask",
+            dest="masks",
+            type=str,
+            action="append",
+            help="Frame-sized boolean mask of interest saved as .npy, can be repeated",
+            default=[]
+    )
+    parser.add_argument("--stride", type=int, help="Use every N-th row and column of the ROIs", default=1)
+    parser.add_argument("--frame-stride", type=int, help="Use every N-th frame", default=1)
+    parser.add_argument("--output", type=str, help="Path to .npz file with the series", default=None)
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    main()
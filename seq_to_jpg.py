@@ -9,71 +9,171 @@ Record jpg in grays. Where 0 is 200 (Celsius), 255 is 1000 (Celsius)
 We record the jpg in grayscale. Where 0 is 0 (Celsius), 255 is 500 (Celsius)
 """
 import os
-import cv2
-import shutil
 import argparse
 import numpy as np
 
-from tqdm import tqdm
+from typing import Optional
 
+from fe_tools import profiling
 from fe_tools.seq import Seq
-from fe_tools.fff_tools import get_thermal_image
-from fe_tools.fff_tools import get_thermal_image_vis_gray
+from fe_tools.sinks import VideoSink
+from fe_tools.sinks import VIDEO_CODECS
+from fe_tools.files import make_empty_folder
+from fe_tools.manifest import Manifest
+from fe_tools.change import skip_static_frames
+from fe_tools.pipeline import Pipeline
+from fe_tools.render import get_renderer
+from fe_tools.units import UNITS
+from fe_tools.units import get_is_celsius
+from fe_tools.units import get_unit_is_celsius
+from fe_tools.parallel import add_decode_stages
+
+
+# Threads encoding and writing the frames, the encoders release the GIL
+ENCODE_WORKERS = 2
+WRITE_WORKERS = 2
 
 
 def main():
     args = parse_args()
-    seq2jpg(args.input_file, args.min_thr, args.max_thr, args.is_celsius, args.is_debug)
+    if args.profile or args.profile_trace is not None:
+        profiling.enable(is_trace=args.profile_trace is not None)
+    seq2jpg(
+            args.input_file, args.min_thr, args.max_thr, get_unit_is_celsius(args.unit, args.is_celsius), args.is_debug,
+            args.save_fff, args.workers, args.output, args.codec, args.fps, args.quality, args.skip_static
+    )
+    profiling.save_profile(args.profile_trace)
 
 
-def seq2jpg(seq_path: str, min_thr: float, max_thr: float, is_celsius: bool, is_debug: bool) -> None:
+def seq2jpg(
+        seq_path: str,
+        min_thr: float,
+        max_thr: float,
+        is_celsius: Optional[bool],
+        is_debug: bool,
+        save_fff: bool = False,
+        workers: int = 1,
+        output: str = "frames",
+        codec: str = "ffv1",
+        fps: float = 25.0,
+        quality: int = 95,
+        skip_static: float = None,
+) -> None:
     """
-    Saves frames from a .seq file into .jpg files
+    Saves frames from a .seq file into .jpg files, or the same gray images into one video.
+    Frames go through the decode, encode and write stages of a pipeline.
+    A .jpg per frame is converted only once for the same thresholds, see fe_tools.manifest
     :param seq_path: path to .seq file
     :param min_thr: min temperature threshold of capturing
     :param max_thr: max temperature threshold of capturing
-    :param is_celsius: if temperature in .seq file is in celsius
+    :param is_celsius: if temperature in .seq file is in celsius, None to detect it from the first frame
     :param is_debug: create new folders for debug
+    :param save_fff: also export the frames as .fff files
+    :param workers: number of processes decoding and encoding the frames
+    :param output: "frames" for a .jpg per frame, "video" for `<folder>/<name>.mkv` (.avi for mjpg)
+    :param codec: codec of the video, see fe_tools.sinks.VIDEO_CODECS
+    :param fps: frame rate of the video
+    :param quality: 0..100 quality of the lossy codecs
+    :param skip_static: skip the frames that changed less than this number of raw counts since the last converted one,
+    see fe_tools.change, only for a .jpg per frame
     :return:
     """
+    from tqdm import tqdm
+
+    if skip_static is not None and output != "frames":
+        raise ValueError("Static frames can be skipped only for the frames output")
     folder = seq_path.split(".")[0]
     file_basename = os.path.basename(folder)
     make_empty_folder(folder, is_debug)
-    make_empty_folder(f"{folder}/fff_frames", is_debug)
-    make_empty_folder(f"{folder}/jpg_frames", is_debug)
+    if save_fff:
+        make_empty_folder(f"{folder}/fff_frames", is_debug)
+    if output == "frames":
+        make_empty_folder(f"{folder}/jpg_frames", is_debug)
 
-    seq_iterator = Seq(seq_path)
-    fff_exists = len(os.listdir(f"{folder}/fff_frames")) == len(seq_iterator)
+    seq_iterator = Seq(seq_path, use_mmap=True)
     print(f"Extracting JPG from {seq_path}...")
-    for frame_id, frame_bytes in enumerate(tqdm(seq_iterator)):
+    is_celsius = get_is_celsius(seq_iterator, min_thr, max_thr, is_celsius)
+    manifest = None
+    frame_ids = range(len(seq_iterator))
+    if output == "frames":
+        # Convert only the frames that are not converted yet with the same parameters
+        manifest_params = {"min_thr": min_thr, "max_thr": max_thr, "is_celsius": is_celsius, "save_fff": save_fff}
+        if skip_static is not None:
+            manifest_params["skip_static"] = skip_static
+        manifest = Manifest(f"{folder}/jpg_manifest.json", manifest_params)
+        frame_ids = manifest.get_todo(seq_iterator)
+        print(f"{len(seq_iterator) - len(frame_ids)} of {len(seq_iterator)} frames are up to date")
+        if skip_static is not None:
+            frame_ids = skip_static_frames(
+                    seq_iterator, frame_ids, skip_static, f"{folder}/jpg_frame_map.json", manifest
+            )
+    pipeline = Pipeline((frame_id, seq_iterator.pos[frame_id], None) for frame_id in frame_ids)
+    sink = None
+    if output == "video":
+        # Frames are appended in the frame order, so one thread per stage
+        video_path = f"{folder}/{file_basename}{VIDEO_CODECS[codec][2]}"
+        sink = VideoSink(video_path, fps, codec, quality, len(seq_iterator))
+        add_decode_stages(
+                pipeline, seq_path, is_celsius, np.float64, workers, "render", thermal2gray, (min_thr, max_thr)
+        )
+        pipeline.add_stage("write", sink.write, pass_frame_id=True)
+    else:
+        add_decode_stages(
+                pipeline, seq_path, is_celsius, np.float64, workers, "encode", thermal2jpg, (min_thr, max_thr),
+                ENCODE_WORKERS
+        )
+        pipeline.add_stage("write", write_jpg, (folder, file_basename), WRITE_WORKERS, pass_frame_id=True)
+    for frame_id, output_path, error in tqdm(pipeline.run(), total=len(frame_ids)):
         fff_path = f"{folder}/fff_frames/{frame_id:04d}.fff"
-        if not fff_exists:
-            # Write frame to .fff file
+        if save_fff:
+            # Export frame to .fff file
             with open(fff_path, "wb") as fff_file:
-                fff_file.write(frame_bytes)
+                fff_file.write(seq_iterator[frame_id])
+
+        if error is not None:
+            print(f"Error: {error}")
+        elif manifest is not None:
+            outputs = [output_path, fff_path] if save_fff else [output_path]
+            manifest.add(frame_id, seq_iterator.pos[frame_id], seq_iterator[frame_id], outputs)
+    if sink is not None:
+        sink.close()
+    if manifest is not None:
+        manifest.save()
+    print(pipeline.report())
 
-        # Get thermal image from .fff file
-        try:
-            thermal_image = get_thermal_image(fff_path, is_celsius=is_celsius)
-            if frame_id == 0:
-                ans = input(f"Temperature range is {np.min(thermal_image):.1f} - {np.max(thermal_image):.1f}. "
-                            f"Do you want to change the unit of measurement? "
-                            f"(current: {'celsius' if is_celsius else 'kelvin'})? [y/n]")
-                if ans == "y":
-                    is_celsius = not is_celsius
-                    thermal_image = get_thermal_image(fff_path, is_celsius=is_celsius)
-        except Exception as e:
-            print(f"Error: {e}")
-            continue
 
-        gray_img = get_thermal_image_vis_gray(thermal_image, min_thr, max_thr)
+@profiling.timed("encode.jpg")
+def thermal2jpg(thermal_image: np.ndarray, min_thr: float, max_thr: float) -> bytes:
+    """
+    Encodes temperatures clipped to the thresholds as gray .jpg
+    :param thermal_image: temperatures
+    :param min_thr: min temperature threshold of capturing
+    :param max_thr: max temperature threshold of capturing
+    :return: encoded .jpg image
+    """
+    import cv2
+
+    gray_img = get_renderer().gray(thermal_image, min_thr, max_thr)
+    is_encoded, jpg_img = cv2.imencode(".jpg", gray_img)
+    if not is_encoded:
+        raise ValueError("Can't encode .jpg image")
+    return jpg_img.tobytes()
 
-        # Save thermal frame as .jpg
-        jpg_path = f"{folder}/jpg_frames/{file_basename}_{frame_id:04d}.jpg"
-        cv2.imwrite(jpg_path, gray_img)
 
-    # Remove all .fff files
-    # shutil.rmtree(f"{folder}/fff_frames")
+def thermal2gray(thermal_image: np.ndarray, min_thr: float, max_thr: float) -> np.ndarray:
+    """ Gray image of the temperatures clipped to the thresholds, the same as in the .jpg files """
+    # Own copy, the renderer's buffer is overwritten by the next frame before this one is written
+    return get_renderer().gray(thermal_image, min_thr, max_thr).copy()
+
+
+@profiling.timed("write.jpg")
+def write_jpg(frame_id: int, jpg_bytes: bytes, folder: str, file_basename: str) -> str:
+    """ Save thermal frame as .jpg, returns its path """
+    profiling.count("bytes_written", len(jpg_bytes))
+    jpg_path = f"{folder}/jpg_frames/{file_basename}_{frame_id:04d}.jpg"
+    with open(jpg_path, "wb") as jpg_file:
+        jpg_file.write(jpg_bytes)
+    return jpg_path
 
 
 def parse_args() -> argparse.Namespace:
@@ -85,9 +185,71 @@ def parse_args() -> argparse.Namespace:
             "--celsius",
             dest="is_celsius",
             action="store_true",
-            help="Temperature in celsius in the .seq file",
+            help="Temperature in celsius in the .seq file (the same as --unit celsius)",
+            default=False
+    )
+    parser.add_argument(
+            "--unit",
+            choices=UNITS,
+            help="Unit of measurement of the .seq file, detected from the first frame by default",
+            default="auto"
+    )
+    parser.add_argument(
+            "--save-fff",
+            dest="save_fff",
+            action="store_true",
+            help="Also export the frames as .fff files",
+            default=False
+    )
+    parser.add_argument(
+            "--workers",
+            type=int,
+            help="Number of processes decoding the frames",
+            default=1
+    )
+    parser.add_argument(
+            "--output",
+            choices=["frames", "video"],
+            help="A .jpg file per frame or one video of the sequence",
+            default="frames"
+    )
+    parser.add_argument(
+            "--codec",
+            choices=list(VIDEO_CODECS),
+            help="Video codec: ffv1 is lossless (.mkv), mjpg is lossy (.avi)",
+            default="ffv1"
+    )
+    parser.add_argument(
+            "--fps",
+            type=float,
+            help="Frame rate of the video",
+            default=25.0
+    )
+    parser.add_argument(
+            "--quality",
+            type=int,
+            help="Quality (0..100) of the lossy video codecs",
+            default=95
+    )
+    parser.add_argument(
+            "--skip-static",
+            type=float,
+            help="Skip the frames that changed less than this number of raw counts since the last converted one, "
+                 "`<name>/jpg_frame_map.json` maps every frame to its converted frame",
+            default=None
+    )
+    parser.add_argument(
+            "--profile",
+            action="store_true",
+            help="Print the time spent in the stages of the conversion (of the main process)",
             default=False
     )
+    parser.add_argument(
+            "--profile-trace",
+            type=str,
+            help="Also save the profile and its timeline as JSON (chrome://tracing), implies --profile",
+            default=None
+    )
     parser.add_argument(
             "--debug",
             dest="is_debug",
@@ -96,16 +258,10 @@ def parse_args() -> argparse.Namespace:
             default=False
     )
     args = parser.parse_args()
+    if args.skip_static is not None and args.output != "frames":
+        parser.error("--skip-static works only with --output frames")
     return args
 
 
-def make_empty_folder(path: str, is_debug: bool) -> None:
-    if not os.path.exists(path):
-        os.makedirs(path)
-    elif is_debug:
-        shutil.rmtree(path)
-        os.makedirs(path)
-
-
 if __name__ == "__main__":
     main()
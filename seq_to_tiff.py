@@ -10,74 +10,212 @@ where the minimum value is 473.15 (200 degrees Celsius) and the maximum value is
 Then we record in Celsius with noise clipping,
 where the minimum value is 0 (Celsius) and the maximum value is 500 (Celsius)
 """
+import io
 import os
-import shutil
 import argparse
 import numpy as np
-import tifffile as tiff
 
-from tqdm import tqdm
+from typing import Tuple
+from typing import Optional
 
+from fe_tools import profiling
 from fe_tools.seq import Seq
-from fe_tools.fff_tools import get_thermal_image
+from fe_tools.sinks import TiffStackSink
+from fe_tools.files import make_empty_folder
+from fe_tools.manifest import Manifest
+from fe_tools.pipeline import Pipeline
+from fe_tools.encoding import ENCODINGS
+from fe_tools.encoding import get_encoding
+from fe_tools.change import skip_static_frames
+from fe_tools.encoding import TemperatureEncoding
+from fe_tools.units import UNITS
+from fe_tools.units import get_is_celsius
+from fe_tools.units import get_unit_is_celsius
+from fe_tools.parallel import add_decode_stages
+
+
+# Threads encoding and writing the frames
+ENCODE_WORKERS = 2
+WRITE_WORKERS = 2
 
 
 def main():
     args = parse_args()
-    seq2tiff(args.input_file, args.min_thr, args.max_thr, args.is_celsius, args.is_debug)
+    if args.profile or args.profile_trace is not None:
+        profiling.enable(is_trace=args.profile_trace is not None)
+    seq2tiff(
+            args.input_file, args.min_thr, args.max_thr, get_unit_is_celsius(args.unit, args.is_celsius), args.is_debug,
+            args.save_fff, args.workers, args.output, args.compression, args.tile, args.skip_static, args.encoding
+    )
+    profiling.save_profile(args.profile_trace)
 
 
-def seq2tiff(seq_path: str, min_thr: float, max_thr: float, is_celsius: bool, is_debug: bool) -> None:
+def seq2tiff(
+        seq_path: str,
+        min_thr: float,
+        max_thr: float,
+        is_celsius: Optional[bool],
+        is_debug: bool,
+        save_fff: bool = False,
+        workers: int = 1,
+        output: str = "frames",
+        compression: str = None,
+        tile: Tuple[int, int] = None,
+        skip_static: float = None,
+        encoding: str = "float64",
+) -> None:
     """
-    Saves frames from a .seq file into .tiff files
+    Saves frames from a .seq file into .tiff files, or into one multi-page BigTIFF file.
+    Frames go through the decode, encode and write stages of a pipeline.
+    A .tiff per frame is converted only once for the same thresholds, see fe_tools.manifest
     :param seq_path: path to .seq file
     :param min_thr: min temperature threshold of capturing
     :param max_thr: max temperature threshold of capturing
-    :param is_celsius: if temperature in .seq file is in celsius
+    :param is_celsius: if temperature in .seq file is in celsius, None to detect it from the first frame
     :param is_debug: create new folders for debug
+    :param save_fff: also export the frames as .fff files
+    :param workers: number of processes decoding and encoding the frames
+    :param output: "frames" for a .tiff per frame, "stack" for a page per frame in `<folder>/<name>.tiff`
+    :param compression: compression of the stack pages, see TiffStackSink
+    :param tile: (height, width) of the tiles of the stack pages
+    :param skip_static: skip the frames that changed less than this number of raw counts since the last converted one,
+    see fe_tools.change, only for a .tiff per frame
+    :param encoding: type of the saved temperatures, see fe_tools.encoding
     :return:
     """
+    from tqdm import tqdm
+
+    if skip_static is not None and output != "frames":
+        raise ValueError("Static frames can be skipped only for the frames output")
     folder = seq_path.split(".")[0]
     file_basename = os.path.basename(folder)
     make_empty_folder(folder, is_debug)
-    make_empty_folder(f"{folder}/fff_frames", is_debug)
-    make_empty_folder(f"{folder}/tiff_frames", is_debug)
+    if save_fff:
+        make_empty_folder(f"{folder}/fff_frames", is_debug)
+    if output == "frames":
+        make_empty_folder(f"{folder}/tiff_frames", is_debug)
 
-    seq_iterator = Seq(seq_path)
-    fff_exists = len(os.listdir(f"{folder}/fff_frames")) == len(seq_iterator)
+    seq_iterator = Seq(seq_path, use_mmap=True)
     print(f"Extracting TIFF from {seq_path}...")
-    for frame_id, frame_bytes in enumerate(tqdm(seq_iterator)):
+    is_celsius = get_is_celsius(seq_iterator, min_thr, max_thr, is_celsius)
+    tiff_encoding = get_tiff_encoding(encoding, min_thr, max_thr, is_celsius)
+    # float16 doesn't need float64 temperatures, float32 ones would round twice
+    decode_dtype = np.float32 if encoding == "float16" else np.float64
+    manifest = None
+    frame_ids = range(len(seq_iterator))
+    if output == "frames":
+        # Convert only the frames that are not converted yet with the same parameters
+        manifest_params = {"min_thr": min_thr, "max_thr": max_thr, "is_celsius": is_celsius, "save_fff": save_fff}
+        if skip_static is not None:
+            manifest_params["skip_static"] = skip_static
+        if encoding != "float64":
+            manifest_params["encoding"] = tiff_encoding.as_dict()
+        manifest = Manifest(f"{folder}/tiff_manifest.json", manifest_params)
+        frame_ids = manifest.get_todo(seq_iterator)
+        print(f"{len(seq_iterator) - len(frame_ids)} of {len(seq_iterator)} frames are up to date")
+        if skip_static is not None:
+            frame_ids = skip_static_frames(
+                    seq_iterator, frame_ids, skip_static, f"{folder}/tiff_frame_map.json", manifest
+            )
+    pipeline = Pipeline((frame_id, seq_iterator.pos[frame_id], None) for frame_id in frame_ids)
+    sink = None
+    if output == "stack":
+        # Pages are appended in the frame order, so one thread per stage
+        sink = TiffStackSink(
+                f"{folder}/{file_basename}.tiff", len(seq_iterator), compression, tile, dtype=tiff_encoding.dtype,
+                attrs=tiff_encoding.as_dict() if tiff_encoding.is_fixed_point else None
+        )
+        add_decode_stages(
+                pipeline, seq_path, is_celsius, decode_dtype, workers, "clip", clip_thermal,
+                (min_thr, max_thr, is_celsius, tiff_encoding)
+        )
+        pipeline.add_stage("write", sink.write, pass_frame_id=True)
+    else:
+        add_decode_stages(
+                pipeline, seq_path, is_celsius, decode_dtype, workers, "encode", thermal2tiff,
+                (min_thr, max_thr, is_celsius, tiff_encoding), ENCODE_WORKERS
+        )
+        pipeline.add_stage("write", write_tiff, (folder, file_basename), WRITE_WORKERS, pass_frame_id=True)
+    for frame_id, output_path, error in tqdm(pipeline.run(), total=len(frame_ids)):
         fff_path = f"{folder}/fff_frames/{frame_id:04d}.fff"
-        if not fff_exists:
-            # Write frame to .fff file
+        if save_fff:
+            # Export frame to .fff file
             with open(fff_path, "wb") as fff_file:
-                fff_file.write(frame_bytes)
-
-        # Get thermal image from .fff file
-        try:
-            thermal_image = get_thermal_image(fff_path, is_celsius=is_celsius)
-            if frame_id == 0:
-                ans = input(f"Temperature range is {np.min(thermal_image):.1f} - {np.max(thermal_image):.1f}. "
-                            f"Do you want to change the unit of measurement? "
-                            f"(current: {'celsius' if is_celsius else 'kelvin'})? [y/n]")
-                if ans == "y":
-                    is_celsius = not is_celsius
-                    thermal_image = get_thermal_image(fff_path, is_celsius=is_celsius)
-        except Exception as e:
-            print(f"Error: {e}")
-            continue
-
-        # Save thermal frame as .tiff
-        tiff_path = f"{folder}/tiff_frames/{file_basename}_{frame_id:04d}.tiff"
-        # Trimming noises
-        if not is_celsius:
-            tiff_img = np.clip(thermal_image, min_thr + 273.15, max_thr + 273.15)
-        else:
-            tiff_img = np.clip(thermal_image, min_thr, max_thr)
-        tiff.imwrite(tiff_path, tiff_img, photometric="minisblack")
-
-    # Remove all .fff files
-    # shutil.rmtree(f"{folder}/fff_frames")
+                fff_file.write(seq_iterator[frame_id])
+
+        if error is not None:
+            print(f"Error: {error}")
+        elif manifest is not None:
+            outputs = [output_path, fff_path] if save_fff else [output_path]
+            manifest.add(frame_id, seq_iterator.pos[frame_id], seq_iterator[frame_id], outputs)
+    if sink is not None:
+        sink.close()
+    if manifest is not None:
+        manifest.save()
+    print(pipeline.report())
+
+
+@profiling.timed("encode.tiff")
+def thermal2tiff(
+        thermal_image: np.ndarray,
+        min_thr: float,
+        max_thr: float,
+        is_celsius: bool,
+        encoding: TemperatureEncoding = None,
+) -> bytes:
+    """
+    Encodes temperatures clipped to the thresholds as .tiff
+    :param thermal_image: temperatures
+    :param min_thr: min temperature threshold of capturing
+    :param max_thr: max temperature threshold of capturing
+    :param is_celsius: if temperature in .seq file is in celsius
+    :param encoding: type of the saved temperatures, float64 by default
+    :return: encoded .tiff image
+    """
+    import tifffile as tiff
+
+    tiff_buffer = io.BytesIO()
+    tiff_image = clip_thermal(thermal_image, min_thr, max_thr, is_celsius, encoding)
+    if encoding is not None and encoding.is_fixed_point:
+        # Scale and offset of the codes go to the shaped metadata: tifffile.TiffFile(path).shaped_metadata
+        tiff.imwrite(tiff_buffer, tiff_image, photometric="minisblack", metadata=encoding.as_dict())
+    else:
+        tiff.imwrite(tiff_buffer, tiff_image, photometric="minisblack")
+    return tiff_buffer.getvalue()
+
+
+def clip_thermal(
+        thermal_image: np.ndarray,
+        min_thr: float,
+        max_thr: float,
+        is_celsius: bool,
+        encoding: TemperatureEncoding = None,
+) -> np.ndarray:
+    """
+    Trimming noises: clip the temperatures to the thresholds (in Celsius) in the unit of the .seq file,
+    then encode them if the encoding is given
+    """
+    if not is_celsius:
+        thermal_image = np.clip(thermal_image, min_thr + 273.15, max_thr + 273.15)
+    else:
+        thermal_image = np.clip(thermal_image, min_thr, max_thr)
+    return encoding.encode(thermal_image) if encoding is not None else thermal_image
+
+
+def get_tiff_encoding(encoding: str, min_thr: float, max_thr: float, is_celsius: bool) -> TemperatureEncoding:
+    """ Encoding of the temperatures clipped to the thresholds (in Celsius) in the unit of the .seq file """
+    shift = 0.0 if is_celsius else 273.15
+    return get_encoding(encoding, min_thr + shift, max_thr + shift)
+
+
+@profiling.timed("write.tiff")
+def write_tiff(frame_id: int, tiff_bytes: bytes, folder: str, file_basename: str) -> str:
+    """ Save thermal frame as .tiff, returns its path """
+    profiling.count("bytes_written", len(tiff_bytes))
+    tiff_path = f"{folder}/tiff_frames/{file_basename}_{frame_id:04d}.tiff"
+    with open(tiff_path, "wb") as tiff_file:
+        tiff_file.write(tiff_bytes)
+    return tiff_path
 
 
 def parse_args() -> argparse.Namespace:
@@ -89,9 +227,74 @@ def parse_args() -> argparse.Namespace:
             "--celsius",
             dest="is_celsius",
             action="store_true",
-            help="Temperature in celsius in the .seq file",
+            help="Temperature in celsius in the .seq file (the same as --unit celsius)",
+            default=False
+    )
+    parser.add_argument(
+            "--unit",
+            choices=UNITS,
+            help="Unit of measurement of the .seq file, detected from the first frame by default",
+            default="auto"
+    )
+    parser.add_argument(
+            "--save-fff",
+            dest="save_fff",
+            action="store_true",
+            help="Also export the frames as .fff files",
+            default=False
+    )
+    parser.add_argument(
+            "--workers",
+            type=int,
+            help="Number of processes decoding the frames",
+            default=1
+    )
+    parser.add_argument(
+            "--output",
+            choices=["frames", "stack"],
+            help="A .tiff file per frame or one multi-page BigTIFF file for the sequence",
+            default="frames"
+    )
+    parser.add_argument(
+            "--compression",
+            type=str,
+            help="Compression of the multi-page BigTIFF pages, e.g. zlib",
+            default=None
+    )
+    parser.add_argument(
+            "--tile",
+            type=int,
+            nargs=2,
+            metavar=("HEIGHT", "WIDTH"),
+            help="Tile size of the multi-page BigTIFF pages, multiples of 16",
+            default=None
+    )
+    parser.add_argument(
+            "--encoding",
+            choices=list(ENCODINGS),
+            help="Type of the saved temperatures: float32 and float16 are smaller, "
+                 "uint16 is fixed point in 0.01 degree steps (coarser for ranges over 655 degrees)",
+            default="float64"
+    )
+    parser.add_argument(
+            "--skip-static",
+            type=float,
+            help="Skip the frames that changed less than this number of raw counts since the last converted one, "
+                 "`<name>/tiff_frame_map.json` maps every frame to its converted frame",
+            default=None
+    )
+    parser.add_argument(
+            "--profile",
+            action="store_true",
+            help="Print the time spent in the stages of the conversion (of the main process)",
             default=False
     )
+    parser.add_argument(
+            "--profile-trace",
+            type=str,
+            help="Also save the profile and its timeline as JSON (chrome://tracing), implies --profile",
+            default=None
+    )
     parser.add_argument(
             "--debug",
             dest="is_debug",
@@ -100,16 +303,10 @@ def parse_args() -> argparse.Namespace:
             default=False
     )
     args = parser.parse_args()
+    if args.skip_static is not None and args.output != "frames":
+        parser.error("--skip-static works only with --output frames")
     return args
 
 
-def make_empty_folder(path: str, is_debug: bool) -> None:
-    if not os.path.exists(path):
-        os.makedirs(path)
-    elif is_debug:
-        shutil.rmtree(path)
-        os.makedirs(path)
-
-
 if __name__ == "__main__":
     main()
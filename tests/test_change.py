@@ -0,0 +1,65 @@
+import os
+import pytest
+
+from fe_tools import change
+from fe_tools import synthetic
+from fe_tools.seq import Seq
+from fe_tools.manifest import Manifest
+
+
+FRAME_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bin", "examples", "frame.fff")
+N_FRAMES = 8
+# Above the shift and noise of the synthetic frames, only the first frame is kept
+THRESHOLD = 100000
+
+
+@pytest.fixture()
+def seq_path(tmp_path) -> str:
+    path = str(tmp_path / "synthetic.seq")
+    synthetic.make_seq(path, N_FRAMES, width=64, height=48, template_path=FRAME_PATH)
+    return path
+
+
+def convert(seq_path: str, tmp_path, monkeypatch) -> tuple:
+    """ Select the frames like the scripts do, returns (converted frame ids, number of compared frames) """
+    n_compared = [0]
+    is_changed = change.ChangeDetector.is_changed
+
+    def count_is_changed(detector, fff_bytes):
+        n_compared[0] += 1
+        return is_changed(detector, fff_bytes)
+
+    monkeypatch.setattr(change.ChangeDetector, "is_changed", count_is_changed)
+    with Seq(seq_path, use_mmap=True) as seq:
+        manifest = Manifest(str(tmp_path / "manifest.json"), {"skip_static": THRESHOLD})
+        frame_ids = change.skip_static_frames(
+                seq, manifest.get_todo(seq), THRESHOLD, str(tmp_path / "frame_map.json"), manifest
+        )
+        for frame_id in frame_ids:
+            output_path = str(tmp_path / f"{frame_id}.out")
+            open(output_path, "w").close()
+            manifest.add(frame_id, seq.pos[frame_id], seq[frame_id], [output_path])
+        manifest.save()
+    return frame_ids, n_compared[0]
+
+
+def test_rerun_compares_nothing(seq_path, tmp_path, monkeypatch):
+    assert convert(seq_path, tmp_path, monkeypatch) == ([0], N_FRAMES)
+    assert convert(seq_path, tmp_path, monkeypatch) == ([], 0)
+    assert list(change.load_frame_map(str(tmp_path / "frame_map.json"))) == [0] * N_FRAMES
+
+
+def test_resume_compares_new_frames(seq_path, tmp_path, monkeypatch):
+    convert(seq_path, tmp_path, monkeypatch)
+    manifest = Manifest(str(tmp_path / "manifest.json"), {"skip_static": THRESHOLD})
+    for frame_id in range(5, N_FRAMES):
+        del manifest.frames[frame_id]
+    manifest.save()
+    # The kept frame standing for frame 4 and the frames from 5 on
+    assert convert(seq_path, tmp_path, monkeypatch) == ([], 1 + N_FRAMES - 5)
+
+
+def test_lost_kept_frame(seq_path, tmp_path, monkeypatch):
+    convert(seq_path, tmp_path, monkeypatch)
+    os.remove(str(tmp_path / "0.out"))
+    assert convert(seq_path, tmp_path, monkeypatch) == ([0], N_FRAMES)
@@ -0,0 +1,91 @@
+import gc
+import io
+import os
+import pytest
+import numpy as np
+
+from fe_tools import fff_parser
+from fe_tools import fff_tools
+from fe_tools.exiftool import probe_exiftool
+
+
+FRAME_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bin", "examples", "frame.fff")
+
+
+@pytest.fixture(scope="module")
+def frame_bytes() -> bytes:
+    with open(FRAME_PATH, "rb") as frame_file:
+        return frame_file.read()
+
+
+def test_native_meta(frame_bytes):
+    meta = fff_parser.get_meta(frame_bytes)
+    assert meta["Emissivity"] == pytest.approx(0.95)
+    assert meta["PlanckR1"] == pytest.approx(35354.77)
+    assert meta["PlanckB"] == pytest.approx(1819.3)
+    assert meta["PlanckF"] == pytest.approx(1.0)
+    assert meta["PlanckO"] == -8320
+    assert meta["PlanckR2"] == pytest.approx(1.0134372)
+
+
+def test_native_raw_image(frame_bytes):
+    raw_image = fff_parser.get_raw_image_np(frame_bytes)
+    assert raw_image.shape == (480, 640)
+    assert raw_image.dtype == np.uint16
+    assert raw_image.min() == 8101
+    assert raw_image.max() == 11527
+
+
+def test_raw_image_shape_mismatch(frame_bytes):
+    # Not an FFFError, so it doesn't fall back to exiftool
+    with pytest.raises(ValueError, match="expected") as error:
+        fff_parser.get_raw_image_np(frame_bytes, out=np.empty((48, 64), dtype=np.uint16))
+    assert not isinstance(error.value, fff_parser.FFFError)
+
+
+def test_file_like_fallback(frame_bytes, monkeypatch):
+    """ exiftool gets the whole content of a file-like object the native parser failed on """
+    def fail_native(fff_bytes):
+        raise fff_parser.FFFError("Unsupported FFF version")
+
+    def run_exiftool(fff_img_filename, args):
+        exiftool_inputs.append(bytes(fff_tools._read_fff(fff_img_filename)))
+        return b'[{}]'
+
+    exiftool_inputs = []
+    monkeypatch.setattr(fff_parser, "get_meta", fail_native)
+    monkeypatch.setattr(fff_tools, "_run_exiftool", run_exiftool)
+    assert fff_tools.get_meta(io.BytesIO(frame_bytes)) == {}
+    assert exiftool_inputs == [frame_bytes]
+
+
+def test_calibration_interning(frame_bytes):
+    calibration = fff_tools.get_calibration(frame_bytes)
+    assert fff_tools.Calibration.intern(*calibration) is calibration
+    n_interned = len(fff_tools.Calibration._interned)
+    for r_temp in range(100):
+        fff_tools.Calibration.intern(*calibration.as_tuple()[:-1], r_temp + 0.5)
+    gc.collect()
+    # Calibrations no longer used are dropped
+    assert len(fff_tools.Calibration._interned) == n_interned
+
+
+def test_lut_cache_dir(frame_bytes, tmp_path, monkeypatch):
+    calibration = fff_tools.get_calibration(frame_bytes)
+    monkeypatch.setattr(fff_tools, "LUT_CACHE_DIR", str(tmp_path))
+    fff_tools.clear_lut_cache()
+    lut = fff_tools.get_temperature_lut(*calibration)
+    lut_paths = list(tmp_path.glob("lut_*.npy"))
+    assert len(lut_paths) == 1
+    fff_tools.clear_lut_cache()
+    np.testing.assert_array_equal(fff_tools.get_temperature_lut(*calibration), lut)
+    # The cache dir can't be created under a file, the table is still built
+    monkeypatch.setattr(fff_tools, "LUT_CACHE_DIR", str(lut_paths[0] / "lut"))
+    fff_tools.clear_lut_cache()
+    np.testing.assert_array_equal(fff_tools.get_temperature_lut(*calibration), lut)
+    fff_tools.clear_lut_cache()
+
+
+@pytest.mark.skipif(probe_exiftool() is None, reason="exiftool is not installed")
+def test_exiftool_parity():
+    assert fff_tools.check_parity(FRAME_PATH)
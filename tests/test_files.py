@@ -0,0 +1,27 @@
+import os
+import pytest
+
+from fe_tools.files import atomic_write
+
+
+def test_atomic_write(tmp_path):
+    path = str(tmp_path / "data.json")
+    with atomic_write(path) as data_file:
+        data_file.write("new")
+    with open(path) as data_file:
+        assert data_file.read() == "new"
+    assert os.listdir(tmp_path) == ["data.json"]
+
+
+def test_atomic_write_error(tmp_path):
+    path = str(tmp_path / "data.json")
+    with open(path, "w") as data_file:
+        data_file.write("old")
+    with pytest.raises(RuntimeError):
+        with atomic_write(path) as data_file:
+            data_file.write("partial")
+            raise RuntimeError("Interrupted")
+    # The file is untouched and the temporary file removed
+    with open(path) as data_file:
+        assert data_file.read() == "old"
+    assert os.listdir(tmp_path) == ["data.json"]
@@ -0,0 +1,50 @@
+import os
+
+import pytest
+
+from fe_tools.pipeline import Pipeline
+
+
+def _exit_on_three(value: int) -> int:
+    if value == 3:
+        # A worker killed e.g. by the OOM killer
+        os._exit(1)
+    return value
+
+
+def _double(value: int) -> int:
+    return value * 2
+
+
+def _fail_after_two():
+    yield 0, 0, None
+    yield 1, 1, None
+    raise OSError("Can't read the source")
+
+
+def test_thread_stages():
+    pipeline = Pipeline((frame_id, frame_id, None) for frame_id in range(20))
+    pipeline.add_stage("double", _double, workers=3)
+    items = sorted(pipeline.run())
+    assert items == [(frame_id, frame_id * 2, None) for frame_id in range(20)]
+
+
+def test_killed_worker():
+    pipeline = Pipeline(((frame_id, frame_id, None) for frame_id in range(10)), queue_size=2)
+    pipeline.add_stage("exit", _exit_on_three, workers=2, use_processes=True)
+    pipeline.add_stage("double", _double)
+    items = list(pipeline.run())
+    assert [frame_id for frame_id, _, _ in items] == list(range(10))
+    # The items in flight when the worker died fail as well
+    assert items[3][1] is None and items[3][2] is not None
+    assert all(value == frame_id * 2 for frame_id, value, error in items if error is None)
+
+
+def test_source_error():
+    pipeline = Pipeline(_fail_after_two())
+    pipeline.add_stage("double", _double, workers=2)
+    items = []
+    with pytest.raises(OSError, match="Can't read the source"):
+        for item in pipeline.run():
+            items.append(item)
+    assert sorted(items) == [(0, 0, None), (1, 2, None)]
@@ -0,0 +1,78 @@
+import os
+import struct
+import pytest
+import numpy as np
+
+from fe_tools import synthetic
+from fe_tools import fff_tools
+from fe_tools.seq import Seq
+
+
+FRAME_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bin", "examples", "frame.fff")
+N_FRAMES = 5
+
+
+@pytest.fixture()
+def seq_path(tmp_path) -> str:
+    path = str(tmp_path / "synthetic.seq")
+    synthetic.make_seq(path, N_FRAMES, width=64, height=48, template_path=FRAME_PATH)
+    return path
+
+
+def read_frames(path: str) -> list:
+    with Seq(path) as seq:
+        return [bytes(frame_bytes) for frame_bytes in seq]
+
+
+def corrupt_frame(path: str, frame_id: int, field_offset: int, value: int) -> None:
+    """ Overwrite a 32-bit field of the FFF header of the frame, the magic bytes stay in place """
+    with Seq(path) as seq:
+        offset, _ = seq.pos[frame_id]
+    with open(path, "r+b") as seq_file:
+        seq_file.seek(offset + field_offset)
+        seq_file.write(struct.pack("<I", value))
+
+
+@pytest.mark.parametrize("use_mmap", [False, True])
+@pytest.mark.parametrize("field_offset, value", [(0x14, 0), (0x1C, 0xFFFF)], ids=["version", "record_directory"])
+def test_corrupt_middle_frame(seq_path, use_mmap, field_offset, value):
+    frames = read_frames(seq_path)
+    corrupt_frame(seq_path, 2, field_offset, value)
+    with Seq(seq_path, use_mmap=use_mmap) as seq:
+        assert len(seq) == N_FRAMES - 1
+        assert [bytes(frame_bytes) for frame_bytes in seq] == frames[:2] + frames[3:]
+
+
+def test_index_round_trip(seq_path):
+    with Seq(seq_path, use_mmap=True, use_index=True) as seq:
+        assert len(seq) == N_FRAMES
+        pos = list(seq.pos)
+    assert os.path.isfile(f"{seq_path}.idx")
+    with Seq(seq_path, use_mmap=True, use_index=True) as seq:
+        assert seq.pos == pos
+
+
+def test_index_file(seq_path, tmp_path):
+    index_path = str(tmp_path / "outputs.idx")
+    with Seq(seq_path, use_mmap=True, use_index=True, index_file=index_path) as seq:
+        assert len(seq) == N_FRAMES
+    assert os.path.isfile(index_path)
+    assert not os.path.exists(f"{seq_path}.idx")
+
+
+def test_index_not_writable(seq_path, tmp_path, monkeypatch):
+    index_path = str(tmp_path / "missing_dir" / "synthetic.seq.idx")
+    monkeypatch.setattr(Seq, "index_file", property(lambda self: index_path))
+    with Seq(seq_path, use_mmap=True, use_index=True) as seq:
+        assert len(seq) == N_FRAMES
+        assert not seq.save_index()
+    assert not os.path.exists(os.path.dirname(index_path))
+
+
+def test_thermal_stack(seq_path):
+    with Seq(seq_path, use_mmap=True) as seq:
+        thermal_stack = seq.get_thermal_stack(slice(1, 4))
+        expected = [fff_tools.get_thermal_image(bytes(seq[frame_id])) for frame_id in range(1, 4)]
+        np.testing.assert_allclose(thermal_stack, np.stack(expected))
+        calibrations = seq.get_calibrations(slice(1, 4))
+        np.testing.assert_array_equal(calibrations[0], fff_tools.get_calibration(seq[1]).as_tuple())